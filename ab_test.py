@@ -0,0 +1,217 @@
+"""Single-pass comparison of any number of cube-cell groups, with bootstrap significance.
+
+A group is ``(dim, values)``: the cells whose ``dim`` is one of ``values``
+(a single value or a list).  There may be any number of groups and they may
+overlap.  :func:`compare` finds every group's cells with one code lookup per
+group and stacks them (a cell in two groups appears twice, tagged with each
+group), so each figure of the comparison is one partitioned group-by of the
+stack, keyed by ``group * n_keys + key``, rather than one filter and one
+group-by per group and figure:
+
+* total sales, distinct orders and average order value;
+* the leading category, sub-category and state;
+* monthly sales, and sales and distinct orders per category.
+
+:func:`significance` tests every group against the first with a bootstrap.
+The cube keeps no per-order rows, so the resampling unit is the cell (a
+cluster of order lines): each group's cells are pooled into at most
+``BOOTSTRAP_UNITS`` random clusters, and ``BOOTSTRAP_SAMPLES`` resamples of
+them are drawn as index matrices, a block of resamples at a time, so a
+test costs about the same at any data size.  Groups are resampled independently, which
+ignores the overlap of overlapping groups.
+"""
+import numpy as np
+import pandas as pd
+
+import parallel
+from cube import DISTINCT_COLS
+
+BOOTSTRAP_SAMPLES = 2000
+BOOTSTRAP_UNITS   = 1000
+CONFIDENCE        = 0.95
+SEED              = 0
+
+# Headline figures :func:`significance` tests.
+TESTED = ('total', 'orders', 'avg_ord')
+
+_BLOCK = 250   # resamples drawn at once
+_NONE  = '—'
+
+
+def values_of(group):
+    _, values = group
+    return list(values) if isinstance(values, (list, tuple, set)) else [values]
+
+
+def label(group):
+    """A group's display label: its value, or its values joined with " + "."""
+    values = values_of(group)
+    return values[0] if len(values) == 1 else ' + '.join(map(str, values))
+
+
+def members(cells, groups):
+    """``(len(groups), len(cells))`` booleans: which cells each group holds."""
+    out = np.zeros((len(groups), len(cells)), dtype=bool)
+    for i, group in enumerate(groups):
+        col = cells[group[0]]
+        if not isinstance(col.dtype, pd.CategoricalDtype):
+            out[i] = col.isin(values_of(group)).to_numpy()
+            continue
+        # One slot per category plus a last, never-set one for missing (-1).
+        table = np.zeros(len(col.cat.categories) + 1, dtype=bool)
+        hit = col.cat.categories.get_indexer(values_of(group))
+        table[hit[hit >= 0]] = True
+        out[i] = table[col.cat.codes.to_numpy()]
+    return out
+
+
+class _Stack:
+    """The groups' cells stacked: ``pos`` (cell positions) tagged with ``group``."""
+
+    def __init__(self, cube, cells, groups, mode):
+        self.cube, self.cells, self.mode = cube, cells, mode or cube.distinct_mode
+        self.n = len(groups)
+        self.group, self.pos = np.nonzero(members(cells, groups))
+        self.sales = cells['Sales'].to_numpy()[self.pos]
+
+    def keyed(self, dim):
+        """``(key, keys)``: each stacked cell's ``group * len(keys) + dim`` key."""
+        col = self.cells[dim]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # Cube dimensions are categorical: their codes are the keys.
+            codes = col.cat.codes.to_numpy(dtype=np.int64)[self.pos]
+            keys  = pd.CategoricalIndex(pd.Categorical.from_codes(np.arange(len(col.cat.categories)),
+                                                                  dtype=col.dtype), name=dim)
+        else:
+            codes, keys = parallel.group_index(self.cells, dim)
+            codes = codes[self.pos]
+        return np.where(codes >= 0, self.group * len(keys) + codes, -1), keys
+
+    def sums(self, key, n_keys):
+        """Sales and presence per (group, key), as ``(n, n_keys)`` matrices."""
+        size = self.n * n_keys
+        sums = parallel.group_sum(key, size, self.sales).reshape(self.n, n_keys)
+        seen = np.bincount(key[key >= 0], minlength=size).reshape(self.n, n_keys) > 0
+        return sums, seen
+
+    def orders(self, groupings):
+        """Distinct orders per (group, key) as ``(n, n_keys)``, for each ``(key, n_keys, by)``.
+
+        Groupings that per-cell counts cannot answer share one gather of
+        the stack's order IDs.
+        """
+        out, merged = [None] * len(groupings), []
+        for i, (key, n_keys, by) in enumerate(groupings):
+            if self.cube.is_exact('Order ID', by):
+                per_cell = self.cells[DISTINCT_COLS['Order ID']].to_numpy()[self.pos]
+                out[i] = parallel.group_sum(key, self.n * n_keys, per_cell).reshape(self.n, n_keys)
+            else:
+                merged.append(i)
+        if merged:
+            rows   = self.cells.index.to_numpy()[self.pos]
+            counts = self.cube.counters['Order ID'].count_each(
+                rows, [(groupings[i][0], self.n * groupings[i][1]) for i in merged], self.mode)
+            for i, c in zip(merged, counts):
+                out[i] = c.reshape(self.n, groupings[i][1])
+        return out
+
+
+def _top(keys, sums, seen):
+    best = np.where(seen, sums, -np.inf).argmax(axis=1)
+    return [keys[b] if seen[i].any() else _NONE for i, b in enumerate(best)]
+
+
+def compare(cube, cells, groups, mode=None):
+    """Every group's figures, from one stack of their cells.
+
+    Returns ``{'stats', 'monthly', 'category'}``, each a list with one entry
+    per group: the headline dict (``total``, ``orders``, ``avg_ord``,
+    ``top_cat``, ``top_sub``, ``top_st``), the Month / Sales frame and the
+    Category / Sales / Order Count / Group frame.  ``cells`` must be a
+    selection of ``cube.cells``.
+    """
+    stack = _Stack(cube, cells, groups, mode)
+    totals = parallel.group_sum(stack.group, stack.n, stack.sales)
+    cat_key, categories = stack.keyed('Category')
+    cat_sales, cat_seen = stack.sums(cat_key, len(categories))
+    orders, cat_orders  = stack.orders([(stack.group, 1, ()), (cat_key, len(categories), ['Category'])])
+    orders = orders.ravel()
+    tops = {'top_cat': _top(categories, cat_sales, cat_seen)}
+    for name, dim in (('top_sub', 'Sub-Category'), ('top_st', 'State')):
+        key, keys = stack.keyed(dim)
+        tops[name] = _top(keys, *stack.sums(key, len(keys)))
+
+    month_key, months = stack.keyed('Month')
+    month_sales, month_seen = stack.sums(month_key, len(months))
+
+    stats, monthly, category = [], [], []
+    for i, group in enumerate(groups):
+        total, n_orders = totals[i], int(orders[i])
+        stats.append(dict(total=total, orders=n_orders, avg_ord=total / n_orders if n_orders else 0,
+                          **{name: top[i] for name, top in tops.items()}))
+        monthly.append(pd.DataFrame({'Month': months[month_seen[i]],
+                                     'Sales': month_sales[i, month_seen[i]]}))
+        category.append(pd.DataFrame({'Category':    categories[cat_seen[i]],
+                                      'Sales':       cat_sales[i, cat_seen[i]],
+                                      'Order Count': cat_orders[i, cat_seen[i]],
+                                      'Group':       label(group)}))
+    return {'stats': stats, 'monthly': monthly, 'category': category}
+
+
+# ── significance ─────────────────────────────────────────────────────────────
+def _clusters(units, k, rng):
+    """The rows of ``units`` summed into at most ``k`` random, equal-share clusters."""
+    if len(units) <= k:
+        return units
+    which = rng.permutation(len(units)) % k
+    return np.stack([np.bincount(which, weights=col, minlength=k) for col in units.T], axis=1)
+
+
+def _resample(units, samples, rng):
+    """Column totals of ``samples`` bootstrap resamples of the rows of ``units``."""
+    out = np.zeros((samples, units.shape[1]))
+    if not len(units):
+        return out
+    for start in range(0, samples, _BLOCK):
+        idx = rng.integers(0, len(units), (min(_BLOCK, samples - start), len(units)))
+        out[start:start + len(idx)] = np.stack([col[idx].sum(axis=1) for col in units.T], axis=1)
+    return out
+
+
+def significance(cells, groups, stats, samples=BOOTSTRAP_SAMPLES, units=BOOTSTRAP_UNITS,
+                 confidence=CONFIDENCE, seed=SEED):
+    """Bootstrap test of every group against the first, per ``TESTED`` figure.
+
+    ``stats`` are :func:`compare`'s headline dicts for the same groups.
+    Returns one entry per group (None for the first): ``{figure: {'diff',
+    'low', 'high', 'p_value'}}``, where ``diff`` is the group's figure minus
+    the first group's, ``low`` / ``high`` its bootstrap ``confidence``
+    interval and ``p_value`` the two-sided bootstrap p-value of no
+    difference.  Results are reproducible for a given ``seed``.
+    """
+    rng = np.random.default_rng(seed)
+    member = members(cells, groups)
+    per_cell = cells[['Sales', DISTINCT_COLS['Order ID']]].to_numpy(dtype=np.float64)
+    draws = []
+    for i, s in enumerate(stats):
+        boot = _resample(_clusters(per_cell[member[i]], units, rng), samples, rng)
+        # Per-cell order counts double-count orders spanning cells; scale the
+        # resampled counts so they centre on the group's distinct count.
+        summed = per_cell[member[i], 1].sum()
+        orders = boot[:, 1] * (s['orders'] / summed if summed else 0)
+        avg = np.divide(boot[:, 0], orders, out=np.zeros(samples), where=orders > 0)
+        draws.append({'total': boot[:, 0], 'orders': orders, 'avg_ord': avg})
+
+    tail = (1 - confidence) / 2
+    out = [None]
+    for i in range(1, len(stats)):
+        tests = {}
+        for name in TESTED:
+            diff = draws[i][name] - draws[0][name]
+            below = np.count_nonzero(diff <= 0)
+            above = np.count_nonzero(diff >= 0)
+            low, high = np.quantile(diff, [tail, 1 - tail])
+            tests[name] = {'diff': stats[i][name] - stats[0][name], 'low': float(low), 'high': float(high),
+                           'p_value': min(1.0, 2 * (min(below, above) + 1) / (samples + 1))}
+        out.append(tests)
+    return out
@@ -151,30 +151,41 @@ _stc.html("""
 """, height=0)
 
 # ── State Mapping ─────────────────────────────────────────────────────────────
-us_state_to_abbrev = {
-    "Alabama":"AL","Alaska":"AK","Arizona":"AZ","Arkansas":"AR","California":"CA",
-    "Colorado":"CO","Connecticut":"CT","Delaware":"DE","Florida":"FL","Georgia":"GA",
-    "Hawaii":"HI","Idaho":"ID","Illinois":"IL","Indiana":"IN","Iowa":"IA",
-    "Kansas":"KS","Kentucky":"KY","Louisiana":"LA","Maine":"ME","Maryland":"MD",
-    "Massachusetts":"MA","Michigan":"MI","Minnesota":"MN","Mississippi":"MS","Missouri":"MO",
-    "Montana":"MT","Nebraska":"NE","Nevada":"NV","New Hampshire":"NH","New Jersey":"NJ",
-    "New Mexico":"NM","New York":"NY","North Carolina":"NC","North Dakota":"ND","Ohio":"OH",
-    "Oklahoma":"OK","Oregon":"OR","Pennsylvania":"PA","Rhode Island":"RI","South Carolina":"SC",
-    "South Dakota":"SD","Tennessee":"TN","Texas":"TX","Utah":"UT","Vermont":"VT",
-    "Virginia":"VA","Washington":"WA","West Virginia":"WV","Wisconsin":"WI","Wyoming":"WY"
-}
-abbrev_to_state = {v: k for k, v in us_state_to_abbrev.items()}
-
-@st.cache_data
-def load_data():
-    df = pd.read_csv('cleaned_train.csv')
-    df['State Code'] = df['State'].map(us_state_to_abbrev)
-    df['Order Date'] = pd.to_datetime(df['Order Date'])
-    df['Year']  = df['Order Date'].dt.year
-    df['Month'] = df['Order Date'].dt.to_period('M').astype(str)
-    return df
-
-df = load_data()
+from datastore import abbrev_to_state
+import datastore
+from query import QueryEngine, FORECAST_DIMS, GRAINS, INTERVALS, CITY_SORTS, CITY_PAGE_ROWS, load_cube
+from section_cache import canonical_key
+import ab_test
+import fragments
+import map_figure
+import profiling
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Sampled per-section timings and allocations (see profiling.py), shown in
+# the sidebar's "Profiling" panel.
+_prof = profiling.profiler.rerun(session=getattr(get_script_run_ctx(), 'session_id', None),
+                                 force=st.session_state.get('profile_session', False),
+                                 memory=st.session_state.get('profile_memory') or None)
+
+# All numbers come from the query engine (see query.py), which answers from
+# the sales cube built off the columnar store (see datastore.py); the CSV is
+# only parsed again when its contents change.  A cube published by
+# `python query.py publish` is attached (memory-mapped, shared between
+# processes) instead of built.  cache_resource hands every session the same
+# engine, and so the same section cache.
+@st.cache_resource(max_entries=1)
+def load_engine(source_fingerprint):
+    cube, report = load_cube(datastore.SOURCE_CSV)
+    return QueryEngine(cube, maxsize=512), report
+
+_source_fp = datastore.source_fingerprint(datastore.SOURCE_CSV)
+engine, _load_report = load_engine(_source_fp)
+# Orders appended with `python datastore.py append <delta.csv>` are folded
+# into the cube here; a rerun with nothing new costs one manifest read.
+engine.refresh(datastore.read_segments)
+sales_cube = engine.cube
+
+_prof.mark('load', rows=len(sales_cube.cells))
 
 # ── Session state init ────────────────────────────────────────────────────────
 defaults = {
@@ -191,6 +202,22 @@ for k, v in defaults.items():
     if k not in st.session_state:
         st.session_state[k] = v
 
+# ── OPERATOR SETTINGS ─────────────────────────────────────────────────────────
+with st.sidebar:
+    st.subheader("⚙️ Operator settings")
+    _distinct_mode = st.radio(
+        "Distinct order / customer counts", ['exact', 'hll'], key='distinct_mode',
+        format_func=lambda m: {'exact': 'Exact', 'hll': 'Approximate (HyperLogLog, ±3%)'}[m],
+    )
+    if _load_report and 'attached' in _load_report:
+        st.caption(f"Shared cube (generation {_load_report['attached']}) attached read-only "
+                   f"in {_load_report['attach_ms']:,.0f} ms")
+    elif _load_report:
+        _ingest = (f"{_load_report['chunks']} chunks, peak {_load_report['peak_bytes'] / 2**20:,.1f} MB; "
+                   if 'chunks' in _load_report else '')
+        st.caption(f"Chunked ingest (budget {datastore.MEMORY_BUDGET_MB:g} MB): {_ingest}"
+                   f"cube build peak {_load_report['cube_peak_bytes'] / 2**20:,.1f} MB")
+
 # ── TITLE ─────────────────────────────────────────────────────────────────────
 st.title("🗺️ Regional Sales Intelligence")
 st.caption("Select filters to update all charts instantly. Click a state on the map to drill down.")
@@ -198,9 +225,9 @@ st.caption("Select filters to update all charts instantly. Click a state on the
 # ── STICKY FILTER BAR ─────────────────────────────────────────────────────────
 st.markdown('<div class="sticky-filter-wrap"><div class="filter-bar"><div class="filter-title">🧭 &nbsp;Dashboard Filters</div>', unsafe_allow_html=True)
 
-category_opts = sorted(df['Category'].unique().tolist())
-segment_opts  = sorted(df['Segment'].unique().tolist())
-year_opts     = sorted(df['Year'].unique().tolist())
+category_opts = sales_cube.cells['Category'].cat.categories.tolist()
+segment_opts  = sales_cube.cells['Segment'].cat.categories.tolist()
+year_opts     = sorted(sales_cube.cells['Year'].unique().tolist())
 
 fc1, fc2, fc3 = st.columns(3)
 with fc1:
@@ -214,16 +241,8 @@ st.session_state.sel_category = list(sel_category)
 st.session_state.sel_segment  = list(sel_segment)
 st.session_state.sel_year     = list(sel_year)
 
-pills_html = '<div class="active-pills">'
-cs = st.session_state.clicked_state
-for v in sel_category: pills_html += f'<div class="pill">📦 {v}</div>'
-for v in sel_segment:  pills_html += f'<div class="pill">👥 {v}</div>'
-for v in sel_year:     pills_html += f'<div class="pill">📅 {v}</div>'
-if cs:                  pills_html += f'<div class="pill state">📍 {cs}</div>'
-if not sel_category and not sel_segment and not sel_year and not cs and not st.session_state.sel_region_card:
-    pills_html += '<div class="pill" style="color:#4a7fa5;border-color:#2d4a6b;">Showing all data</div>'
-pills_html += '</div>'
-st.markdown(pills_html, unsafe_allow_html=True)
+st.markdown(fragments.pills(sel_category, sel_segment, sel_year, st.session_state.clicked_state,
+                            st.session_state.sel_region_card), unsafe_allow_html=True)
 st.markdown('</div></div>', unsafe_allow_html=True)
 
 if st.session_state.clicked_state:
@@ -235,41 +254,108 @@ if st.session_state.clicked_state:
             st.session_state.clicked_state = None
             st.rerun()
 
-# ── BUILD filtered_df ───────────────────────────────────────────────────────
-mask = pd.Series([True] * len(df), index=df.index)
-_active_regions = list(st.session_state.sel_region_card)
-if _active_regions: mask &= df['Region'].isin(_active_regions)
-if sel_category: mask &= df['Category'].isin(sel_category)
-if sel_segment:  mask &= df['Segment'].isin(sel_segment)
-if sel_year:     mask &= df['Year'].isin(sel_year)
-if st.session_state.clicked_state: mask &= df['State'] == st.session_state.clicked_state
-if st.session_state.clicked_city:  mask &= df['City']  == st.session_state.clicked_city
-
-filtered_df = df[mask]
+_prof.mark('filter_bar')
+
+# ── BUILD FILTER SELECTION ──────────────────────────────────────────────────
+# The region cards and the map only apply year / category / segment
+# (engine.cells(..., base=True)); everything else also applies the
+# region-card and clicked-state / city filters.
+_filters = {
+    'year':     sel_year,
+    'category': sel_category,
+    'segment':  sel_segment,
+    'region':   list(st.session_state.sel_region_card),
+    'state':    st.session_state.clicked_state,
+    'city':     st.session_state.clicked_city,
+}
+_cells = engine.cells(_filters)
+_prof.mark('selection', rows=len(_cells))
 
-if filtered_df.empty:
+if _cells.empty:
     st.warning("No data matches the current filter combination. Try adjusting your selections.")
+    _prof.finish()
     st.stop()
 
+# ── PREFETCH ──────────────────────────────────────────────────────────────────
+# Every section below reads its data from the engine, and none of those calls
+# needs another's result.  They all start here, on the engine's pool; when a
+# section reaches its own call it gets the cached result or waits for the one
+# in flight, so the slow sections compute side by side while the page above
+# them renders.  The A/B and forecast calls use the widgets' current values
+# (their defaults on a first run); if a widget ends up elsewhere, that
+# section simply computes its own.
+_ab_dims = {
+    "Region":       "Region",
+    "Category":     "Category",
+    "Sub-Category": "Sub-Category",
+    "Segment":      "Segment",
+    "Ship Mode":    "Ship Mode",
+    "State":        "State",
+}
+
+def _ab_options(dim):
+    return sorted(_cells[_ab_dims[dim]].unique().tolist())
+
+# A group is one or more values of a dimension.  The values widget is keyed
+# per dimension (ab_val_<side>_<dimension>), so switching dimension starts
+# from that dimension's default selection.
+def _ab_default(opts, index):
+    return opts[min(index, len(opts) - 1):][:1]
+
+def _ab_guess(side, default_dim, index):
+    dim  = st.session_state.get(f'ab_dim_{side}', default_dim)
+    opts = _ab_options(dim)
+    vals = st.session_state.get(f'ab_val_{side}_{dim}')
+    return _ab_dims[dim], [v for v in vals if v in opts] if vals is not None else _ab_default(opts, index)
+
+_ab_next = (_ab_guess('a', list(_ab_dims)[0], 0), _ab_guess('b', 'Segment', 1))
+_fc_next = (st.session_state.get('fc_dim', FORECAST_DIMS[0]), st.session_state.get('fc_months', 6),
+            st.session_state.get('fc_interval', INTERVALS[0]), st.session_state.get('fc_grain', 'Month'))
+# The city table shows its first `city_rows` rows in the chosen order; a
+# change of filters, search or order starts it again from one page.
+_city_next = (st.session_state.get('city_sort', CITY_SORTS[0]),
+              st.session_state.get('city_order', 'Descending') == 'Ascending',
+              st.session_state.get('city_search', ''))
+if st.session_state.get('city_view') != canonical_key(_filters, *_city_next):
+    st.session_state.city_view = canonical_key(_filters, *_city_next)
+    st.session_state.city_rows = CITY_PAGE_ROWS
+_city_rows = st.session_state.city_rows
+engine.prefetch([
+    lambda: engine.rankings(_filters, _distinct_mode),
+    lambda: engine.region_cards(_filters, _distinct_mode),
+    lambda: engine.map_ranking(_filters),
+    lambda: engine.region_states(_filters),
+    lambda: engine.state_summary(_filters, _distinct_mode),
+    lambda: engine.ab_compare(_filters, _ab_next, _distinct_mode),
+    lambda: engine.ab_significance(_filters, _ab_next, _distinct_mode),
+    lambda: engine.ab_daily(_filters, _ab_next),
+    lambda: engine.daily(_filters),
+    lambda: engine.forecast(_filters, *_fc_next),
+    lambda: engine.city_page(_filters, _distinct_mode, *_city_next[:2], 0, _city_rows, _city_next[2]),
+])
+
 # ── METRICS ───────────────────────────────────────────────────────────────────
-state_sales   = filtered_df.groupby(['State','State Code'])['Sales'].sum().reset_index()
-cat_sales     = filtered_df.groupby('Category')['Sales'].sum().reset_index()
-subcat_sales  = filtered_df.groupby('Sub-Category')['Sales'].sum().reset_index()
-region_sales  = filtered_df.groupby('Region')['Sales'].sum().reset_index()
-segment_sales = filtered_df.groupby('Segment')['Sales'].sum().reset_index()
-city_sales    = filtered_df.groupby('City')['Sales'].sum().reset_index()
-monthly_sales = filtered_df.groupby('Month')['Sales'].sum().reset_index().sort_values('Month')
-region_seg    = filtered_df.groupby(['Region','Segment'])['Sales'].sum().reset_index()
-
-total_sales   = filtered_df['Sales'].sum()
-total_orders  = filtered_df['Order ID'].nunique()
-avg_order_val = total_sales / total_orders if total_orders else 0
-top_state     = state_sales.sort_values('Sales', ascending=False).iloc[0]
-top_city_row  = city_sales.sort_values('Sales', ascending=False).iloc[0]
-top_cat_row   = cat_sales.sort_values('Sales', ascending=False).iloc[0]
-top_subcat_row= subcat_sales.sort_values('Sales', ascending=False).iloc[0]
-top_region_row= region_sales.sort_values('Sales', ascending=False).iloc[0]
-top_seg_row   = segment_sales.sort_values('Sales', ascending=False).iloc[0]
+with st.spinner("Computing totals…"):
+    _metrics   = engine.metrics(_filters, _distinct_mode)
+state_sales    = _metrics['by_state']
+cat_sales      = _metrics['by_category']
+subcat_sales   = _metrics['by_sub_category']
+region_sales   = _metrics['by_region']
+segment_sales  = _metrics['by_segment']
+city_sales     = _metrics['by_city']
+region_seg     = _metrics['region_segment']
+total_sales    = _metrics['total_sales']
+total_orders   = _metrics['total_orders']
+avg_order_val  = _metrics['avg_order']
+# Leaders, top-N and weakest entries come from rankings (see ranking.py)
+# rather than sorting the rollups.
+_ranks        = engine.rankings(_filters, _distinct_mode)
+top_state     = _ranks['by_state'].leader()
+top_city_row  = _ranks['by_city'].leader()
+top_cat_row   = _ranks['by_category'].leader()
+top_subcat_row= _ranks['by_sub_category'].leader()
+top_region_row= _ranks['by_region'].leader()
+top_seg_row   = _ranks['by_segment'].leader()
 state_share   = (top_state['Sales'] / total_sales * 100) if total_sales else 0
 
 k1,k2,k3,k4 = st.columns(4)
@@ -281,42 +367,20 @@ k4.metric("🏆 #1 Region",       top_region_row['Region'])
 st.markdown("---")
 
 
+_prof.mark('metrics', rows=len(_cells))
+
 # ── REGION FILTER CARDS ─────────────────────────────────────────────────────
 st.subheader("🌎 Filter by Region")
 st.caption("Click a card to filter — click again to deselect. Multiple regions can be active.")
 
 # Apply year / category / segment filters so cards stay in sync with the filter bar
-_card_base = df.copy()
-if sel_year:     _card_base = _card_base[_card_base['Year'].isin(sel_year)]
-if sel_category: _card_base = _card_base[_card_base['Category'].isin(sel_category)]
-if sel_segment:  _card_base = _card_base[_card_base['Segment'].isin(sel_segment)]
-
-_all_region_stats = _card_base.groupby('Region').agg(
-    Sales=('Sales', 'sum'),
-    Orders=('Order ID', 'nunique'),
-).reset_index().sort_values('Sales', ascending=False).reset_index(drop=True)
-_grand_total = _all_region_stats['Sales'].sum()
-
-_region_meta = {
-    'East':    ('🏙️', '#0d2240', '#1a4a80', '#4299e1', '#90cdf4'),
-    'West':    ('🌄', '#0d2a1a', '#1a5c36', '#48bb78', '#9ae6b4'),
-    'Central': ('🌾', '#2a1500', '#a04010', '#ed8936', '#fbd38d'),
-    'South':   ('🌴', '#1e0f38', '#5a35a8', '#9f7aea', '#d6bcfa'),
-}
+_all_region_stats = engine.region_cards(_filters, _distinct_mode)
+_rc_labels, _rc_script = fragments.region_cards(_all_region_stats, st.session_state.sel_region_card)
 
-import streamlit.components.v1 as _stcv1, json as _json
+import streamlit.components.v1 as _stcv1
 
 _rc_cols = st.columns(len(_all_region_stats))
-for _idx, _row in _all_region_stats.iterrows():
-    _region   = _row['Region']
-    _sales    = _row['Sales']
-    _orders   = int(_row['Orders'])
-    _share    = _sales / _grand_total * 100 if _grand_total else 0
-    _icon     = _region_meta[_region][0]
-    _is_act   = _region in st.session_state.sel_region_card
-    _check    = "  ✓" if _is_act else ""
-    _label    = f"{_icon}  {_region}{_check}\n${_sales:,.0f}\n{_orders:,} orders · {_share:.1f}%"
-
+for _idx, (_region, _label) in enumerate(zip(_all_region_stats['Region'], _rc_labels)):
     with _rc_cols[_idx]:
         if st.button(_label, key=f"rcard_{_region}", use_container_width=True):
             _cards = list(st.session_state.sel_region_card)
@@ -334,107 +398,13 @@ if st.session_state.sel_region_card:
             st.session_state.sel_region_card = []
             st.rerun()
 
-_js_cards = []
-for _, _r in _all_region_stats.iterrows():
-    _reg = _r['Region']
-    _icon, _bg1, _bg2, _border, _accent = _region_meta.get(_reg, ('🌎','#0d1b2a','#1b2a3b','#4299e1','#90cdf4'))
-    _act = _reg in st.session_state.sel_region_card
-    _js_cards.append({
-        'region': _reg, 'bg1': _bg1, 'bg2': _bg2,
-        'border': _border, 'accent': _accent, 'active': _act
-    })
-
-_stcv1.html(f"""<script>
-(function() {{
-  var cards = {_json.dumps(_js_cards)};
-
-  function styleAll() {{
-    var doc = window.parent.document;
-    cards.forEach(function(c) {{
-      var allBtns = doc.querySelectorAll('button');
-      var btn = null;
-      for (var i = 0; i < allBtns.length; i++) {{
-        if (allBtns[i].innerText && allBtns[i].innerText.indexOf(c.region) !== -1) {{
-          btn = allBtns[i];
-          break;
-        }}
-      }}
-      if (!btn) return;
-
-      var want = c.active ? '1' : '0';
-      if (btn.getAttribute('data-rs') === want) return;
-      btn.setAttribute('data-rs', want);
-
-      var s = btn.style;
-      s.setProperty('background', 'linear-gradient(145deg,' + c.bg1 + ' 0%,' + c.bg2 + ' 100%)', 'important');
-      s.setProperty('border-radius', '16px', 'important');
-      s.setProperty('color', c.accent, 'important');
-      s.setProperty('min-height', '130px', 'important');
-      s.setProperty('height', 'auto', 'important');
-      s.setProperty('width', '100%', 'important');
-      s.setProperty('padding', '18px 12px 14px', 'important');
-      s.setProperty('font-size', '0.85rem', 'important');
-      s.setProperty('white-space', 'pre-line', 'important');
-      s.setProperty('line-height', '1.8', 'important');
-      s.setProperty('cursor', 'pointer', 'important');
-      s.setProperty('text-align', 'center', 'important');
-      s.setProperty('transition', 'transform 0.15s ease, opacity 0.15s ease', 'important');
-      s.setProperty('will-change', 'transform, box-shadow', 'important');
-
-      if (c.active) {{
-        s.setProperty('border', '3px solid ' + c.border, 'important');
-        s.setProperty('opacity', '1', 'important');
-        var kfId = 'gkf-' + c.region.toLowerCase();
-        if (!doc.getElementById(kfId)) {{
-          var el = doc.createElement('style');
-          el.id = kfId;
-          el.textContent =
-            '@keyframes ' + kfId + '{{' +
-            '0%,100%{{box-shadow:0 0 8px ' + c.border + '55,0 0 18px ' + c.border + '22}}' +
-            '50%{{box-shadow:0 0 30px ' + c.border + 'ff,0 0 60px ' + c.border + 'bb,0 0 90px ' + c.border + '44}}' +
-            '}}';
-          doc.head.appendChild(el);
-        }}
-        s.setProperty('animation', kfId + ' 2.5s ease-in-out infinite', 'important');
-      }} else {{
-        s.setProperty('border', '1.5px solid ' + c.border, 'important');
-        s.setProperty('opacity', '0.72', 'important');
-        s.setProperty('animation', 'none', 'important');
-        s.setProperty('box-shadow', 'none', 'important');
-      }}
-
-      if (!btn._rsHover) {{
-        btn._rsHover = true;
-        var border = c.border;
-        var isAct = c.active;
-        btn.addEventListener('mouseenter', function() {{
-          btn.style.setProperty('opacity', '1', 'important');
-          btn.style.setProperty('transform', 'translateY(-4px) scale(1.02)', 'important');
-          btn.style.setProperty('box-shadow', '0 0 32px ' + border + 'dd, 0 10px 28px rgba(0,0,0,.5)', 'important');
-          btn.style.setProperty('animation', 'none', 'important');
-        }});
-        btn.addEventListener('mouseleave', function() {{
-          btn.style.setProperty('transform', '', 'important');
-          if (isAct) {{
-            btn.style.setProperty('animation', 'gkf-' + c.region.toLowerCase() + ' 2.5s ease-in-out infinite', 'important');
-          }}
-        }});
-      }}
-    }});
-  }}
-
-  styleAll();
-  var obs = new MutationObserver(function(muts) {{
-    var hasNew = muts.some(function(m) {{ return m.addedNodes.length > 0; }});
-    if (hasNew) styleAll();
-  }});
-  obs.observe(window.parent.document.body, {{childList:true, subtree:true}});
-}})();
-</script>""", height=0)
+_stcv1.html(_rc_script, height=0)
 
 st.markdown("---")
 
 
+_prof.mark('region_cards', rows=len(engine.base_rows(_filters)))
+
 # ── MAP ───────────────────────────────────────────────────────────────────────
 st.subheader("📍 Sales Distribution by State  ·  Click a state to drill down")
 
@@ -448,19 +418,12 @@ _gmf_labels = {
 
 # Map base: respect year/category/segment but NOT region-card or clicked_state
 # so all states remain visible on the map for geographic context
-_map_base = df.copy()
-if sel_year:     _map_base = _map_base[_map_base['Year'].isin(sel_year)]
-if sel_category: _map_base = _map_base[_map_base['Category'].isin(sel_category)]
-if sel_segment:  _map_base = _map_base[_map_base['Segment'].isin(sel_segment)]
-
-all_state_sales = _map_base.groupby(['State', 'State Code'])['Sales'].sum().reset_index()
-_map_total = all_state_sales['Sales'].sum()
-all_state_sales['Share'] = all_state_sales['Sales'] / _map_total * 100
+all_state_sales = engine.map_data(_filters)
 
 if not st.session_state.clicked_state and not st.session_state.sel_region_card:
     st.markdown("""<div style="display:flex;gap:8px;flex-wrap:wrap;margin-bottom:15px;align-items:center;">
         <span style="color:#90cdf4;font-size:0.8rem;">⚡ Quick select:</span>""", unsafe_allow_html=True)
-    top_states_quick = all_state_sales.nlargest(5, 'Sales')['State'].tolist()
+    top_states_quick = engine.map_ranking(_filters).top(5)['State'].tolist()
     quick_cols = st.columns(len(top_states_quick))
     for i, state in enumerate(top_states_quick):
         with quick_cols[i]:
@@ -486,130 +449,27 @@ border-radius:10px;padding:8px 15px;margin-bottom:15px;">
             st.session_state.clicked_state = None
             st.rerun()
 
-# ── Build map with region-aware coloring ──────────────────────────────────
-_region_fill_colors = {
-    'East':    [[0, 'rgba(66,153,225,0.12)'],  [1, 'rgba(66,153,225,0.55)']],
-    'West':    [[0, 'rgba(72,187,120,0.12)'],  [1, 'rgba(72,187,120,0.55)']],
-    'Central': [[0, 'rgba(237,137,54,0.12)'],  [1, 'rgba(237,137,54,0.55)']],
-    'South':   [[0, 'rgba(159,122,234,0.12)'], [1, 'rgba(159,122,234,0.55)']],
-}
-_region_border_colors = {'East':'#4299e1','West':'#48bb78','Central':'#ed8936','South':'#9f7aea'}
-
-_sel_regions = st.session_state.sel_region_card
-
-if _sel_regions:
-    fig_map = px.choropleth(
-        all_state_sales, locations='State Code', locationmode="USA-states",
-        color='Sales', scope="usa", hover_name='State',
-        color_continuous_scale=[[0,'rgba(40,40,60,0.5)'],[1,'rgba(80,80,100,0.5)']],
-        labels={'Sales': 'Total Sales ($)'},
-        custom_data=['Share']
-    )
-    fig_map.update_traces(
-        hovertemplate=(
-            "<b>%{hovertext}</b><br>"
-            "Total Sales: $%{z:,.0f}<br>"
-            "Revenue Share: %{customdata[0]:.1f}%"
-            "<extra></extra>"
-        ),
-        marker_line_color='rgba(100,100,120,0.3)', marker_line_width=0.5
-    )
-    for _sreg in _sel_regions:
-        _reg_df = all_state_sales[all_state_sales['State'].isin(
-            _map_base[_map_base['Region'] == _sreg]['State'].unique()
-        )].copy()
-        if not _reg_df.empty:
-            _fcol   = _region_fill_colors.get(_sreg, [[0,'rgba(255,255,255,0.1)'],[1,'rgba(255,255,255,0.5)']])
-            _bcol   = _region_border_colors.get(_sreg, '#ffffff')
-            fig_map.add_trace(go.Choropleth(
-                locations=_reg_df['State Code'].tolist(),
-                z=_reg_df['Sales'].tolist(),
-                locationmode="USA-states",
-                colorscale=_fcol,
-                showscale=False,
-                marker_line_color=_bcol,
-                marker_line_width=2.5,
-                text=_reg_df['State'].tolist(),
-                customdata=_reg_df[['Share']].values,
-                hovertemplate=(
-                    "<b>%{text}</b><br>"
-                    "Sales: $%{z:,.0f}<br>"
-                    "Revenue Share: %{customdata[0]:.1f}%<br>"
-                    "Region: " + _sreg +
-                    "<extra></extra>"
-                ),
-                name=_sreg,
-            ))
-else:
-    fig_map = px.choropleth(
-        all_state_sales, locations='State Code', locationmode="USA-states",
-        color='Sales', scope="usa", hover_name='State',
-        color_continuous_scale="Blues", labels={'Sales': 'Total Sales ($)'},
-        custom_data=['Share']
-    )
-    fig_map.update_traces(
-        hovertemplate=(
-            "<b>%{hovertext}</b><br>"
-            "Total Sales: $%{z:,.0f}<br>"
-            "Revenue Share: %{customdata[0]:.1f}%"
-            "<extra></extra>"
-        )
-    )
-
-if st.session_state.clicked_state:
-    _hl = all_state_sales[all_state_sales['State'] == st.session_state.clicked_state]
-    if not _hl.empty:
-        fig_map.add_trace(go.Choropleth(
-            locations=_hl['State Code'], z=[1], locationmode="USA-states",
-            colorscale=[[0,"rgba(233,69,96,0)"],[1,"rgba(233,69,96,0)"]],
-            showscale=False, marker_line_color="#e94560",
-            marker_line_width=3, hoverinfo='skip',
-        ))
-
 # ── Geo-card filter highlight overlay ────────────────────────────────────────
 _gmf = st.session_state.geo_map_filter
-if _gmf:
-    if _gmf == 'leader':
-        _hl_states = [top_state['State']]
-        _hl_color  = '#4299e1'
-    elif _gmf == 'top5':
-        _hl_states = state_sales.nlargest(5, 'Sales')['State'].tolist()
-        _hl_color  = '#ed8936'
-    elif _gmf == 'above_avg':
-        _avg_s     = state_sales['Sales'].mean()
-        _hl_states = state_sales[state_sales['Sales'] > _avg_s]['State'].tolist()
-        _hl_color  = '#9f7aea'
-    elif _gmf == 'weakest':
-        _hl_states = [state_sales.sort_values('Sales').iloc[0]['State']]
-        _hl_color  = '#e94560'
-    else:
-        _hl_states = []
-        _hl_color  = '#ffffff'
-
-    _hl_df = all_state_sales[all_state_sales['State'].isin(_hl_states)]
-    if not _hl_df.empty:
-        fig_map.add_trace(go.Choropleth(
-            locations=_hl_df['State Code'].tolist(),
-            z=_hl_df['Sales'].tolist(),
-            locationmode="USA-states",
-            colorscale=[
-                [0, f'rgba({int(_hl_color[1:3],16)},{int(_hl_color[3:5],16)},{int(_hl_color[5:7],16)},0.25)'],
-                [1, f'rgba({int(_hl_color[1:3],16)},{int(_hl_color[3:5],16)},{int(_hl_color[5:7],16)},0.7)'],
-            ],
-            showscale=False,
-            marker_line_color=_hl_color,
-            marker_line_width=3,
-            text=_hl_df['State'].tolist(),
-            customdata=_hl_df[['Share']].values,
-            hovertemplate="<b>%{text}</b><br>Sales: $%{z:,.0f}<br>Share: %{customdata[0]:.1f}%<extra></extra>",
-            name='highlighted',
-        ))
-
-fig_map.update_layout(
-    margin={"r":0,"t":0,"l":0,"b":0}, geo_bgcolor='rgba(0,0,0,0)',
-    coloraxis_colorbar=dict(title="Sales ($)", tickprefix="$"),
-    showlegend=False,
-)
+_hl_states, _hl_color = [], '#ffffff'
+if _gmf == 'leader':
+    _hl_states = [top_state['State']]
+    _hl_color  = '#4299e1'
+elif _gmf == 'top5':
+    _hl_states = _ranks['by_state'].top(5)['State'].tolist()
+    _hl_color  = '#ed8936'
+elif _gmf == 'above_avg':
+    _hl_states = _ranks['by_state'].above()['State'].tolist()
+    _hl_color  = '#9f7aea'
+elif _gmf == 'weakest':
+    _hl_states = [_ranks['by_state'].weakest()['State']]
+    _hl_color  = '#e94560'
+
+# Base choropleth per year / category / segment rollup, plus cached overlay
+# traces for the region cards, the clicked state and the geo-card highlight
+fig_map = map_figure.figure(all_state_sales, engine.region_states(_filters),
+                            st.session_state.sel_region_card, st.session_state.clicked_state,
+                            _hl_states, _hl_color)
 map_event = st.plotly_chart(fig_map, use_container_width=True, on_select="rerun", key="choropleth_map")
 
 if map_event and map_event.selection and map_event.selection.get("points"):
@@ -624,134 +484,14 @@ if map_event and map_event.selection and map_event.selection.get("points"):
             st.session_state.clicked_state = None
             st.rerun()
 
+_prof.mark('map', rows=len(engine.base_rows(_filters)))
+
 # ── Smart map insight banner ──────────────────────────────────────────────────
-_n_active_states   = len(state_sales[state_sales['Sales'] > 0])
-_top5_states       = state_sales.nlargest(5, 'Sales')
-_top5_share        = _top5_states['Sales'].sum() / total_sales * 100 if total_sales else 0
-_top5_names        = " · ".join(_top5_states['State'].str[:2].tolist())
-_bottom_state      = state_sales.sort_values('Sales').iloc[0]
-_avg_state_sales   = state_sales['Sales'].mean()
-_above_avg_states  = len(state_sales[state_sales['Sales'] > _avg_state_sales])
-_pct_above         = _above_avg_states / _n_active_states * 100 if _n_active_states else 0
-_gap_ratio         = top_state['Sales'] / _bottom_state['Sales'] if _bottom_state['Sales'] > 0 else 0
-_conc_lbl          = "High Risk — over-reliance on few states" if _top5_share > 60 else "Moderate — healthy regional spread" if _top5_share > 40 else "Low — well diversified across states"
-_conc_color        = "#e94560" if _top5_share > 60 else "#ed8936" if _top5_share > 40 else "#48bb78"
-_conc_dot          = "#e94560" if _top5_share > 60 else "#ed8936" if _top5_share > 40 else "#48bb78"
-_leader_share_bar  = min(state_share * 3.5, 100)
-
-# Pre-compute all values used in banner f-string to avoid quote/expression conflicts
-_ts_name   = top_state['State']
-_ts_sales  = top_state['Sales']
-_bs_name   = _bottom_state['State']
-_bs_sales  = _bottom_state['Sales']
-_bs_pct    = max(_bottom_state['Sales'] / top_state['Sales'] * 100, 1.5) if top_state['Sales'] else 0
-_avg_pct   = min(_avg_state_sales / top_state['Sales'] * 100, 100) if top_state['Sales'] else 0
-_avg_share = _avg_state_sales / total_sales * 100 if total_sales else 0
-
-# Pre-compute pip HTML outside f-string to avoid nested quote conflicts
-_pip_html = ''.join([
-    '<div style="width:8px;height:8px;border-radius:2px;flex-shrink:0;background:' +
-    ('#9f7aea' if i < _above_avg_states else 'rgba(255,255,255,0.06)') +
-    ';"></div>'
-    for i in range(min(_n_active_states, 30))
-])
+_banner            = engine.state_summary(_filters, _distinct_mode)
 
 _geo_active = st.session_state.geo_map_filter or ''
 
-_geo_html = (
-    "<!DOCTYPE html><html><head><meta charset=\'utf-8\'>"
-    "<style>"
-    "body{margin:0;padding:0;background:transparent;font-family:-apple-system,BlinkMacSystemFont,Segoe UI,sans-serif;}"
-    "@keyframes shimmer{0%{background-position:-200% center}100%{background-position:200% center}}"
-    ".geo-card-click{cursor:pointer;transition:transform 0.15s,box-shadow 0.15s;}"
-    ".geo-card-click:hover{transform:translateY(-3px);box-shadow:0 8px 24px rgba(0,0,0,0.5);}"
-    ".geo-card-click.active{outline:2px solid currentColor;outline-offset:2px;}"
-    "</style>"
-    "<script>"
-    "function sendFilter(f){window.parent.postMessage({geoFilter:f},'*');}"
-    "</script>"
-    "</head><body>"
-) + f"""<div style="background:linear-gradient(160deg,#080f1e 0%,#0c1a30 60%,#080f1e 100%);border:1px solid #162640;border-radius:16px;padding:28px 28px 24px;margin-bottom:12px;position:relative;overflow:hidden;">
-
-  <!-- glow -->
-  <div style="position:absolute;inset:0;background:radial-gradient(ellipse at 80% 0%,rgba(66,153,225,0.07) 0%,transparent 60%),radial-gradient(ellipse at 10% 100%,rgba(99,179,237,0.04) 0%,transparent 50%);pointer-events:none;"></div>
-
-  <!-- header -->
-  <div style="display:flex;align-items:center;gap:10px;margin-bottom:18px;">
-    <div style="width:3px;height:18px;background:linear-gradient(180deg,#4299e1,#63b3ed);border-radius:2px;flex-shrink:0;"></div>
-    <span style="font-size:0.68rem;font-weight:800;color:#4299e1;text-transform:uppercase;letter-spacing:0.18em;">Geographic Revenue Intelligence</span>
-    <span style="margin-left:auto;background:rgba(66,153,225,0.08);border:1px solid #1e3a5f;border-radius:20px;padding:2px 10px;font-size:0.68rem;color:#90cdf4;font-weight:600;">{_n_active_states} states · {len(state_sales)} markets</span>
-  </div>
-
-  <!-- 4-col grid -->
-  <div style="display:grid;grid-template-columns:1.4fr 1fr 1fr 1fr;gap:10px;">
-
-    <!-- Card 1: Revenue Leader -->
-    <div class="geo-card-click" onclick="sendFilter('leader')" style="background:linear-gradient(145deg,#0d2240,#112a50);border:1px solid #1e4a80;border-radius:12px;padding:16px 14px 14px;position:relative;overflow:hidden;color:#4299e1;">
-      <div style="position:absolute;top:0;left:0;right:0;height:2px;background:linear-gradient(90deg,transparent,#4299e1,#90cdf4,transparent);"></div>
-      <div style="font-size:0.65rem;font-weight:700;text-transform:uppercase;letter-spacing:0.13em;color:#4a6580;margin-bottom:12px;display:flex;align-items:center;gap:5px;">
-        <div style="width:5px;height:5px;border-radius:50%;background:#4299e1;flex-shrink:0;"></div>Revenue Leader
-      </div>
-      <div style="font-size:1.55rem;font-weight:800;color:#fff;line-height:1.1;">{_ts_name}</div>
-      <div style="font-size:0.88rem;font-weight:600;margin-top:5px;color:#48bb78;">${_ts_sales:,.0f}</div>
-      <div style="margin-top:14px;display:flex;flex-direction:column;gap:5px;">
-        <div style="display:flex;align-items:center;gap:6px;">
-          <span style="color:#4a6580;font-size:0.6rem;width:32px;flex-shrink:0;">Leader</span>
-          <div style="flex:1;background:rgba(255,255,255,0.05);border-radius:99px;height:4px;">
-            <div style="width:100%;height:4px;background:linear-gradient(90deg,#4299e1,#90cdf4);border-radius:99px;"></div>
-          </div>
-          <span style="color:#90cdf4;font-size:0.6rem;width:34px;text-align:right;">{state_share:.1f}%</span>
-        </div>
-        <div style="display:flex;align-items:center;gap:6px;">
-          <span style="color:#4a6580;font-size:0.6rem;width:32px;flex-shrink:0;">Avg</span>
-          <div style="flex:1;background:rgba(255,255,255,0.05);border-radius:99px;height:4px;">
-            <div style="width:{_avg_pct:.0f}%;height:4px;background:rgba(66,153,225,0.35);border-radius:99px;"></div>
-          </div>
-          <span style="color:#4a6580;font-size:0.6rem;width:34px;text-align:right;">{_avg_share:.1f}%</span>
-        </div>
-      </div>
-      <div style="font-size:0.72rem;color:#4a6580;margin-top:12px;font-weight:500;">{_gap_ratio:.0f}x larger than weakest state</div>
-    </div>
-
-    <!-- Card 2: Concentration -->
-    <div class="geo-card-click" onclick="sendFilter('top5')" style="background:rgba(255,255,255,0.025);border:1px solid #162640;border-radius:12px;padding:16px 14px 14px;position:relative;overflow:hidden;color:#ed8936;">
-      <div style="font-size:0.65rem;font-weight:700;text-transform:uppercase;letter-spacing:0.13em;color:#4a6580;margin-bottom:12px;display:flex;align-items:center;gap:5px;">
-        <div style="width:5px;height:5px;border-radius:50%;background:{_conc_color};flex-shrink:0;"></div>Concentration
-      </div>
-      <div style="font-size:1.55rem;font-weight:800;color:#fff;line-height:1.1;">{_top5_share:.0f}<span style="font-size:0.75rem;color:#718096;font-weight:500;">%</span></div>
-      <div style="font-size:0.88rem;font-weight:600;margin-top:5px;color:{_conc_color};">Top-5 share</div>
-      <div style="margin-top:14px;width:70px;height:70px;border-radius:50%;background:conic-gradient({_conc_color} 0% {_top5_share:.0f}%,rgba(255,255,255,0.06) {_top5_share:.0f}% 100%);display:flex;align-items:center;justify-content:center;">
-        <div style="width:50px;height:50px;border-radius:50%;background:#0c1a30;display:flex;align-items:center;justify-content:center;font-size:0.72rem;font-weight:700;color:{_conc_color};">{_top5_share:.0f}%</div>
-      </div>
-      <div style="font-size:0.63rem;color:{_conc_color};margin-top:8px;font-weight:500;">{_conc_lbl}</div>
-    </div>
-
-    <!-- Card 3: Market Spread -->
-    <div class="geo-card-click" onclick="sendFilter('above_avg')" style="background:rgba(255,255,255,0.025);border:1px solid #162640;border-radius:12px;padding:16px 14px 14px;position:relative;overflow:hidden;color:#9f7aea;">
-      <div style="font-size:0.65rem;font-weight:700;text-transform:uppercase;letter-spacing:0.13em;color:#4a6580;margin-bottom:12px;display:flex;align-items:center;gap:5px;">
-        <div style="width:5px;height:5px;border-radius:50%;background:#9f7aea;flex-shrink:0;"></div>Market Spread
-      </div>
-      <div style="font-size:1.55rem;font-weight:800;color:#fff;line-height:1.1;">{_above_avg_states}<span style="font-size:0.75rem;color:#718096;font-weight:400;"> /{_n_active_states}</span></div>
-      <div style="font-size:0.88rem;font-weight:600;margin-top:5px;color:#9f7aea;">States above avg</div>
-      <div style="margin-top:12px;display:flex;gap:2px;flex-wrap:wrap;">{_pip_html}</div>
-      <div style="font-size:0.72rem;color:#4a6580;margin-top:10px;font-weight:500;">{_pct_above:.0f}% outperforming avg ${_avg_state_sales/1000:.0f}K</div>
-    </div>
-
-    <!-- Card 4: Needs Attention -->
-    <div class="geo-card-click" onclick="sendFilter('weakest')" style="background:rgba(233,69,96,0.04);border:1px solid #3d1020;border-radius:12px;padding:16px 14px 14px;position:relative;overflow:hidden;color:#e94560;">
-      <div style="font-size:0.65rem;font-weight:700;text-transform:uppercase;letter-spacing:0.13em;color:#4a6580;margin-bottom:12px;display:flex;align-items:center;gap:5px;">
-        <div style="width:5px;height:5px;border-radius:50%;background:#e94560;flex-shrink:0;"></div>Needs Attention
-      </div>
-      <div style="font-size:1.3rem;font-weight:800;color:#fff;line-height:1.1;">{_bs_name}</div>
-      <div style="font-size:0.88rem;font-weight:600;margin-top:5px;color:#e94560;">${_bs_sales:,.0f}</div>
-      <div style="margin-top:12px;background:rgba(255,255,255,0.05);border-radius:99px;height:3px;overflow:hidden;">
-        <div style="width:{_bs_pct:.1f}%;height:3px;border-radius:99px;background:linear-gradient(90deg,#e94560,#fc8181);"></div>
-      </div>
-      <div style="font-size:0.72rem;color:#4a6580;margin-top:10px;font-weight:500;">Only {_bs_pct:.1f}% of leader — high opportunity gap</div>
-    </div>
-
-  </div>
-</div>""" + "</body></html>"
+_geo_html = fragments.geo_banner(_banner, top_state, total_sales, len(state_sales))
 
 _stc.html(_geo_html, height=310, scrolling=False)
 
@@ -841,6 +581,8 @@ if _gmf:
 
 st.markdown("---")
 
+_prof.mark('geo_banner', rows=len(_cells))
+
 # ── INSIGHT CARDS ─────────────────────────────────────────────────────────────
 st.header("💡 Key Business Insights")
 c1,c2,c3 = st.columns(3)
@@ -862,7 +604,7 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("Top 10 States by Sales")
-    top_states_df = state_sales.sort_values('Sales', ascending=False).head(10)
+    top_states_df = _ranks['by_state'].top(10)
     fig_bar = px.bar(top_states_df, x='Sales', y='State', orientation='h',
                      color='Sales', color_continuous_scale='Blues', labels={'Sales':'Total Sales ($)'})
     fig_bar.update_traces(hovertemplate="<b>%{y}</b><br>Sales: $%{x:,.0f}<extra></extra>")
@@ -871,7 +613,7 @@ with col1:
 
 with col2:
     st.subheader("Category & Segment Mix")
-    _sun_df = filtered_df.groupby(['Category','Segment'])['Sales'].sum().reset_index()
+    _sun_df = _metrics['category_segment']
     _sun_cmap = {
         "Consumer":        "#1a56a0",
         "Corporate":       "#4299e1",
@@ -915,47 +657,41 @@ with col2:
 
 st.markdown("---")
 
+_prof.mark('insights', rows=len(_cells))
+
+# Trend, A/B overlay and forecast charts share the time grains of
+# timeseries.py: a hover date format, an axis tick format and a title word
+# per grain, and no markers or labels on series longer than _MARKED_BUCKETS
+# buckets.
+_grain_dates   = {"Day": "%a %d %b %Y", "Week": "week of %d %b %Y", "Month": "%b %Y", "Quarter": "%b %Y"}
+_grain_ticks   = {"Day": "%d %b %Y", "Week": "%d %b %Y", "Month": "%b %Y", "Quarter": "%b %Y"}
+_grain_titles  = {"Day": "Daily", "Week": "Weekly", "Month": "Monthly", "Quarter": "Quarterly"}
+_MARKED_BUCKETS = 60
+
 # ── A/B TEST ──────────────────────────────────────────────────────────────────
 st.header("🧪 A/B Segment Comparison")
-st.caption("Pick two groups across any dimension — compare their sales, order volume, and avg order value side by side.")
+st.caption("Pick two groups across any dimension — one or more values each — and compare their sales, order volume, and avg order value side by side.")
 
 ab_c1, ab_c2 = st.columns(2)
 
-_ab_dims = {
-    "Region":       "Region",
-    "Category":     "Category",
-    "Sub-Category": "Sub-Category",
-    "Segment":      "Segment",
-    "Ship Mode":    "Ship Mode",
-    "State":        "State",
-}
-
 with ab_c1:
     st.markdown("#### 🔵 Group A")
     dim_a  = st.selectbox("Dimension", list(_ab_dims.keys()), key="ab_dim_a")
-    opts_a = sorted(filtered_df[_ab_dims[dim_a]].unique().tolist())
-    val_a  = st.selectbox("Value", opts_a, key="ab_val_a")
+    opts_a = _ab_options(dim_a)
+    vals_a = st.multiselect("Values", opts_a, default=_ab_default(opts_a, 0), key=f"ab_val_a_{dim_a}")
 
 with ab_c2:
     st.markdown("#### 🔴 Group B")
     dim_b  = st.selectbox("Dimension", list(_ab_dims.keys()), key="ab_dim_b", index=list(_ab_dims.keys()).index("Segment") if "Segment" in _ab_dims else 0)
-    opts_b = sorted(filtered_df[_ab_dims[dim_b]].unique().tolist())
-    val_b  = st.selectbox("Value", opts_b, key="ab_val_b", index=min(1, len(opts_b)-1))
-
-grp_a = filtered_df[filtered_df[_ab_dims[dim_a]] == val_a]
-grp_b = filtered_df[filtered_df[_ab_dims[dim_b]] == val_b]
+    opts_b = _ab_options(dim_b)
+    vals_b = st.multiselect("Values", opts_b, default=_ab_default(opts_b, 1), key=f"ab_val_b_{dim_b}")
 
-def _ab_stats(grp):
-    total   = grp["Sales"].sum()
-    orders  = grp["Order ID"].nunique()
-    avg_ord = total / orders if orders else 0
-    top_cat = grp.groupby("Category")["Sales"].sum().idxmax() if not grp.empty else "—"
-    top_sub = grp.groupby("Sub-Category")["Sales"].sum().idxmax() if not grp.empty else "—"
-    top_st  = grp.groupby("State")["Sales"].sum().idxmax() if not grp.empty else "—"
-    return dict(total=total, orders=orders, avg_ord=avg_ord,
-                top_cat=top_cat, top_sub=top_sub, top_st=top_st)
-
-sa, sb = _ab_stats(grp_a), _ab_stats(grp_b)
+_group_a = (_ab_dims[dim_a], vals_a)
+_group_b = (_ab_dims[dim_b], vals_b)
+val_a, val_b = ab_test.label(_group_a), ab_test.label(_group_b)
+with st.spinner("Comparing groups…"):
+    sa, sb = engine.ab_stats(_filters, _group_a, _group_b, _distinct_mode)
+    _ab_sig = engine.ab_significance(_filters, (_group_a, _group_b), _distinct_mode)[1]
 
 k1, k2, k3 = st.columns(3)
 
@@ -963,11 +699,20 @@ def _delta(a, b):
     if b == 0: return 0
     return (a - b) / b * 100
 
-for col, label, ka, kb in [
-    (k1, "💰 Total Sales",      sa["total"],   sb["total"]),
-    (k2, "📦 Total Orders",     sa["orders"],  sb["orders"]),
-    (k3, "🧾 Avg Order Value",  sa["avg_ord"], sb["avg_ord"]),
+def _significance(test):
+    if not (vals_a and vals_b):
+        return "Pick values for both groups to test the difference"
+    p = test["p_value"]
+    if p < 1 - ab_test.CONFIDENCE:
+        return f"✅ Significant difference (p = {p:.3f})"
+    return f"➖ Not significant (p = {p:.3f})"
+
+for col, label, metric in [
+    (k1, "💰 Total Sales",      "total"),
+    (k2, "📦 Total Orders",     "orders"),
+    (k3, "🧾 Avg Order Value",  "avg_ord"),
 ]:
+    ka, kb = sa[metric], sb[metric]
     with col:
         d = _delta(ka, kb)
         arrow = "▲" if d > 0 else "▼"
@@ -990,25 +735,32 @@ for col, label, ka, kb in [
               <div style="font-size:1.2rem;font-weight:700;color:#fff;">{fb}</div>
             </div>
           </div>
+          <div style="font-size:0.7rem;color:#a0aec0;margin-top:6px;">{_significance(_ab_sig[metric])}</div>
         </div>""", unsafe_allow_html=True)
 
-# ── Monthly trend overlay ─────────────────────────────────────────────────────
-ma = grp_a.groupby("Month")["Sales"].sum().reset_index().sort_values("Month")
-mb = grp_b.groupby("Month")["Sales"].sum().reset_index().sort_values("Month")
+st.caption(f"Significance: {ab_test.BOOTSTRAP_SAMPLES:,} bootstrap resamples of each group's cells, "
+           f"two-sided at {ab_test.CONFIDENCE:.0%} confidence.")
+
+# ── Sales trend overlay ───────────────────────────────────────────────────────
+# Both groups' daily sums are built once per filter state and groups; any
+# grain is resampled from them.
+_ab_grain = st.selectbox("Trend grain", GRAINS, index=GRAINS.index("Month"), key="ab_grain")
+ma, mb = engine.ab_trend(_filters, (_group_a, _group_b), _ab_grain)
+_ab_mode = "lines+markers" if len(ma) <= _MARKED_BUCKETS else "lines"
 
 fig_ab = go.Figure()
 fig_ab.add_trace(go.Scatter(
-    x=ma["Month"], y=ma["Sales"], name=f"🔵 {val_a}",
-    line=dict(color="#4299e1", width=2.5), mode="lines+markers",
-    hovertemplate=f"<b>{val_a}</b><br>%{{x}}<br>Sales: $%{{y:,.0f}}<extra></extra>"
+    x=ma["Date"], y=ma["Sales"], name=f"🔵 {val_a}",
+    line=dict(color="#4299e1", width=2.5), mode=_ab_mode,
+    hovertemplate=f"<b>{val_a}</b><br>%{{x|{_grain_dates[_ab_grain]}}}<br>Sales: $%{{y:,.0f}}<extra></extra>"
 ))
 fig_ab.add_trace(go.Scatter(
-    x=mb["Month"], y=mb["Sales"], name=f"🔴 {val_b}",
-    line=dict(color="#e94560", width=2.5), mode="lines+markers",
-    hovertemplate=f"<b>{val_b}</b><br>%{{x}}<br>Sales: $%{{y:,.0f}}<extra></extra>"
+    x=mb["Date"], y=mb["Sales"], name=f"🔴 {val_b}",
+    line=dict(color="#e94560", width=2.5), mode=_ab_mode,
+    hovertemplate=f"<b>{val_b}</b><br>%{{x|{_grain_dates[_ab_grain]}}}<br>Sales: $%{{y:,.0f}}<extra></extra>"
 ))
 fig_ab.update_layout(
-    title=dict(text="Monthly Sales — A vs B", font=dict(size=13), x=0.5),
+    title=dict(text=f"{_grain_titles[_ab_grain]} Sales — A vs B", font=dict(size=13), x=0.5),
     xaxis_tickangle=-45,
     yaxis=dict(tickprefix="$", tickformat=",.0f"),
     legend=dict(orientation="h", yanchor="bottom", y=-0.35, xanchor="center", x=0.5),
@@ -1018,8 +770,7 @@ fig_ab.update_layout(
 st.plotly_chart(fig_ab, use_container_width=True, key="ab_trend")
 
 # ── Category breakdown A vs B ─────────────────────────────────────────────────
-ab_cat_a = grp_a.groupby("Category").agg(Sales=("Sales","sum"), **{"Order Count":("Order ID","nunique")}).reset_index().assign(Group=val_a)
-ab_cat_b = grp_b.groupby("Category").agg(Sales=("Sales","sum"), **{"Order Count":("Order ID","nunique")}).reset_index().assign(Group=val_b)
+ab_cat_a, ab_cat_b = engine.ab_category(_filters, _group_a, _group_b, _distinct_mode)
 ab_cat   = pd.concat([ab_cat_a, ab_cat_b], ignore_index=True)
 
 group_a_color = "#4299e1"
@@ -1078,7 +829,7 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
-categories = sorted(filtered_df['Category'].unique())
+categories = sorted(_cells['Category'].unique())
 category_colors = {'Furniture': '#48bb78', 'Office Supplies': '#f39c12', 'Technology': '#9b59b6'}
 cols = st.columns(len(categories))
 for i, cat in enumerate(categories):
@@ -1130,37 +881,42 @@ st.markdown(f"""
 
 st.markdown("---")
 
+_prof.mark('ab_test', rows=len(_cells))
+
 # ── TRENDS ────────────────────────────────────────────────────────────────────
 st.header("📈 Sales Trends & Sub-Category Deep Dive")
 col3, col4 = st.columns(2)
 
 with col3:
-    st.subheader("Monthly Sales Trend")
-    monthly_sales['label'] = monthly_sales['Sales'].apply(
+    st.subheader("Sales Trend")
+    _trend_grain = st.selectbox("Grain", GRAINS, index=GRAINS.index("Month"), key="trend_grain")
+    trend_sales = engine.trend(_filters, _trend_grain)
+    _marked = len(trend_sales) <= _MARKED_BUCKETS
+    trend_sales = trend_sales.assign(label=trend_sales['Sales'].apply(
         lambda v: f"${v/1000:.0f}K" if v >= 1000 else f"${v:.0f}"
-    )
-    fig_line = px.line(monthly_sales, x='Month', y='Sales', markers=True,
-                       text='label', labels={'Sales':'Total Sales ($)','Month':''})
+    ))
+    fig_line = px.line(trend_sales, x='Date', y='Sales', markers=_marked,
+                       text='label' if _marked else None, labels={'Sales':'Total Sales ($)','Date':''})
     fig_line.update_traces(
         line_color='#4299e1', line_width=2.5,
         marker=dict(size=7, color='#4299e1'),
         textposition='top center', textfont=dict(size=10, color='#90cdf4'),
-        hovertemplate="<b>%{x}</b><br>Sales: $%{y:,.0f}<extra></extra>"
+        hovertemplate=f"<b>%{{x|{_grain_dates[_trend_grain]}}}</b><br>Sales: $%{{y:,.0f}}<extra></extra>"
     )
     fig_line.update_layout(
         xaxis_tickangle=-45,
         yaxis=dict(tickprefix="$", tickformat=",.0f"),
-        yaxis_range=[0, monthly_sales['Sales'].max() * 1.18]
+        yaxis_range=[0, trend_sales['Sales'].max() * 1.18]
     )
     st.plotly_chart(fig_line, use_container_width=True, key="line_trend")
 
-    if len(monthly_sales) >= 2:
-        pct_chg = ((monthly_sales.iloc[-1]['Sales'] - monthly_sales.iloc[0]['Sales'])
-                   / monthly_sales.iloc[0]['Sales'] * 100)
+    if len(trend_sales) >= 2 and trend_sales.iloc[0]['Sales'] > 0:
+        pct_chg = ((trend_sales.iloc[-1]['Sales'] - trend_sales.iloc[0]['Sales'])
+                   / trend_sales.iloc[0]['Sales'] * 100)
         card_cls   = "good" if pct_chg > 0 else "alert"
         trend_word = "grown" if pct_chg > 0 else "declined"
         advice     = "Momentum is positive — consider scaling inventory." if pct_chg > 0 else "Investigate demand drivers and revisit pricing strategy."
-        st.markdown(f'<div class="insight-card {card_cls}"><div class="icon">📈</div><div class="label">Trend Insight</div><div class="value">{abs(pct_chg):.1f}% {"▲" if pct_chg > 0 else "▼"} over period</div><div class="detail">Sales have <strong>{trend_word} {abs(pct_chg):.1f}%</strong> from first to last month. {advice}</div></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="insight-card {card_cls}"><div class="icon">📈</div><div class="label">Trend Insight</div><div class="value">{abs(pct_chg):.1f}% {"▲" if pct_chg > 0 else "▼"} over period</div><div class="detail">Sales have <strong>{trend_word} {abs(pct_chg):.1f}%</strong> from first to last {_trend_grain.lower()}. {advice}</div></div>', unsafe_allow_html=True)
 
 with col4:
     st.subheader("Sub-Category Sales Ranking")
@@ -1188,59 +944,36 @@ fig_grouped.for_each_trace(
 )
 st.plotly_chart(fig_grouped, use_container_width=True, key="grouped_region_seg")
 
-best_rs  = region_seg.sort_values('Sales', ascending=False).iloc[0]
-worst_rs = region_seg.sort_values('Sales').iloc[0]
+best_rs  = _ranks['region_segment'].leader()
+worst_rs = _ranks['region_segment'].weakest()
 st.markdown(f'<div class="insight-card good"><div class="icon">🎯</div><div class="label">Strategic Insight</div><div class="value">Best combo: {best_rs["Region"]} × {best_rs["Segment"]}</div><div class="detail"><strong>{best_rs["Segment"]}</strong> in <strong>{best_rs["Region"]}</strong> delivers the highest sales at <strong>${best_rs["Sales"]:,.0f}</strong>. Lowest: <strong>{worst_rs["Segment"]}</strong> in <strong>{worst_rs["Region"]}</strong> (${worst_rs["Sales"]:,.0f}).</div></div>', unsafe_allow_html=True)
 
 st.markdown("---")
 
+_prof.mark('trends', rows=len(_cells))
+
 # ── SALES FORECAST ────────────────────────────────────────────────────────────
 st.header("🔮 Sales Forecast")
-st.caption("Linear trend + seasonal decomposition forecast based on historical data in current filter.")
+st.caption("Linear trend + seasonal decomposition forecast based on historical data in current filter, "
+           "seasonal by calendar month (by weekday for days, week of year for weeks, quarter for quarters). "
+           "The shaded band is a 90% prediction interval from 2,000 bootstrap paths, or ±1.5σ of the residuals.")
+
+_fc_bands = {"bootstrap": "Bootstrap 90%", "sigma": "±1.5σ"}
 
 _fc_col1, _fc_col2 = st.columns([3, 1])
 with _fc_col2:
     _fc_months = st.selectbox("Forecast horizon", [3, 6, 12], index=1, key="fc_months",
                                format_func=lambda x: f"{x} months")
-    _fc_dim = st.selectbox("Breakdown by", ["Total", "Category", "Region"], key="fc_dim")
-
-_fc_df = filtered_df.copy()
-_fc_df['Month_dt'] = pd.to_datetime(_fc_df['Order Date']).dt.to_period('M').dt.to_timestamp()
-
-if _fc_dim == "Total":
-    _series_dict = {"Total": _fc_df.groupby('Month_dt')['Sales'].sum()}
-elif _fc_dim == "Category":
-    _series_dict = {cat: grp.groupby('Month_dt')['Sales'].sum()
-                    for cat, grp in _fc_df.groupby('Category')}
-else:
-    _series_dict = {reg: grp.groupby('Month_dt')['Sales'].sum()
-                    for reg, grp in _fc_df.groupby('Region')}
-
-def _forecast_series(series, n_months):
-    series = series.sort_index().asfreq('MS', fill_value=0)
-    if len(series) < 4:
-        return None, None, None
-    y = series.values.astype(float)
-    x = np.arange(len(y))
-    coeffs = np.polyfit(x, y, 1)
-    trend  = np.poly1d(coeffs)
-    detrended = y - trend(x)
-    months = series.index.month
-    seasonal = np.array([detrended[months == m].mean() if (months == m).any() else 0 for m in range(1, 13)])
-    last_date = series.index[-1]
-    future_dates = pd.date_range(last_date + pd.DateOffset(months=1), periods=n_months, freq='MS')
-    future_x = np.arange(len(y), len(y) + n_months)
-    future_trend = trend(future_x)
-    future_seasonal = np.array([seasonal[d.month - 1] for d in future_dates])
-    forecast = np.maximum(future_trend + future_seasonal, 0)
-    residuals = y - (trend(x) + np.array([seasonal[m-1] for m in months]))
-    sigma = residuals.std() * 1.5
-    lower = np.maximum(forecast - sigma, 0)
-    upper = forecast + sigma
-    return series, pd.Series(forecast, index=future_dates), (
-        pd.Series(lower, index=future_dates),
-        pd.Series(upper, index=future_dates)
-    )
+    _fc_dim = st.selectbox("Breakdown by", list(FORECAST_DIMS), key="fc_dim")
+    _fc_interval = st.selectbox("Band", list(INTERVALS), key="fc_interval", format_func=_fc_bands.get)
+    _fc_grain = st.selectbox("Grain", GRAINS, index=GRAINS.index("Month"), key="fc_grain")
+
+# Every series of the breakdown is fitted in one batch and the results are
+# cached: the chart and all three summary cards read these fits, so each
+# series is fitted once per (filter state, breakdown, horizon).  Bootstrap
+# paths are kept per series, so changing the horizon does not re-simulate.
+with st.spinner("Fitting forecasts…"):
+    _fc_results = engine.forecast(_filters, _fc_dim, _fc_months, _fc_interval, _fc_grain)
 
 _dim_colors = {
     "Total":          "#4299e1",
@@ -1252,6 +985,7 @@ _dim_colors = {
     "Central":        "#ed8936",
     "South":          "#9f7aea",
 }
+_fc_palette = px.colors.qualitative.Plotly
 
 with _fc_col1:
     fig_fc = go.Figure()
@@ -1259,9 +993,8 @@ with _fc_col1:
     _fc_growth_pcts = []
     _hist = None
 
-    for _dim_name, _dim_series in _series_dict.items():
-        _color = _dim_colors.get(_dim_name, "#90cdf4")
-        _hist, _fc_vals, _ci = _forecast_series(_dim_series, _fc_months)
+    for _i, (_dim_name, (_hist, _fc_vals, _ci)) in enumerate(_fc_results.items()):
+        _color = _dim_colors.get(_dim_name, _fc_palette[_i % len(_fc_palette)])
         if _hist is None:
             continue
 
@@ -1269,9 +1002,9 @@ with _fc_col1:
             x=_hist.index, y=_hist.values,
             name=f"{_dim_name} (actual)",
             line=dict(color=_color, width=2.5),
-            mode="lines+markers",
+            mode="lines+markers" if len(_hist) <= _MARKED_BUCKETS else "lines",
             marker=dict(size=5),
-            hovertemplate=f"<b>{_dim_name}</b><br>%{{x|%b %Y}}<br>Actual: $%{{y:,.0f}}<extra></extra>"
+            hovertemplate=f"<b>{_dim_name}</b><br>%{{x|{_grain_dates[_fc_grain]}}}<br>Actual: $%{{y:,.0f}}<extra></extra>"
         ))
 
         _bridge_x = [_hist.index[-1], _fc_vals.index[0]]
@@ -1287,7 +1020,7 @@ with _fc_col1:
             line=dict(color=_color, width=2.5, dash='dash'),
             mode="lines+markers",
             marker=dict(size=6, symbol='diamond'),
-            hovertemplate=f"<b>{_dim_name} forecast</b><br>%{{x|%b %Y}}<br>$%{{y:,.0f}}<extra></extra>"
+            hovertemplate=f"<b>{_dim_name} forecast</b><br>%{{x|{_grain_dates[_fc_grain]}}}<br>$%{{y:,.0f}}<extra></extra>"
         ))
 
         _lo, _hi = _ci
@@ -1301,7 +1034,7 @@ with _fc_col1:
         ))
 
         _fc_total_next += _fc_vals.sum()
-        _last_period_actual = _hist.tail(_fc_months).sum()
+        _last_period_actual = _hist.tail(len(_fc_vals)).sum()
         if _last_period_actual > 0:
             _fc_growth_pcts.append((_fc_vals.sum() - _last_period_actual) / _last_period_actual * 100)
 
@@ -1310,7 +1043,7 @@ with _fc_col1:
 
     fig_fc.update_layout(
         title=dict(text=f"Sales Forecast — Next {_fc_months} Months", font=dict(size=14), x=0.5),
-        xaxis=dict(title="", tickformat="%b %Y", tickangle=-30),
+        xaxis=dict(title="", tickformat=_grain_ticks[_fc_grain], tickangle=-30),
         yaxis=dict(tickprefix="$", tickformat=",.0f", gridcolor="rgba(128,128,128,0.15)"),
         plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)",
         legend=dict(orientation="h", yanchor="bottom", y=-0.35, xanchor="center", x=0.5,
@@ -1345,9 +1078,8 @@ with _fc_sum_cols[1]:
     </div>""", unsafe_allow_html=True)
 
 with _fc_sum_cols[2]:
-    _best_dim = max(_series_dict.keys(),
-                    key=lambda k: _forecast_series(_series_dict[k], _fc_months)[1].sum()
-                    if _forecast_series(_series_dict[k], _fc_months)[1] is not None else 0)
+    _best_dim = max(_fc_results,
+                    key=lambda k: _fc_results[k][1].sum() if _fc_results[k][1] is not None else 0)
     st.markdown(f"""
     <div class="insight-card">
       <div class="icon">🏆</div>
@@ -1358,24 +1090,25 @@ with _fc_sum_cols[2]:
 
 st.markdown("---")
 
+_prof.mark('forecast', rows=len(_cells))
+
 # ── CITIES TABLE ──────────────────────────────────────────────────────────────
 st.header("🏙️ Top Cities by Sales")
 
-# City table uses filtered_df which already has all active filters applied
-# (year, category, segment, region cards, clicked state)
-_city_base = filtered_df
-
-_agg = _city_base.groupby(['City', 'State']).agg(
-    **{
-        'Total Sales': ('Sales',       'sum'),
-        'Orders':      ('Order ID',    'nunique'),
-        'Customers':   ('Customer ID', 'nunique'),
-    }
-).reset_index()
-_agg['Avg Order'] = _agg['Total Sales'] / _agg['Orders']
-_agg = _agg.sort_values('Total Sales', ascending=False).reset_index(drop=True)
-_agg.index += 1
-_agg = _agg[['State', 'City', 'Total Sales', 'Orders', 'Customers', 'Avg Order']]
+_ct1, _ct2, _ct3 = st.columns([2, 1, 1])
+with _ct1:
+    _city_search = st.text_input("Search city or state", key="city_search", placeholder="e.g. san, or Texas")
+with _ct2:
+    _city_sort = st.selectbox("Sort by", CITY_SORTS, key="city_sort")
+with _ct3:
+    _city_order = st.selectbox("Order", ["Descending", "Ascending"], key="city_order")
+
+# City table uses all active filters
+# (year, category, segment, region cards, clicked state).  Only the rows on
+# screen are counted and formatted; "Show more" fetches the next page.
+with st.spinner("Ranking cities…"):
+    _agg, _n_cities = engine.city_page(_filters, _distinct_mode, _city_sort, _city_order == "Ascending",
+                                       0, _city_rows, _city_search)
 
 st.dataframe(
     _agg.style.format({
@@ -1387,5 +1120,40 @@ st.dataframe(
     use_container_width=True,
     height=420,
 )
+_cm1, _cm2 = st.columns([5, 1])
+_cm1.caption(f"Showing {len(_agg):,} of {_n_cities:,} cities")
+if len(_agg) < _n_cities:
+    with _cm2:
+        if st.button("Show more", key="city_more", use_container_width=True):
+            st.session_state.city_rows = _city_rows + CITY_PAGE_ROWS
+            st.rerun()
 
 st.markdown("---")
+
+_prof.mark('city_table', rows=len(_cells))
+_prof.finish()
+
+with st.sidebar:
+    with st.expander("Section cache"):
+        st.dataframe(pd.DataFrame({**engine.cache.stats(), **fragments.cache.stats(),
+                                   **map_figure.cache.stats()}).T,
+                     use_container_width=True)
+    with st.expander("Profiling"):
+        st.checkbox("Profile every rerun of this session", key='profile_session')
+        st.checkbox("Trace allocations (slow)", key='profile_memory')
+        _session = getattr(get_script_run_ctx(), 'session_id', None)
+        _records = profiling.profiler.records(_session)
+        if _records:
+            _last = _records[-1]
+            st.caption(f"Rerun #{_last['run']}: {_last['total_ms']:,.0f} ms"
+                       + ("" if _last['complete'] else " (stopped early)"))
+            st.dataframe(pd.DataFrame(_last['sections']).set_index('section'), use_container_width=True)
+            st.caption(f"Last {len(_records)} profiled reruns of this session")
+            st.dataframe(pd.DataFrame(profiling.profiler.summary(_session)).T, use_container_width=True)
+            st.download_button("Download JSON lines", profiling.profiler.jsonl(_session),
+                               file_name='profile.jsonl', mime='application/x-ndjson')
+        else:
+            st.caption("No profiled reruns yet. Tick the box above, or set "
+                       "SUPERSTORE_PROFILE_EVERY=N to sample every Nth rerun.")
+        if profiling.profiler.log_path:
+            st.caption(f"Appending every profiled rerun to `{profiling.profiler.log_path}`")
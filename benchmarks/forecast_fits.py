@@ -0,0 +1,68 @@
+"""Check that a dashboard rerun fits every forecast series exactly once.
+
+Runs app.py headlessly through Streamlit's AppTest for each forecast
+breakdown and horizon, and reads ``forecast.fit_counts`` (the app imports
+the same module object) before and after every rerun:
+
+* a rerun with a new (filters, breakdown, horizon) fits each series once;
+* its bootstrap band simulates each series once for the first horizon of
+  a breakdown and not at all for the others (``forecast.simulation_counts``);
+* a rerun with unchanged inputs fits nothing (the result store is hit).
+
+Usage:  python benchmarks/forecast_fits.py
+"""
+import os
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import forecast
+
+BREAKDOWNS = ["Total", "Category", "Region", "Segment", "Sub-Category", "State"]
+HORIZONS   = [3, 6, 12]
+
+
+def _rerun(at):
+    before, simulated = Counter(forecast.fit_counts), Counter(forecast.simulation_counts)
+    t0 = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - t0
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return forecast.fit_counts - before, forecast.simulation_counts - simulated, elapsed
+
+
+def main():
+    st.cache_resource.clear()
+    at = AppTest.from_file(os.path.join(ROOT, 'app.py'), default_timeout=300)
+
+    print(f"{'breakdown':<14}{'horizon':>8}{'series':>8}{'max fits':>10}{'simulated':>10}"
+          f"{'rerun s':>10}{'cached s':>10}")
+    for dim in BREAKDOWNS:
+        for months in HORIZONS:
+            at.session_state['fc_dim']    = dim
+            at.session_state['fc_months'] = months
+            fits, sims, elapsed = _rerun(at)
+            again, _, cached = _rerun(at)
+
+            n_series = len(fits)
+            assert n_series and set(fits.values()) == {1}, f"{dim}/{months}: {dict(fits)}"
+            assert not again, f"{dim}/{months} refitted on an unchanged rerun: {dict(again)}"
+            if months == HORIZONS[0]:
+                assert sims and set(sims.values()) == {1}, f"{dim}/{months} simulations: {dict(sims)}"
+            else:
+                assert not sims, f"{dim}/{months} re-simulated for a new horizon: {dict(sims)}"
+            print(f"{dim:<14}{months:>8}{n_series:>8}{max(fits.values()):>10}{len(sims):>10}"
+                  f"{elapsed:>10.3f}{cached:>10.3f}")
+    print("ok: every series fitted exactly once per rerun and simulated once per breakdown")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Check that the HTTP endpoint keeps A/B group order apart in its cache.
+
+The first ``group`` of ``/ab`` is the reference every other group is tested
+against, so the same groups in another order are a different question.
+Starts the JSON server on a free local port, asks ``/ab`` for two groups in
+both orders (each twice, so the second asks are served from the response
+cache) and checks that the answers come back reversed and match
+:func:`query.answer` called directly.
+
+Usage:  python benchmarks/http_group_order.py
+"""
+import json
+import os
+import sys
+import threading
+from urllib.request import urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import query
+
+ORDERS = ('group=Segment:Corporate&group=Segment:Consumer',
+          'group=Segment:Consumer&group=Segment:Corporate')
+
+
+def _totals(answer):
+    return [round(g['total'], 2) for g in answer['groups']]
+
+
+def main():
+    engine = query.QueryEngine(query.load_cube()[0])
+    server = query.make_server(engine, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}/ab?'
+    try:
+        for _ in range(2):
+            served = []
+            for q in ORDERS:
+                with urlopen(base + q) as resp:
+                    served.append(json.load(resp))
+                direct = _totals(query.answer(engine, '/ab', q))
+                assert _totals(served[-1]) == direct, f"{q}: served {_totals(served[-1])}, expected {direct}"
+                assert served[-1]['groups'][0]['significance'] is None, f"{q}: first group was tested"
+            first, second = (_totals(a) for a in served)
+            assert first == second[::-1], f"reordered groups gave {first} and {second}"
+            print(f"{first} / {second}")
+    finally:
+        server.shutdown()
+    print("ok: reordered A/B groups get their own answer over HTTP, cached or not")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Measure the peak allocation of one dashboard rerun against dataset size.
+
+Builds a cube over the store frame replicated 1x, 4x and 16x (Order IDs are
+suffixed per copy, so distinct counts grow too) and, under tracemalloc,
+runs the section calls of one cache-miss rerun through a fresh
+``QueryEngine``.  Every section reads the shared base / full cell
+selections, so the rerun peak follows the number of cube cells, not the
+number of raw rows; the last column shows what copying the raw frame once
+per base-filtered section (region cards and map) would have cost instead.
+
+Usage:  python benchmarks/rerun_memory.py
+"""
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pandas as pd
+
+import datastore
+from cube import SalesCube
+from query import QueryEngine
+
+COPIES = [1, 4, 16]
+FILTERS = {'year': [2017, 2018], 'category': ['Technology', 'Furniture'], 'segment': ['Consumer'],
+           'region': ['West', 'East'], 'state': [], 'city': []}
+AB = (('Region', 'West'), ('Region', 'East'))
+
+
+def replicate(df, copies):
+    frames = []
+    for i in range(copies):
+        part = df.copy()
+        part['Order ID'] = part['Order ID'].astype(str) + f'-{i}'
+        frames.append(part)
+    out = pd.concat(frames, ignore_index=True)
+    out['Order ID'] = out['Order ID'].astype('category')
+    return out
+
+
+def rerun(engine):
+    engine.cells(FILTERS)
+    engine.metrics(FILTERS)
+    engine.trend(FILTERS)
+    engine.region_cards(FILTERS)
+    engine.map_data(FILTERS)
+    engine.state_summary(FILTERS)
+    engine.ab_stats(FILTERS, *AB)
+    engine.ab_trend(FILTERS, AB)
+    engine.ab_category(FILTERS, *AB)
+    engine.ab_significance(FILTERS, AB)
+    engine.city_page(FILTERS)
+    engine.forecast(FILTERS, 'Region', 6)
+
+
+def main():
+    base = datastore.load()
+    print(f"{'copies':>7}{'rows':>10}{'cells':>8}{'frame MB':>10}{'rerun peak MB':>15}{'2 copies MB':>13}")
+    for copies in COPIES:
+        df = replicate(base, copies)
+        cube = SalesCube(df)
+        rerun(QueryEngine(cube))            # warm up imports and lazy state
+        engine = QueryEngine(cube)
+        tracemalloc.start()
+        rerun(engine)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        frame_mb = df.memory_usage(deep=True).sum() / 2**20
+        print(f"{copies:>7}{len(df):>10}{len(cube.cells):>8}{frame_mb:>10.1f}"
+              f"{peak / 2**20:>15.2f}{2 * frame_mb:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Scaling benchmark for the dashboard's data path, run headlessly.
+
+For each dataset size a synthetic CSV with the ``cleaned_train.csv`` schema
+is written by :mod:`synth` (orders drawn from distributions learned from
+the bundled file), ingested into a columnar store in chunks and built into
+a sales cube.  Then every scenario runs the query-engine calls
+of one dashboard rerun, stage by stage:
+
+=============  ==============================================================
+``filter``     the filtered cell selection
+``aggregate``  KPIs and rollups, the sales trend, region cards, map data, the
+               insight banner
+``ab``         A/B statistics, trend overlay, category breakdown and significance
+``forecast``   the forecast section
+``table``      the city table's first page, as the dashboard shows it
+=============  ==============================================================
+
+Each repetition starts from an empty section cache, so every stage is a
+cache miss.  Latency percentiles come from untraced repetitions; the peak
+allocation of each stage from one extra run under tracemalloc.  Loading
+(chunked ingest, then the cube build) is measured once per size, untraced:
+tracemalloc slows it down tenfold, so its peak is the growth of the
+process's resident set, sampled every few milliseconds (Linux only).
+
+Usage::
+
+    python benchmarks/suite.py                       # 10k and 1M rows
+    python benchmarks/suite.py --sizes 10k,1m,10m --repeat 10
+    python benchmarks/suite.py --json results.json
+    python benchmarks/suite.py --baseline results.json   # exit 1 on regression
+
+With ``--baseline``, any stage whose p50 is more than ``--tolerance``
+(default 25%) slower than in the baseline file is reported as a regression.
+Generated datasets are kept in ``--data-dir`` and reused on the next run.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+
+import datastore
+import synth
+from cube import SalesCube
+from query import QueryEngine
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+
+DEFAULT_AB = (('Segment', 'Consumer'), ('Segment', 'Corporate'))
+
+# name -> (filters, A/B groups, (forecast breakdown, months))
+SCENARIOS = {
+    'no_filters':      ({}, DEFAULT_AB, ('Total', 6)),
+    'single_state':    ({'state': ['California']}, DEFAULT_AB, ('Total', 6)),
+    'multi_region':    ({'region': ['East', 'West']}, DEFAULT_AB, ('Total', 6)),
+    'ab_by_state':     ({}, (('State', 'California'), ('State', 'New York')), ('Total', 6)),
+    'forecast_region': ({}, DEFAULT_AB, ('Region', 12)),
+}
+
+STAGES = ('filter', 'aggregate', 'ab', 'forecast', 'table')
+
+SEED = 7
+MEMORY_MB = 256
+
+
+# ── measurement ──────────────────────────────────────────────────────────────
+def stages(engine, filters, ab, fc):
+    a, b = ab
+    return {
+        'filter':    lambda: engine.cells(filters),
+        'aggregate': lambda: (engine.metrics(filters), engine.trend(filters), engine.region_cards(filters),
+                              engine.map_data(filters), engine.state_summary(filters)),
+        'ab':        lambda: (engine.ab_stats(filters, a, b), engine.ab_trend(filters, ab),
+                              engine.ab_category(filters, a, b), engine.ab_significance(filters, ab)),
+        'forecast':  lambda: engine.forecast(filters, *fc),
+        'table':     lambda: engine.city_page(filters),
+    }
+
+
+def run_scenario(cube, filters, ab, fc, repeat):
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        calls = stages(QueryEngine(cube), filters, ab, fc)
+        for stage in STAGES:
+            t0 = time.perf_counter()
+            calls[stage]()
+            timings[stage].append((time.perf_counter() - t0) * 1000)
+    peaks = {}
+    calls = stages(QueryEngine(cube), filters, ab, fc)
+    for stage in STAGES:
+        peaks[stage] = datastore.traced_peak(calls[stage])[1]
+    return {stage: {'p50_ms': float(np.percentile(timings[stage], 50)),
+                    'p95_ms': float(np.percentile(timings[stage], 95)),
+                    'max_ms': float(np.max(timings[stage])),
+                    'peak_mb': peaks[stage] / 2**20}
+            for stage in STAGES}
+
+
+def _rss():
+    with open('/proc/self/statm') as fh:
+        return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class PeakRSS:
+    """Peak resident-set growth (MB) while the ``with`` block runs, or None."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak_mb  = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, _rss())
+
+    def __enter__(self):
+        if not os.path.exists('/proc/self/statm'):
+            return self
+        self._start = self._peak = _rss()
+        self._stop  = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if hasattr(self, '_thread'):
+            self._stop.set()
+            self._thread.join()
+            self.peak_mb = (max(self._peak, _rss()) - self._start) / 2**20
+
+
+def load(csv_path, store_dir):
+    t0 = time.perf_counter()
+    with PeakRSS() as ingest_peak:
+        datastore.build_store(csv_path, store_dir, datastore.chunk_rows_for(MEMORY_MB, csv_path), trace=False)
+    ingest_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    with PeakRSS() as cube_peak:
+        cube = SalesCube.from_frames(datastore.iter_frames(store_dir))
+    return cube, {'ingest_s': ingest_s, 'ingest_peak_mb': ingest_peak.peak_mb,
+                  'cube_s': time.perf_counter() - t0, 'cube_peak_mb': cube_peak.peak_mb,
+                  'cells': len(cube.cells)}
+
+
+def bench_size(label, rows, data_dir, repeat):
+    csv_path = os.path.join(data_dir, f'superstore_{label}.csv')
+    if not os.path.exists(csv_path):
+        t0 = time.perf_counter()
+        synth.write_csv(csv_path, rows, seed=SEED)
+        print(f"  generated {rows:,} rows in {time.perf_counter() - t0:.1f}s")
+    store_dir = os.path.join(data_dir, f'store_{label}')
+    try:
+        cube, load_stats = load(csv_path, store_dir)
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    mb = lambda v: 'n/a' if v is None else f'{v:.1f} MB'
+    print(f"  load: ingest {load_stats['ingest_s']:.2f}s (peak RSS +{mb(load_stats['ingest_peak_mb'])}), "
+          f"cube {load_stats['cube_s']:.2f}s (peak RSS +{mb(load_stats['cube_peak_mb'])}), "
+          f"{load_stats['cells']:,} cells")
+    scenarios = {}
+    print(f"  {'scenario':<16}{'stage':<11}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'peak MB':>9}")
+    for name, (filters, ab, fc) in SCENARIOS.items():
+        scenarios[name] = run_scenario(cube, filters, ab, fc, repeat)
+        for stage, s in scenarios[name].items():
+            print(f"  {name:<16}{stage:<11}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}"
+                  f"{s['max_ms']:>9.2f}{s['peak_mb']:>9.2f}")
+    return {'rows': rows, 'load': load_stats, 'scenarios': scenarios}
+
+
+def regressions(results, baseline, tolerance):
+    """``(size, scenario, stage, baseline p50, p50)`` slower than ``tolerance`` allows."""
+    found = []
+    for size, result in results.items():
+        for name, stages_ in result['scenarios'].items():
+            for stage, s in stages_.items():
+                before = baseline.get(size, {}).get('scenarios', {}).get(name, {}).get(stage)
+                if before and s['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+                    found.append((size, name, stage, before['p50_ms'], s['p50_ms']))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10k,1m', help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'superstore-bench'))
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file to compare p50 latencies against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {}
+    for label in args.sizes.split(','):
+        print(f"{label} rows")
+        results[label] = bench_size(label, SIZES[label], args.data_dir, args.repeat)
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=1)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            found = regressions(results, json.load(fh), args.tolerance)
+        for size, name, stage, before, now in found:
+            print(f"REGRESSION {size} {name} {stage}: p50 {before:.2f} -> {now:.2f} ms")
+        if found:
+            return 1
+        print(f"ok: no stage slower than {args.tolerance:.0%} over the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
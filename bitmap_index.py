@@ -0,0 +1,225 @@
+"""Bitmap index over the dashboard's filter dimensions.
+
+Built once per loaded dataset.  Every distinct value of every indexed column
+gets a container holding the rows where it occurs:
+
+* dense values (more than 1 row in 32) keep a packed bitmap, ``n_rows / 8``
+  bytes, combined with ``np.bitwise_or`` / ``np.bitwise_and``;
+* sparse values (a single city, a small state) keep their sorted row ids,
+  which is smaller than a bitmap and lets a selection that contains them be
+  resolved by probing only those rows.
+
+A selection is a mapping ``{column: [values]}``; empty or missing columns
+are unfiltered, values inside a column are OR-ed and columns are AND-ed.
+
+Rows appended after the build (:meth:`BitmapIndex.append`) extend the
+existing containers; new values start out sparse.  :meth:`BitmapIndex.save`
+and :meth:`BitmapIndex.attach` share a built index between processes as
+memory-mapped files.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FILTER_DIMS = ('Region', 'Category', 'Segment', 'Year', 'State', 'City')
+
+_SPARSE_RATIO = 32
+
+
+class BitmapIndex:
+    def __init__(self, df, columns=FILTER_DIMS):
+        self.n_rows  = len(df)
+        self.n_bytes = (self.n_rows + 7) // 8
+        self._containers = {col: self._build(df[col]) for col in columns}
+
+    # ── build ────────────────────────────────────────────────────────────────
+    def _build(self, col):
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            codes, values = col.cat.codes.to_numpy(), col.cat.categories
+        else:
+            codes, values = pd.factorize(col, sort=True)
+        order  = np.argsort(codes, kind='stable').astype(np.int64)
+        bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+        dense_min = max(self.n_rows // _SPARSE_RATIO, 1)
+
+        containers = {}
+        for code, value in enumerate(values.tolist()):
+            ids = order[bounds[code]:bounds[code + 1]]
+            if len(ids) >= dense_min:
+                containers[value] = ('bitmap', self._pack(ids))
+            else:
+                containers[value] = ('rows', ids)
+        return containers
+
+    def append(self, df):
+        """Index ``df`` as the rows following the current last row."""
+        start = self.n_rows
+        self.n_rows += len(df)
+        grow = (self.n_rows + 7) // 8 - self.n_bytes
+        self.n_bytes += grow
+        for column, containers in self._containers.items():
+            if grow:
+                for value, (kind, payload) in containers.items():
+                    if kind == 'bitmap':
+                        containers[value] = (kind, np.concatenate((payload, np.zeros(grow, np.uint8))))
+            codes, values = pd.factorize(df[column])
+            order  = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            for code, value in enumerate(values.tolist()):
+                ids = start + order[bounds[code]:bounds[code + 1]].astype(np.int64)
+                kind, payload = containers.get(value, ('rows', np.empty(0, np.int64)))
+                if kind == 'bitmap':
+                    self._set_bits(payload, ids)
+                else:
+                    containers[value] = ('rows', np.concatenate((payload, ids)))
+
+    def _pack(self, ids):
+        bits = np.zeros(self.n_rows, dtype=bool)
+        bits[ids] = True
+        return np.packbits(bits)
+
+    def _set_bits(self, bitmap, ids):
+        np.bitwise_or.at(bitmap, ids >> 3, (0x80 >> (ids & 7)).astype(np.uint8))
+
+    @staticmethod
+    def _test_bits(bitmap, ids):
+        return ((bitmap[ids >> 3] >> (7 - (ids & 7))) & 1).astype(bool)
+
+    # ── query ────────────────────────────────────────────────────────────────
+    def values(self, column):
+        return list(self._containers[column])
+
+    def _column_bitmap(self, column, values):
+        """OR of the containers for ``values`` in ``column``."""
+        containers = self._containers[column]
+        acc = np.zeros(self.n_bytes, dtype=np.uint8)
+        for v in values:
+            kind, payload = containers.get(v, ('rows', np.empty(0, np.int64)))
+            if kind == 'bitmap':
+                np.bitwise_or(acc, payload, out=acc)
+            else:
+                self._set_bits(acc, payload)
+        return acc
+
+    def _column_rows(self, column, values):
+        """Sorted row ids for ``values`` if they are all sparse, else None."""
+        containers = self._containers[column]
+        parts = []
+        for v in values:
+            kind, payload = containers.get(v, ('rows', np.empty(0, np.int64)))
+            if kind == 'bitmap':
+                return None
+            parts.append(payload)
+        return np.sort(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+
+    def bitmap(self, selection):
+        """Packed bitmap for ``selection``, or None when nothing is filtered."""
+        active = [(c, v) for c, v in selection.items() if v]
+        if not active:
+            return None
+        acc = self._column_bitmap(*active[0])
+        for column, values in active[1:]:
+            np.bitwise_and(acc, self._column_bitmap(column, values), out=acc)
+        return acc
+
+    def rows(self, selection, within=None):
+        """Ascending row positions matching ``selection``.
+
+        ``within`` is an optional packed bitmap (e.g. from :meth:`bitmap`)
+        that the result is further AND-ed with.
+        """
+        active = [(c, v) for c, v in selection.items() if v]
+
+        # Cheapest sparse column drives the lookup; everything else is a probe.
+        best = None
+        for column, values in active:
+            ids = self._column_rows(column, values)
+            if ids is not None and (best is None or len(ids) < len(best[1])):
+                best = (column, ids)
+
+        if best is None:
+            acc = self.bitmap(dict(active))
+            if within is not None:
+                acc = within.copy() if acc is None else np.bitwise_and(acc, within)
+            if acc is None:
+                return np.arange(self.n_rows)
+            return np.flatnonzero(np.unpackbits(acc, count=self.n_rows))
+
+        column, ids = best
+        keep = np.ones(len(ids), dtype=bool)
+        for other, values in active:
+            if other != column:
+                keep &= self._test_bits(self._column_bitmap(other, values), ids)
+        if within is not None:
+            keep &= self._test_bits(within, ids)
+        return ids[keep]
+
+    def narrow(self, rows, selection):
+        """The members of ascending ``rows`` that also match ``selection``.
+
+        Costs a probe per row in ``rows``, so a selection refined from a
+        shared base (e.g. base filters plus a region) never rescans the index.
+        """
+        keep = np.ones(len(rows), dtype=bool)
+        for column, values in selection.items():
+            if not values:
+                continue
+            ids = self._column_rows(column, values)
+            if ids is None:
+                keep &= self._test_bits(self._column_bitmap(column, values), rows)
+            elif len(ids):
+                pos   = np.minimum(np.searchsorted(ids, rows), len(ids) - 1)
+                keep &= ids[pos] == rows
+            else:
+                keep[:] = False
+        return rows[keep]
+
+    def mask(self, selection, within=None):
+        """Boolean row mask for ``selection``."""
+        out = np.zeros(self.n_rows, dtype=bool)
+        out[self.rows(selection, within)] = True
+        return out
+
+    def nbytes(self):
+        return sum(p.nbytes for cont in self._containers.values() for _, p in cont.values())
+
+    # ── sharing ──────────────────────────────────────────────────────────────
+    def save(self, path):
+        """Write the containers to directory ``path`` (created)."""
+        os.makedirs(path)
+        parts   = {'bitmap': [], 'rows': []}
+        offsets = {'bitmap': 0, 'rows': 0}
+        columns = {}
+        for column, containers in self._containers.items():
+            entries = []
+            for value, (kind, payload) in containers.items():
+                entries.append([value, kind, offsets[kind], len(payload)])
+                parts[kind].append(payload)
+                offsets[kind] += len(payload)
+            columns[column] = entries
+        for kind, dtype in (('bitmap', np.uint8), ('rows', np.int64)):
+            data = np.concatenate(parts[kind]) if parts[kind] else np.empty(0, dtype)
+            np.save(os.path.join(path, kind + '.npy'), data.astype(dtype, copy=False))
+        with open(os.path.join(path, 'index.json'), 'w') as fh:
+            json.dump({'n_rows': self.n_rows, 'columns': columns}, fh)
+
+    @classmethod
+    def attach(cls, path):
+        """Index over the files written by :meth:`save`, memory-mapped.
+
+        The maps are copy-on-write: appends stay private to this process.
+        """
+        with open(os.path.join(path, 'index.json')) as fh:
+            meta = json.load(fh)
+        data = {kind: np.asarray(np.load(os.path.join(path, kind + '.npy'), mmap_mode='c'))
+                for kind in ('bitmap', 'rows')}
+        index = cls.__new__(cls)
+        index.n_rows  = meta['n_rows']
+        index.n_bytes = (index.n_rows + 7) // 8
+        index._containers = {
+            column: {value: (kind, data[kind][start:start + n]) for value, kind, start, n in entries}
+            for column, entries in meta['columns'].items()
+        }
+        return index
@@ -0,0 +1,356 @@
+"""Pre-aggregated sales cube for the dashboard's KPI and chart rollups.
+
+The raw rows are grouped once, at load time, to the finest grain any chart
+needs (``CUBE_DIMS``).  Each cell holds the sales sum, the line count and the
+number of distinct orders and customers in it.  Charts filter the cells with
+the same bitmap index the raw frame uses and then roll them up, which scans
+thousands of cells instead of millions of rows.  Finer than the month, each
+cell's sales per day are kept by :mod:`timeseries`.
+
+Sales and line counts roll up exactly.  Per-cell distinct counts only sum
+exactly when no ID can sit in two cells of the same output group, i.e. when
+the rollup keeps every dimension the ID varies over (an order spans several
+categories; a customer spans regions).  Which dimensions are fixed per ID is
+measured from the data at build time; every other distinct count is merged
+from the per-cell ID sets kept by :mod:`distinct`, exactly or via
+HyperLogLog sketches depending on the mode.
+
+Orders appended to the store are folded in with :meth:`SalesCube.append`:
+the delta is grouped on its own, matching cells are topped up and new
+cells are added at the end, so positions already handed out stay valid.
+The work is proportional to the delta plus the number of cells, never to
+the raw history.  The updated cells, distinct counters and daily sums are
+built as new objects and swapped in together, so a reader sees each of
+them either before or after an append, never half-way.  The same path builds a cube block by block
+(:meth:`SalesCube.from_frames`) for stores too large to hold in memory.
+
+A built cube can be published as a directory of ``.npy`` files
+(:meth:`SalesCube.publish`) that other processes attach to
+(:meth:`SalesCube.attach`) as copy-on-write memory maps: the pages are
+shared through the OS page cache, so every extra process costs almost no
+memory and starts without aggregating anything.
+"""
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+import parallel
+from bitmap_index import BitmapIndex, FILTER_DIMS
+from distinct import DistinctCounter
+from timeseries import DailySales, day_numbers
+
+CUBE_DIMS = ('Year', 'Month', 'Region', 'State', 'State Code', 'City',
+             'Category', 'Sub-Category', 'Segment', 'Ship Mode')
+
+# distinct-ID column -> per-cell count column
+DISTINCT_COLS = {'Order ID': 'Orders', 'Customer ID': 'Customers'}
+
+_UNSEEN = -2   # no value recorded yet (-1 is a missing categorical value)
+
+
+def _cell_keys(frame):
+    """Hashable value tuples of the cube dimensions, one per row."""
+    cols = [frame[d].astype(object).where(frame[d].notna(), None).tolist() for d in CUBE_DIMS]
+    return list(zip(*cols))
+
+
+def _dim_codes(col):
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return col.cat.codes.to_numpy(dtype=np.int64)
+    return col.to_numpy(dtype=np.int64)
+
+
+def _aggregate(df):
+    # dropna=False keeps District of Columbia (no State Code) in the totals.
+    grouped = df.groupby(list(CUBE_DIMS), observed=True, dropna=False, sort=False)
+    cells = grouped.agg(
+        Sales=('Sales', 'sum'),
+        Lines=('Sales', 'size'),
+    ).reset_index()
+    return cells, grouped.ngroup().to_numpy()
+
+
+class SalesCube:
+    def __init__(self, df, distinct_mode='exact'):
+        self.generation = df.attrs.get('generation', 0)
+        self.cells, cell_of_row = _aggregate(df)
+        self.counters = {}
+        for id_col, count_col in DISTINCT_COLS.items():
+            ids = df[id_col].cat
+            self.counters[id_col] = DistinctCounter(
+                cell_of_row, len(self.cells), ids.codes.to_numpy(), ids.categories)
+            self.cells[count_col] = self.counters[id_col].per_cell()
+        self.daily = DailySales(cell_of_row, day_numbers(df['Order Date']), df['Sales'].to_numpy())
+        self.distinct_mode = distinct_mode
+        self.index = BitmapIndex(self.cells, FILTER_DIMS)
+        self._fixed_per_id = {
+            id_col: {d for d in CUBE_DIMS
+                     if (df.groupby(id_col, observed=True)[d].nunique(dropna=False) <= 1).all()}
+            for id_col in DISTINCT_COLS
+        }
+        # For appends: every cell's position (built on the first append), and
+        # each ID's value of the dimensions it is fixed on (by store code), to
+        # spot a delta breaking it.
+        self._cell_pos  = None
+        self._id_values = {}
+        for id_col, dims in self._fixed_per_id.items():
+            ids = df[id_col].cat
+            self._id_values[id_col] = {}
+            for d in dims:
+                first = np.full(len(ids.categories), _UNSEEN, dtype=np.int64)
+                first[ids.codes.to_numpy()] = _dim_codes(df[d])
+                self._id_values[id_col][d] = first
+        self._lock        = threading.Lock()
+        self._append_lock = threading.Lock()
+
+    @classmethod
+    def from_frames(cls, frames, distinct_mode='exact'):
+        """Build from consecutive row blocks of one store, one block at a time.
+
+        See :func:`datastore.iter_frames`; only a single block's raw rows are
+        in memory at once.
+        """
+        frames = iter(frames)
+        cube = cls(next(frames), distinct_mode)
+        for frame in frames:
+            cube._append(frame)
+        return cube
+
+    def select(self, selection):
+        """Cells matching a ``{column: [values]}`` filter selection."""
+        with self._lock:
+            return self.cells.iloc[self.index.rows(selection)]
+
+    def rows(self, selection, within=None):
+        """Cell positions matching ``selection``, optionally narrowed from ``within``.
+
+        Positions stay valid across appends (new cells only go at the end),
+        so they can be cached and shared; :meth:`take` turns them into cells.
+        """
+        with self._lock:
+            if within is None:
+                return self.index.rows(selection)
+            return self.index.narrow(within, selection)
+
+    def take(self, rows):
+        """The cells at positions ``rows``."""
+        with self._lock:
+            return self.cells.iloc[rows]
+
+    # ── appends ──────────────────────────────────────────────────────────────
+    def catch_up(self, read_since):
+        """Fold in whatever ``read_since(generation)`` reports as new.
+
+        ``read_since`` returns ``(frame, generation)`` like
+        :func:`datastore.read_segments`; ``frame`` is None when nothing is.
+        Returns True if the cube changed.
+        """
+        with self._append_lock:
+            delta, generation = read_since(self.generation)
+            if delta is None or generation <= self.generation:
+                return False
+            self._append(delta)
+            self.generation = generation
+            return True
+
+    def append(self, delta):
+        """Fold newly appended raw rows into the cube.
+
+        ``delta`` must come from the same store as the frame the cube was
+        built from, so that its ID codes line up.
+        """
+        with self._append_lock:
+            self._append(delta)
+            self.generation += 1
+
+    def _append(self, delta):
+        cells = self.cells
+        n_old = len(cells)
+
+        # Keep the cells' categories sorted as new dimension values arrive.
+        for d in CUBE_DIMS:
+            if isinstance(cells[d].dtype, pd.CategoricalDtype):
+                known = cells[d].cat.categories
+                new   = pd.Index(delta[d].dropna().unique()).difference(known)
+                if len(new):
+                    cells = cells.assign(**{d: cells[d].cat.set_categories(known.append(new).sort_values())})
+
+        part, part_of_row = _aggregate(delta)
+        if self._cell_pos is None:
+            self._cell_pos = {key: i for i, key in enumerate(_cell_keys(self.cells))}
+        pos   = np.array([self._cell_pos.get(key, -1) for key in _cell_keys(part)], dtype=np.int64)
+        fresh = pos < 0
+        pos[fresh] = n_old + np.arange(int(fresh.sum()))
+
+        sales = cells['Sales'].to_numpy(copy=True)
+        lines = cells['Lines'].to_numpy(copy=True)
+        np.add.at(sales, pos[~fresh], part['Sales'].to_numpy()[~fresh])
+        np.add.at(lines, pos[~fresh], part['Lines'].to_numpy()[~fresh])
+        added = part[fresh].astype({d: cells[d].dtype for d in CUBE_DIMS})
+        cells = pd.concat([cells.assign(Sales=sales, Lines=lines), added], ignore_index=True)
+
+        cell_of_row = pos[part_of_row]
+        counters = {}
+        for id_col, count_col in DISTINCT_COLS.items():
+            ids = delta[id_col].cat
+            counters[id_col] = self.counters[id_col].added(cell_of_row, len(cells),
+                                                           ids.codes.to_numpy(), ids.categories)
+            cells[count_col] = counters[id_col].per_cell()
+        daily = self.daily.added(cell_of_row, day_numbers(delta['Order Date']), delta['Sales'].to_numpy())
+        self._update_fixed(delta)
+
+        with self._lock:
+            for key, p in zip(_cell_keys(added), range(n_old, len(cells))):
+                self._cell_pos[key] = p
+            self.index.append(cells.iloc[n_old:])
+            self.counters = counters
+            self.daily = daily
+            self.cells = cells
+
+    def _update_fixed(self, delta):
+        """Drop any fixed-per-ID dimension the delta shows an ID varying over."""
+        for id_col, dims in self._fixed_per_id.items():
+            ids = delta[id_col].cat
+            codes = ids.codes.to_numpy()
+            for d in sorted(dims):
+                first = self._id_values[id_col][d]
+                if len(first) < len(ids.categories):
+                    first = np.concatenate((first, np.full(len(ids.categories) - len(first), _UNSEEN)))
+                values = _dim_codes(delta[d])
+                seen   = first[codes]
+                varies = (((seen != _UNSEEN) & (seen != values)).any()
+                          or (delta.groupby(id_col, observed=True)[d].nunique(dropna=False) > 1).any())
+                if varies:
+                    dims.discard(d)
+                    del self._id_values[id_col][d]
+                else:
+                    first[codes] = values
+                    self._id_values[id_col][d] = first
+
+    @staticmethod
+    def totals(cells, by, value='Sales'):
+        """``value`` summed per ``by``, indexed by ``by``; the cube's groupby().sum().
+
+        Large selections are summed in partitions across cores (see :mod:`parallel`).
+        """
+        groups, keys = parallel.group_index(cells, by)
+        return pd.Series(parallel.group_sum(groups, len(keys), cells[value].to_numpy()),
+                         index=keys, name=value)
+
+    @staticmethod
+    def rollup(cells, by, value='Sales'):
+        """:meth:`totals` as a frame, one row per group."""
+        return SalesCube.totals(cells, by, value).reset_index()
+
+    def is_exact(self, id_col, by=()):
+        """True if per-cell distinct counts of ``id_col`` can be summed over ``by``."""
+        return set(CUBE_DIMS) - self._fixed_per_id[id_col] <= set(by)
+
+    def distinct(self, cells, id_col, by=(), mode=None):
+        """Distinct ``id_col`` count over ``cells``, overall or per ``by``.
+
+        ``cells`` must be a selection of :attr:`cells` (its index holds the
+        cell positions).  ``mode`` is ``'exact'`` or ``'hll'`` and defaults
+        to :attr:`distinct_mode`.
+        """
+        by   = list(by)
+        mode = mode or self.distinct_mode
+        if self.is_exact(id_col, by):
+            col = DISTINCT_COLS[id_col]
+            return self.totals(cells, by, col) if by else int(cells[col].sum())
+
+        counter = self.counters[id_col]
+        rows = cells.index.to_numpy()
+        if not by:
+            return counter.count(rows, mode)
+        groups, keys = parallel.group_index(cells, by)
+        keep   = groups >= 0
+        counts = counter.count_by(rows[keep], groups[keep], len(keys), mode)
+        return pd.Series(counts, index=keys, name=id_col)
+
+    def nbytes(self):
+        return (int(self.cells.memory_usage(deep=True).sum()) + self.index.nbytes()
+                + sum(c.nbytes() for c in self.counters.values()) + self.daily.nbytes())
+
+    # ── sharing ──────────────────────────────────────────────────────────────
+    def publish(self, path):
+        """Write the cube to directory ``path``, replacing it atomically."""
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        with self._append_lock:
+            columns = []
+            for i, name in enumerate(self.cells.columns):
+                col, stem = self.cells[name], f'cell{i:02d}'
+                if isinstance(col.dtype, pd.CategoricalDtype):
+                    np.save(os.path.join(tmp, stem + '.codes.npy'), col.cat.codes.to_numpy())
+                    np.save(os.path.join(tmp, stem + '.dict.npy'), np.asarray(col.cat.categories, dtype=str))
+                    columns.append([name, stem, True])
+                else:
+                    np.save(os.path.join(tmp, stem + '.npy'), col.to_numpy())
+                    columns.append([name, stem, False])
+            self.index.save(os.path.join(tmp, 'index'))
+            self.daily.save(os.path.join(tmp, 'daily'))
+            for i, (id_col, counter) in enumerate(self.counters.items()):
+                counter.save(os.path.join(tmp, f'distinct{i}'))
+                for d, first in self._id_values[id_col].items():
+                    np.save(os.path.join(tmp, f'distinct{i}', f'first.{CUBE_DIMS.index(d)}.npy'), first)
+            meta = {
+                'generation':    self.generation,
+                'distinct_mode': self.distinct_mode,
+                'columns':       columns,
+                'distinct':      list(self.counters),
+                'fixed_per_id':  {k: sorted(v) for k, v in self._fixed_per_id.items()},
+            }
+        with open(os.path.join(tmp, 'cube.json'), 'w') as fh:
+            json.dump(meta, fh)
+        old = path + '.old'
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.isdir(path):
+            os.rename(path, old)
+        os.rename(tmp, path)
+        # Processes still mapping the old files keep them until they unmap.
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def attach(cls, path):
+        """Cube over a :meth:`publish`-ed directory, without copying it.
+
+        Arrays are copy-on-write memory maps, so :meth:`catch_up` still
+        works: pages it touches become private to this process.
+        """
+        with open(os.path.join(path, 'cube.json')) as fh:
+            meta = json.load(fh)
+        data = {}
+        for name, stem, is_dict in meta['columns']:
+            if is_dict:
+                codes = np.asarray(np.load(os.path.join(path, stem + '.codes.npy'), mmap_mode='c'))
+                data[name] = pd.Categorical.from_codes(
+                    codes, np.load(os.path.join(path, stem + '.dict.npy')), validate=False)
+            else:
+                data[name] = np.asarray(np.load(os.path.join(path, stem + '.npy'), mmap_mode='c'))
+
+        cube = cls.__new__(cls)
+        cube.generation    = meta['generation']
+        cube.distinct_mode = meta['distinct_mode']
+        cube.cells         = pd.DataFrame(data, copy=False)
+        cube.index         = BitmapIndex.attach(os.path.join(path, 'index'))
+        cube.daily         = DailySales.attach(os.path.join(path, 'daily'))
+        cube.counters      = {}
+        cube._fixed_per_id = {k: set(v) for k, v in meta['fixed_per_id'].items()}
+        cube._id_values    = {}
+        for i, id_col in enumerate(meta['distinct']):
+            sub = os.path.join(path, f'distinct{i}')
+            cube.counters[id_col]   = DistinctCounter.attach(sub)
+            cube._id_values[id_col] = {
+                d: np.asarray(np.load(os.path.join(sub, f'first.{CUBE_DIMS.index(d)}.npy'), mmap_mode='c'))
+                for d in cube._fixed_per_id[id_col]
+            }
+        cube._cell_pos    = None
+        cube._lock        = threading.Lock()
+        cube._append_lock = threading.Lock()
+        return cube
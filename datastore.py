@@ -0,0 +1,505 @@
+"""Columnar on-disk store for the Superstore orders export.
+
+The CSV is parsed once, the derived columns (State Code, Order Date, Year,
+Month) are added, and every column is written as its own ``.npy`` file under
+``STORE_DIR``.  Numeric and date columns are opened memory-mapped, so a cold
+start only pays for the page faults it actually touches.  String columns are
+stored as integer dictionary codes plus a sorted dictionary and come back as
+``pd.Categorical`` columns whose codes are the mapped arrays themselves, so
+``isin``/``==``/``groupby`` on dimensions compare small integers instead of
+hashing Python strings.
+
+``manifest.json`` records the size, mtime and SHA-1 of the source CSV.  The
+store is rebuilt only when the CSV's content changes: a touched-but-identical
+file just refreshes the recorded mtime.
+
+New orders are added without touching the CSV.  :func:`append_rows`
+validates a delta against the store's schema, derives its columns and writes
+it as a numbered segment directory; dictionaries only ever grow at the end,
+so codes already on disk (and in memory) never change.  The store's
+generation counts the segments ever appended, and :func:`read_segments` hands
+a reader exactly the rows it has not seen yet.  :func:`compact` folds the
+segments back into the base columns.  Rebuilding from a changed CSV starts
+over from the CSV alone.
+
+Exports too large to parse in one go are built in chunks
+(``build_store(chunk_rows=...)``, or a memory budget via
+``SUPERSTORE_MEMORY_MB`` / ``build --memory-mb``): the CSV is streamed, the
+first chunk becomes the base columns and every later chunk a segment, so
+the working set is one chunk plus the dictionaries, which are kept in
+memory as they grow and written once at the end.  :func:`iter_frames` reads the store back one
+block at a time for consumers that aggregate as they go, and the manifest
+keeps the ingest report, including the measured peak allocation.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+SOURCE_CSV    = 'cleaned_train.csv'
+STORE_DIR     = '.store'
+STORE_VERSION = 3
+
+# Added by derive_columns(); everything else must be present in a delta.
+DERIVED_COLUMNS = ('State Code', 'Year', 'Month')
+
+# Per-chunk memory budget for chunked ingest; unset means parse in one go.
+MEMORY_BUDGET_MB = float(os.environ.get('SUPERSTORE_MEMORY_MB') or 0) or None
+
+# A parsed chunk, its derived columns and its encoded copy are alive at once.
+_CHUNK_OVERHEAD = 4
+
+# ── State Mapping ─────────────────────────────────────────────────────────────
+us_state_to_abbrev = {
+    "Alabama":"AL","Alaska":"AK","Arizona":"AZ","Arkansas":"AR","California":"CA",
+    "Colorado":"CO","Connecticut":"CT","Delaware":"DE","Florida":"FL","Georgia":"GA",
+    "Hawaii":"HI","Idaho":"ID","Illinois":"IL","Indiana":"IN","Iowa":"IA",
+    "Kansas":"KS","Kentucky":"KY","Louisiana":"LA","Maine":"ME","Maryland":"MD",
+    "Massachusetts":"MA","Michigan":"MI","Minnesota":"MN","Mississippi":"MS","Missouri":"MO",
+    "Montana":"MT","Nebraska":"NE","Nevada":"NV","New Hampshire":"NH","New Jersey":"NJ",
+    "New Mexico":"NM","New York":"NY","North Carolina":"NC","North Dakota":"ND","Ohio":"OH",
+    "Oklahoma":"OK","Oregon":"OR","Pennsylvania":"PA","Rhode Island":"RI","South Carolina":"SC",
+    "South Dakota":"SD","Tennessee":"TN","Texas":"TX","Utah":"UT","Vermont":"VT",
+    "Virginia":"VA","Washington":"WA","West Virginia":"WV","Wisconsin":"WI","Wyoming":"WY"
+}
+abbrev_to_state = {v: k for k, v in us_state_to_abbrev.items()}
+
+
+def derive_columns(df):
+    """Add the columns the dashboard derives from the raw export."""
+    df['State Code'] = df['State'].map(us_state_to_abbrev)
+    df['Order Date'] = pd.to_datetime(df['Order Date'])
+    df['Year']  = df['Order Date'].dt.year
+    df['Month'] = df['Order Date'].dt.to_period('M').astype(str)
+    return df
+
+
+# ── Source fingerprint ────────────────────────────────────────────────────────
+def source_fingerprint(csv_path=SOURCE_CSV):
+    """Cheap (size, mtime_ns) fingerprint; suitable as a cache key."""
+    s = os.stat(csv_path)
+    return s.st_size, s.st_mtime_ns
+
+
+def _sha1(path, chunk=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_manifest(store_dir):
+    try:
+        with open(os.path.join(store_dir, 'manifest.json')) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(store_dir, manifest):
+    path = os.path.join(store_dir, 'manifest.json')
+    with open(path + '.tmp', 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def is_fresh(csv_path=SOURCE_CSV, store_dir=STORE_DIR):
+    """True if the store at ``store_dir`` was built from the current CSV."""
+    manifest = _read_manifest(store_dir)
+    if not manifest or manifest.get('version') != STORE_VERSION:
+        return False
+    size, mtime_ns = source_fingerprint(csv_path)
+    src = manifest['source']
+    if src['size'] == size and src['mtime_ns'] == mtime_ns:
+        return True
+    if src['size'] != size or src['sha1'] != _sha1(csv_path):
+        return False
+    # Same bytes, new mtime (e.g. re-copied file): remember it and skip the rebuild.
+    src['mtime_ns'] = mtime_ns
+    _write_manifest(store_dir, manifest)
+    return True
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+def _code_dtype(n_categories):
+    # Same width pandas picks for Categorical codes, so from_codes() can keep
+    # the memory-mapped array instead of copying it into a narrower one.
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _encode_strings(values):
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), sort=True)
+    return codes.astype(_code_dtype(len(uniques))), np.asarray(uniques, dtype=str)
+
+
+def _write_base(df, tmp_dir, source, generation):
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    columns = []
+    for i, name in enumerate(df.columns):
+        col  = df[name]
+        stem = f'c{i:02d}'
+        if pd.api.types.is_numeric_dtype(col) or pd.api.types.is_datetime64_dtype(col):
+            np.save(os.path.join(tmp_dir, stem + '.npy'), col.to_numpy())
+            columns.append({'name': name, 'kind': 'array', 'file': stem + '.npy'})
+        else:
+            codes, dictionary = _encode_strings(col)
+            np.save(os.path.join(tmp_dir, stem + '.codes.npy'), codes)
+            np.save(os.path.join(tmp_dir, stem + '.dict.npy'), dictionary)
+            columns.append({'name': name, 'kind': 'dict',
+                            'file': stem + '.codes.npy', 'dict': stem + '.dict.npy'})
+
+    _write_manifest(tmp_dir, {
+        'version': STORE_VERSION,
+        'rows':    len(df),
+        'source':  source or {},
+        'columns': columns,
+        # segments folded into the base columns so far / appended since
+        'compacted': generation,
+        'segments':  [],
+    })
+
+
+def _swap_in(tmp_dir, store_dir):
+    old_dir = store_dir + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(store_dir):
+        os.rename(store_dir, old_dir)
+    os.rename(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def write_store(df, store_dir=STORE_DIR, source=None, generation=0):
+    """Write ``df`` column by column into ``store_dir`` (atomically replaced)."""
+    _write_base(df, store_dir + '.tmp', source, generation)
+    _swap_in(store_dir + '.tmp', store_dir)
+
+
+def traced_peak(fn, *args, **kwargs):
+    """``(fn(*args, **kwargs), peak bytes allocated while it ran)``."""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        result = fn(*args, **kwargs)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def chunk_rows_for(memory_mb, csv_path=SOURCE_CSV, sample_rows=1000):
+    """Chunk size whose working set fits ``memory_mb``, from a parsed sample."""
+    sample  = derive_columns(pd.read_csv(csv_path, nrows=sample_rows))
+    per_row = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    return max(int(memory_mb * 2**20 / (per_row * _CHUNK_OVERHEAD)), 100)
+
+
+def _write_chunks(frames, tmp_dir, source):
+    chunks = rows = 0
+    # The growing dictionaries stay in memory and are written once at the
+    # end, so a chunk costs time proportional to its own rows.
+    dictionaries = {}
+    for chunk in frames:
+        if chunks:
+            _write_segment(derive_columns(validate_delta(chunk, tmp_dir)), tmp_dir, dictionaries)
+        else:
+            _write_base(derive_columns(chunk), tmp_dir, source, 0)
+        chunks += 1
+        rows   += len(chunk)
+    for name, lookup in dictionaries.items():
+        np.save(os.path.join(tmp_dir, name), np.asarray(list(lookup), dtype=str))
+    return chunks, rows
+
+
+def _build_chunked(csv_path, tmp_dir, source, chunk_rows):
+    return _write_chunks(pd.read_csv(csv_path, chunksize=chunk_rows), tmp_dir, source)
+
+
+def build_store_from_frames(frames, store_dir, source):
+    """Write raw-export frames (as ``pd.read_csv`` returns them) as a store.
+
+    The frames are consumed one at a time, so a generator of chunks is
+    written in bounded memory; the first becomes the base columns, the
+    rest segments.  ``source`` describes where they came from and must
+    carry a ``sha1`` identifying the rows.  Returns ``(chunks, rows)``.
+    """
+    tmp_dir = store_dir + '.tmp'
+    result = _write_chunks(frames, tmp_dir, source)
+    _swap_in(tmp_dir, store_dir)
+    return result
+
+
+def build_store(csv_path=SOURCE_CSV, store_dir=STORE_DIR, chunk_rows=None, trace=True):
+    """Parse ``csv_path`` and write the typed columnar store.
+
+    With ``chunk_rows`` the CSV is streamed that many rows at a time and the
+    ingest report (chunks, rows, peak allocation) is kept in the manifest
+    and returned.  Tracing the peak slows the ingest down several times;
+    ``trace=False`` skips it and reports a peak of None.
+    """
+    size, mtime_ns = source_fingerprint(csv_path)
+    source = {'path': os.path.abspath(csv_path), 'size': size,
+              'mtime_ns': mtime_ns, 'sha1': _sha1(csv_path)}
+    if not chunk_rows:
+        write_store(derive_columns(pd.read_csv(csv_path)), store_dir, source)
+        return None
+
+    tmp_dir = store_dir + '.tmp'
+    if trace:
+        (chunks, rows), peak = traced_peak(_build_chunked, csv_path, tmp_dir, source, chunk_rows)
+    else:
+        (chunks, rows), peak = _build_chunked(csv_path, tmp_dir, source, chunk_rows), None
+    manifest = _read_manifest(tmp_dir)
+    manifest['ingest'] = {'chunk_rows': chunk_rows, 'chunks': chunks,
+                          'rows': rows, 'peak_bytes': peak}
+    _write_manifest(tmp_dir, manifest)
+    _swap_in(tmp_dir, store_dir)
+    return manifest['ingest']
+
+
+def ensure_store(csv_path=SOURCE_CSV, store_dir=STORE_DIR, memory_mb=MEMORY_BUDGET_MB):
+    """(Re)build the store if it is stale, chunked when ``memory_mb`` is set."""
+    if not is_fresh(csv_path, store_dir):
+        chunk_rows = chunk_rows_for(memory_mb, csv_path) if memory_mb else None
+        build_store(csv_path, store_dir, chunk_rows)
+
+
+def ingest_report(store_dir=STORE_DIR):
+    """The chunked-ingest report of the current store, or None."""
+    manifest = _read_manifest(store_dir)
+    return manifest and manifest.get('ingest')
+
+
+def store_state(store_dir=STORE_DIR):
+    """``(source sha1, generation)`` identifying the store's rows, or None."""
+    manifest = _read_manifest(store_dir)
+    return manifest and (manifest['source'].get('sha1'), _generation(manifest))
+
+
+# ── Append ────────────────────────────────────────────────────────────────────
+def _generation(manifest):
+    return manifest['compacted'] + len(manifest['segments'])
+
+
+def validate_delta(delta, store_dir=STORE_DIR):
+    """Check ``delta`` against the store's raw schema and coerce its types.
+
+    Raises ValueError naming every missing, unexpected or null column and
+    any value that does not parse as the stored type.
+    """
+    manifest = _read_manifest(store_dir)
+    columns  = [c for c in manifest['columns'] if c['name'] not in DERIVED_COLUMNS]
+    expected = [c['name'] for c in columns]
+    missing    = [c for c in expected if c not in delta.columns]
+    unexpected = [c for c in delta.columns if c not in expected]
+    if missing or unexpected:
+        raise ValueError(f'delta columns do not match the store: missing {missing}, unexpected {unexpected}')
+    nulls = delta.columns[delta.isna().any()].tolist()
+    if nulls:
+        raise ValueError(f'delta has null values in {nulls}')
+
+    out = pd.DataFrame(index=pd.RangeIndex(len(delta)))
+    for col in columns:
+        name, values = col['name'], delta[col['name']].to_numpy()
+        if col['kind'] == 'dict':
+            out[name] = values.astype(str)
+            continue
+        dtype = np.load(os.path.join(store_dir, col['file']), mmap_mode='r').dtype
+        try:
+            if np.issubdtype(dtype, np.datetime64):
+                # derive_columns() parses the date itself
+                pd.to_datetime(values)
+                out[name] = values
+                continue
+            parsed = pd.to_numeric(values).astype(np.float64)
+        except (ValueError, TypeError) as exc:
+            raise ValueError(f'delta column {name!r}: {exc}') from None
+        if np.issubdtype(dtype, np.integer) and not (parsed == np.round(parsed)).all():
+            raise ValueError(f'delta column {name!r} must hold whole numbers')
+        out[name] = parsed.astype(dtype)
+    return out
+
+
+def _save_atomic(path, array):
+    with open(path + '.tmp', 'wb') as fh:
+        np.save(fh, array)
+    os.replace(path + '.tmp', path)
+
+
+def append_rows(delta, store_dir=STORE_DIR):
+    """Validate ``delta`` (a DataFrame or CSV path) and append it as a segment.
+
+    Costs time proportional to the delta (plus rewriting any dictionary that
+    gained values).  Returns the store's new generation.  Appends must come
+    from a single writer.
+    """
+    if not isinstance(delta, pd.DataFrame):
+        delta = pd.read_csv(delta)
+    return _write_segment(derive_columns(validate_delta(delta, store_dir)), store_dir)
+
+
+def _write_segment(delta, store_dir, dictionaries=None):
+    """Write ``delta`` as the next segment; returns the new generation.
+
+    ``dictionaries`` (dictionary file -> ``{value: code}``, filled on first
+    use) lets a caller writing many segments keep the dictionaries in
+    memory; it must then write them itself.  Without it, grown
+    dictionaries are written here.
+    """
+    manifest = _read_manifest(store_dir)
+    seg_dir  = f'seg{_generation(manifest) + 1:06d}'
+    tmp_dir  = os.path.join(store_dir, seg_dir + '.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    kept  = dictionaries is not None
+    dictionaries = {} if dictionaries is None else dictionaries
+    grown = []
+    for col in manifest['columns']:
+        values = delta[col['name']]
+        if col['kind'] == 'array':
+            np.save(os.path.join(tmp_dir, col['file']), values.to_numpy())
+            continue
+        lookup = dictionaries.get(col['dict'])
+        if lookup is None:
+            dictionary = np.load(os.path.join(store_dir, col['dict'])).tolist()
+            lookup = dictionaries[col['dict']] = dict(zip(dictionary, range(len(dictionary))))
+        local, uniques = pd.factorize(values)
+        new = sorted(v for v in uniques.tolist() if v not in lookup)
+        if new:
+            # New values go at the end so existing codes stay valid.
+            lookup.update(zip(new, range(len(lookup), len(lookup) + len(new))))
+            grown.append(col['dict'])
+        # Local code -1 (a missing value) picks the trailing -1.
+        found = np.array([lookup[v] for v in uniques.tolist()] + [-1], dtype=np.int64)
+        codes = found[local]
+        np.save(os.path.join(tmp_dir, col['file']), codes.astype(_code_dtype(len(lookup))))
+
+    os.rename(tmp_dir, os.path.join(store_dir, seg_dir))
+    if not kept:
+        for name in grown:
+            _save_atomic(os.path.join(store_dir, name), np.asarray(list(dictionaries[name]), dtype=str))
+    # The manifest is the commit point: readers never see a half-written segment.
+    manifest['segments'].append({'dir': seg_dir, 'rows': len(delta)})
+    _write_manifest(store_dir, manifest)
+    return _generation(manifest)
+
+
+def compact(store_dir=STORE_DIR):
+    """Fold every appended segment into the base columns (re-sorting dictionaries).
+
+    Run it while no dashboard process is serving the store.
+    """
+    manifest = _read_manifest(store_dir)
+    if manifest['segments']:
+        write_store(open_store(store_dir), store_dir, manifest['source'], _generation(manifest))
+
+
+# ── Open ──────────────────────────────────────────────────────────────────────
+def _open_frame(store_dir, manifest, dirs):
+    data = {}
+    for col in manifest['columns']:
+        parts  = [np.load(os.path.join(store_dir, d, col['file']), mmap_mode='r') for d in dirs]
+        values = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        if col['kind'] == 'dict':
+            dictionary = np.load(os.path.join(store_dir, col['dict']))
+            values = pd.Categorical.from_codes(values, dictionary, validate=False)
+        data[col['name']] = values
+    frame = pd.DataFrame(data, copy=False)
+    frame.attrs['generation'] = _generation(manifest)
+    return frame
+
+
+def open_store(store_dir=STORE_DIR):
+    """Open the store as a DataFrame backed by read-only memory maps.
+
+    Dictionary-encoded columns are returned as categoricals sharing the
+    mapped codes; always group them with ``observed=True``.  Dictionaries
+    are sorted except for values first seen in an appended segment.  With
+    segments present the columns are concatenated (copied) once.
+    ``attrs['generation']`` records the store generation the frame holds.
+    """
+    manifest = _read_manifest(store_dir)
+    return _open_frame(store_dir, manifest, [''] + [s['dir'] for s in manifest['segments']])
+
+
+def iter_frames(store_dir=STORE_DIR):
+    """The store as consecutive row blocks (base, then each segment), uncopied."""
+    manifest = _read_manifest(store_dir)
+    for d in [''] + [s['dir'] for s in manifest['segments']]:
+        yield _open_frame(store_dir, manifest, [d])
+
+
+def read_segments(since, store_dir=STORE_DIR):
+    """``(frame, generation)`` of the rows appended after generation ``since``.
+
+    ``frame`` is None when nothing is new.  Its categoricals use the same
+    dictionaries (and so the same codes) as :func:`open_store`.
+    """
+    manifest = _read_manifest(store_dir)
+    current  = _generation(manifest)
+    if current <= since:
+        return None, current
+    if since < manifest['compacted']:
+        raise ValueError(f'store was compacted past generation {since}; reopen it')
+    segments = manifest['segments'][since - manifest['compacted']:]
+    return _open_frame(store_dir, manifest, [s['dir'] for s in segments]), current
+
+
+def load(csv_path=SOURCE_CSV, store_dir=STORE_DIR):
+    """Open the store for ``csv_path``, (re)building it first if it is stale."""
+    ensure_store(csv_path, store_dir, memory_mb=None)
+    return open_store(store_dir)
+
+
+def memory_report(csv_path=SOURCE_CSV, store_dir=STORE_DIR):
+    """Per-column deep memory of the plain CSV frame vs. the store frame."""
+    plain   = derive_columns(pd.read_csv(csv_path)).memory_usage(deep=True, index=False)
+    encoded = load(csv_path, store_dir).memory_usage(deep=True, index=False)
+    report = pd.DataFrame({'csv_bytes': plain, 'store_bytes': encoded})
+    report.loc['TOTAL'] = report.sum()
+    report['ratio'] = (report['store_bytes'] / report['csv_bytes']).round(3)
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv',   default=SOURCE_CSV)
+    parser.add_argument('--store', default=STORE_DIR)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    build = sub.add_parser('build', help='(re)build the store from the CSV')
+    build.add_argument('--memory-mb', type=float, default=MEMORY_BUDGET_MB,
+                       help='stream the CSV in chunks that fit this budget')
+    sub.add_parser('memory', help='print the before/after memory footprint')
+    add = sub.add_parser('append', help='validate a CSV of new orders and append it')
+    add.add_argument('delta')
+    sub.add_parser('compact', help='fold appended segments into the base columns')
+    args = parser.parse_args()
+
+    if args.cmd == 'build':
+        chunk_rows = chunk_rows_for(args.memory_mb, args.csv) if args.memory_mb else None
+        report = build_store(args.csv, args.store, chunk_rows)
+        print(f'built {args.store} from {args.csv}')
+        if report:
+            print(f"{report['rows']:,} rows in {report['chunks']} chunks of {report['chunk_rows']:,}; "
+                  f"peak {report['peak_bytes'] / 2**20:.1f} MB (budget {args.memory_mb:g} MB)")
+    elif args.cmd == 'memory':
+        print(memory_report(args.csv, args.store).to_string())
+    elif args.cmd == 'append':
+        load(args.csv, args.store)
+        print(f'{args.store} is at generation {append_rows(args.delta, args.store)}')
+    elif args.cmd == 'compact':
+        compact(args.store)
+        print(f'compacted {args.store}')
@@ -0,0 +1,239 @@
+"""Batched linear-trend + seasonal forecasting for many time series.
+
+Every series is fitted with the same model the dashboard has always used:
+an ordinary least-squares trend over its own span (first to last bucket
+with sales, gaps filled with zero) and a mean detrended value per seasonal
+slot as the seasonal term.  Series are monthly by default; any grain of
+:mod:`timeseries` works, with its own slots (``timeseries.SEASONS``): the
+calendar month or quarter, the week of the year, or the weekday for daily
+series.
+
+All series are fitted together.  They are laid out as columns of one
+(buckets x series) matrix over a shared grid; a 0/1 weight matrix marks
+each series' own span, so the per-series trend, seasonal means, residual
+spread and projections all come out of a handful of matrix operations
+instead of a Python loop per series and per bucket.
+
+Two kinds of band are offered (``INTERVALS``):
+
+``bootstrap``
+    a residual-bootstrap prediction interval.  Each series is rebuilt
+    ``BOOTSTRAP_PATHS`` times from its fitted values plus resampled
+    residuals, every rebuilt series is refitted, and each refit is projected
+    with further resampled residuals added; the band is the central
+    ``INTERVAL_LEVEL`` of those simulated paths.  The fit is linear in the
+    series, so the pseudo-series are just more columns of the same matrix
+    code: a batch of series simulates as one array operation, and batches
+    run across the :mod:`parallel` pool.  Paths are simulated at least
+    ``SIM_HORIZON`` months ahead and their quantiles cached by a
+    fingerprint of the series and its grain, so a shorter or equal
+    horizon, or the same series under another filter, reuses them.
+``sigma``
+    +/- 1.5 residual standard deviations, flat over the horizon.
+
+``fit_counts`` counts how often each series name has been fitted in this
+process and ``simulation_counts`` how often its bootstrap paths have been
+simulated; ``benchmarks/forecast_fits.py`` uses them to check that a rerun
+fits every series exactly once and that a new horizon simulates nothing.
+"""
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import parallel
+from timeseries import GRAINS, SEASONS, STARTS, periods, season
+
+MIN_POINTS = 4
+BAND_SIGMAS = 1.5
+
+INTERVALS = ('bootstrap', 'sigma')
+BOOTSTRAP_PATHS = 2000
+INTERVAL_LEVEL  = 0.9
+SIM_HORIZON     = 12
+
+# Simulated columns (series x paths) per batch, at most this many values
+# (columns x buckets) per simulated array, and cached path quantiles.
+_SIM_COLUMNS = 1 << 14
+_SIM_VALUES  = 1 << 23
+_SIM_CACHE   = 4096
+
+fit_counts = Counter()
+simulation_counts = Counter()
+
+_simulated = OrderedDict()   # fingerprint -> (lower, upper) per bucket ahead
+_simulated_lock = threading.Lock()
+
+
+def _fit(Y, W, X, onehot, resid=True):
+    """``(intercept, slope, seasonal, resid)`` of every series in ``Y`` over its span ``W``.
+
+    Axis 0 is the bucket; ``W`` and ``X`` broadcast against ``Y`` over the
+    others (series, or series x bootstrap paths).  ``onehot`` marks each
+    bucket's seasonal slot.  ``Y`` must be zero outside each span.
+    ``resid`` is None unless asked for.
+    """
+    n     = W.sum(axis=0)
+    sx    = X.sum(axis=0)
+    sy    = Y.sum(axis=0)
+    denom = n * (X * X).sum(axis=0) - sx * sx
+    slope = np.divide(n * np.einsum('t...,t...->...', X, Y) - sx * sy, denom,
+                      out=np.zeros(Y.shape[1:]), where=denom != 0)
+    intercept = (sy - slope * sx) / np.maximum(n, 1)
+
+    # Seasonal mean of the detrended series per slot (0 where a slot never
+    # occurs), from slot sums of the series itself.
+    counts = np.tensordot(onehot, W, axes=(0, 0))
+    sums = (np.tensordot(onehot, Y, axes=(0, 0)) - intercept * counts
+            - slope * np.tensordot(onehot, X, axes=(0, 0)))
+    seasonal = np.divide(sums, counts, out=np.zeros(onehot.shape[1:] + Y.shape[1:]), where=counts > 0)
+    if not resid:
+        return intercept, slope, seasonal, None
+    return intercept, slope, seasonal, (Y - intercept - slope * X - seasonal[onehot.argmax(axis=1)]) * W
+
+
+def _project(intercept, slope, seasonal, length, last_slot, n_periods):
+    """Projections ``(n_periods, ...)``; x continues each series' own index."""
+    k = np.arange(n_periods).reshape((-1,) + (1,) * intercept.ndim)
+    future_slot = np.broadcast_to((last_slot + 1 + k) % len(seasonal), (n_periods,) + intercept.shape)
+    return intercept + slope * (length + k) + np.take_along_axis(seasonal, future_slot, axis=0)
+
+
+def _fingerprint(values, first, grain):
+    digest = hashlib.blake2b(np.ascontiguousarray(values, dtype=np.float64).tobytes(), digest_size=16)
+    digest.update(f'{first} {grain}'.encode())
+    return digest.digest() + repr((BOOTSTRAP_PATHS, INTERVAL_LEVEL)).encode()
+
+
+def _simulate(batch, fitted, W, X, onehot, resid, start, length, last_slot, horizon, prints):
+    """Bootstrap band ``(lower, upper)``, each ``(horizon, len(batch))``, for series ``batch``.
+
+    Arrays are ``(bucket, series, path)``; the spans broadcast over paths.
+    """
+    n_t = len(fitted)
+    # Residual draws from each series' own span: n_t to rebuild it, then
+    # one per bucket ahead.  Each series draws from its own fingerprint-seeded
+    # generator, so its band does not depend on the batch it lands in.
+    draws = np.empty((n_t + horizon, len(batch), BOOTSTRAP_PATHS), dtype=np.int64)
+    for j, i in enumerate(batch):
+        rng = np.random.default_rng(np.frombuffer(prints[i][:16], dtype=np.uint32))
+        draws[:, j] = start[i] + rng.integers(0, length[i], (n_t + horizon, BOOTSTRAP_PATHS))
+    noise = resid[draws, batch[:, None]]
+
+    Wb = W[:, batch, None]
+    refit = _fit((fitted[:, batch, None] + noise[:n_t]) * Wb, Wb, X[:, batch, None], onehot, resid=False)[:3]
+    sim = np.maximum(_project(*refit, length[batch, None], last_slot[batch, None], horizon)
+                     + noise[n_t:], 0)
+    tail = (1 - INTERVAL_LEVEL) / 2
+    lower, upper = np.quantile(sim, [tail, 1 - tail], axis=2)
+    return lower, upper
+
+
+def _bootstrap_bands(names, prints, fitted, W, X, onehot, resid, start, length, last_slot, n_periods,
+                     grain):
+    """``(lower, upper)`` bootstrap bands ``(n_periods, series)`` for the series in ``prints``.
+
+    ``prints`` maps series positions to fingerprints; only series without
+    cached paths for ``n_periods`` are simulated.
+    """
+    n_s = fitted.shape[1]
+    lower, upper = np.zeros((n_periods, n_s)), np.zeros((n_periods, n_s))
+    todo = []
+    with _simulated_lock:
+        for i, fp in prints.items():
+            band = _simulated.get(fp)
+            if band is not None and len(band[0]) >= n_periods:
+                _simulated.move_to_end(fp)
+                lower[:, i], upper[:, i] = band[0][:n_periods], band[1][:n_periods]
+            else:
+                todo.append(i)
+    if not todo:
+        return lower, upper
+
+    horizon = max(n_periods, periods(SIM_HORIZON, grain))
+    # Long (e.g. daily) series simulate fewer series per batch.
+    per_batch = max(1, min(_SIM_COLUMNS, _SIM_VALUES // (len(fitted) + horizon)) // BOOTSTRAP_PATHS)
+    batches = [np.array(todo[a:a + per_batch]) for a in range(0, len(todo), per_batch)]
+    bands = parallel.run(lambda batch: _simulate(batch, fitted, W, X, onehot, resid, start, length,
+                                                 last_slot, horizon, prints), batches)
+    simulation_counts.update(names[i] for i in todo)
+    with _simulated_lock:
+        for batch, (lo, hi) in zip(batches, bands):
+            for j, i in enumerate(batch):
+                _simulated[prints[i]] = (lo[:, j], hi[:, j])
+                lower[:, i], upper[:, i] = lo[:n_periods, j], hi[:n_periods, j]
+        while len(_simulated) > _SIM_CACHE:
+            _simulated.popitem(last=False)
+    return lower, upper
+
+
+def forecast_many(history, n_periods, band=BAND_SIGMAS, min_points=MIN_POINTS, interval='sigma',
+                  grain='Month'):
+    """Fit and project every column of ``history`` ``n_periods`` buckets ahead.
+
+    ``history`` has a DatetimeIndex of ``grain`` bucket starts (see
+    ``timeseries.STARTS``; month starts by default) and one column per
+    series, as :meth:`timeseries.DailySeries.resample` gives with
+    ``missing=np.nan``; NaN means no sales in that bucket.  ``interval`` is one of
+    ``INTERVALS``; ``band`` is the width of the ``sigma`` band in residual
+    standard deviations.  Returns ``{name: (hist, forecast, (lower,
+    upper))}`` with pandas Series indexed by bucket, or ``(None, None,
+    None)`` for series shorter than ``min_points`` buckets.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f'interval must be one of {list(INTERVALS)}')
+    if grain not in GRAINS:
+        raise ValueError(f'grain must be one of {list(GRAINS)}')
+    names = list(history.columns)
+    fit_counts.update(names)
+    if history.empty:
+        return {name: (None, None, None) for name in names}
+    grid = pd.date_range(history.index.min(), history.index.max(), freq=STARTS[grain])
+    Y = history.reindex(grid).to_numpy(dtype=float)
+    n_t, n_s = Y.shape
+    t = np.arange(n_t)[:, None]
+
+    observed = ~np.isnan(Y)
+    start  = observed.argmax(axis=0)
+    end    = n_t - 1 - observed[::-1].argmax(axis=0)
+    length = np.where(observed.any(axis=0), end - start + 1, 0)
+    W = ((t >= start) & (t <= end)).astype(float)
+    Y = np.nan_to_num(Y) * W
+    X = (t - start) * W
+
+    slot   = season(grid, grain)
+    onehot = np.eye(SEASONS[grain])[slot]
+    intercept, slope, seasonal, resid = _fit(Y, W, X, onehot)
+    n = W.sum(axis=0)
+    mean_resid = resid.sum(axis=0) / np.maximum(n, 1)
+    resid = (resid - mean_resid) * W
+
+    forecast = np.maximum(_project(intercept, slope, seasonal, length, slot[end], n_periods), 0)
+    eligible = length >= min_points
+    if interval == 'bootstrap':
+        fitted = (intercept + slope * X + seasonal[slot]) * W
+        prints = {i: _fingerprint(Y[start[i]:end[i] + 1, i], grid[start[i]], grain)
+                  for i in np.flatnonzero(eligible)}
+        lower, upper = _bootstrap_bands(names, prints, fitted, W, X, onehot, resid,
+                                        start, length, slot[end], n_periods, grain)
+    else:
+        sigma = np.sqrt((resid ** 2).sum(axis=0) / np.maximum(n, 1)) * band
+        lower = np.maximum(forecast - sigma, 0)
+        upper = forecast + sigma
+
+    results = {}
+    for i, name in enumerate(names):
+        if not eligible[i]:
+            results[name] = (None, None, None)
+            continue
+        hist_index   = grid[start[i]:end[i] + 1]
+        future_index = pd.date_range(hist_index[-1], periods=n_periods + 1, freq=STARTS[grain])[1:]
+        results[name] = (
+            pd.Series(Y[start[i]:end[i] + 1, i], index=hist_index),
+            pd.Series(forecast[:, i], index=future_index),
+            (pd.Series(lower[:, i], index=future_index),
+             pd.Series(upper[:, i], index=future_index)),
+        )
+    return results
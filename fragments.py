@@ -0,0 +1,302 @@
+"""HTML / JSON fragments of the dashboard, rendered once per distinct input.
+
+Each fragment is rendered from column arrays in a single pass (formatted
+columns are concatenated as whole Series, not row by row) and cached in a
+:class:`section_cache.SectionCache` under the values it is drawn from, so a
+rerun that does not change a fragment's inputs reuses its markup as is.
+Fragments are plain strings and can be shared between sessions.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from section_cache import SectionCache, canonical_key
+
+cache = SectionCache(maxsize=256)
+
+REGION_META = {
+    'East':    ('🏙️', '#0d2240', '#1a4a80', '#4299e1', '#90cdf4'),
+    'West':    ('🌄', '#0d2a1a', '#1a5c36', '#48bb78', '#9ae6b4'),
+    'Central': ('🌾', '#2a1500', '#a04010', '#ed8936', '#fbd38d'),
+    'South':   ('🌴', '#1e0f38', '#5a35a8', '#9f7aea', '#d6bcfa'),
+}
+_DEFAULT_META = ('🌎', '#0d1b2a', '#1b2a3b', '#4299e1', '#90cdf4')
+
+PIP_LIMIT = 30
+
+
+def _fmt(values, spec):
+    return pd.Series(values, dtype=object).map(spec.format)
+
+
+# ── filter pills ─────────────────────────────────────────────────────────────
+def pills(category, segment, year, state=None, regions=()):
+    """The active-filter pills under the filter bar."""
+    def render():
+        parts = ([f'<div class="pill">📦 {v}</div>' for v in category]
+                 + [f'<div class="pill">👥 {v}</div>' for v in segment]
+                 + [f'<div class="pill">📅 {v}</div>' for v in year])
+        if state:
+            parts.append(f'<div class="pill state">📍 {state}</div>')
+        if not parts and not regions:
+            parts.append('<div class="pill" style="color:#4a7fa5;border-color:#2d4a6b;">Showing all data</div>')
+        return '<div class="active-pills">' + ''.join(parts) + '</div>'
+    # keyed in selection order: it is the pills' display order
+    key = (tuple(category), tuple(segment), tuple(year), state, bool(regions))
+    return cache.get('pills', key, render)
+
+
+# ── region cards ─────────────────────────────────────────────────────────────
+def region_cards(stats, active=()):
+    """``(labels, script)`` for the region card buttons.
+
+    ``stats`` is :meth:`query.QueryEngine.region_cards`; ``labels`` are the
+    button captions in its row order and ``script`` styles the buttons of
+    the ``active`` regions.
+    """
+    region = stats['Region'].to_numpy(dtype=object)
+    sales  = stats['Sales'].to_numpy(dtype=float)
+    orders = stats['Orders'].to_numpy(dtype=np.int64)
+    key = canonical_key(tuple(region), tuple(sales), tuple(orders), active=list(active))
+
+    def render():
+        total  = sales.sum()
+        share  = sales / total * 100 if total else np.zeros(len(sales))
+        meta   = pd.DataFrame([REGION_META.get(r, _DEFAULT_META) for r in region],
+                              columns=['icon', 'bg1', 'bg2', 'border', 'accent'])
+        is_act = np.isin(region, list(active))
+        labels = (meta['icon'] + '  ' + pd.Series(region, dtype=object)
+                  + pd.Series(np.where(is_act, '  ✓', ''), dtype=object) + '\n'
+                  + _fmt(sales, '${:,.0f}') + '\n'
+                  + _fmt(orders, '{:,}') + ' orders · ' + _fmt(share, '{:.1f}%'))
+        cards = meta.drop(columns='icon').assign(region=region, active=is_act)
+        cards = cards[['region', 'bg1', 'bg2', 'border', 'accent', 'active']].to_dict('records')
+        return labels.tolist(), _region_script(json.dumps(cards, default=bool))
+    return cache.get('region_cards', key, render)
+
+
+def _region_script(cards_json):
+    return f"""<script>
+(function() {{
+  var cards = {cards_json};
+
+  function styleAll() {{
+    var doc = window.parent.document;
+    cards.forEach(function(c) {{
+      var allBtns = doc.querySelectorAll('button');
+      var btn = null;
+      for (var i = 0; i < allBtns.length; i++) {{
+        if (allBtns[i].innerText && allBtns[i].innerText.indexOf(c.region) !== -1) {{
+          btn = allBtns[i];
+          break;
+        }}
+      }}
+      if (!btn) return;
+
+      var want = c.active ? '1' : '0';
+      if (btn.getAttribute('data-rs') === want) return;
+      btn.setAttribute('data-rs', want);
+
+      var s = btn.style;
+      s.setProperty('background', 'linear-gradient(145deg,' + c.bg1 + ' 0%,' + c.bg2 + ' 100%)', 'important');
+      s.setProperty('border-radius', '16px', 'important');
+      s.setProperty('color', c.accent, 'important');
+      s.setProperty('min-height', '130px', 'important');
+      s.setProperty('height', 'auto', 'important');
+      s.setProperty('width', '100%', 'important');
+      s.setProperty('padding', '18px 12px 14px', 'important');
+      s.setProperty('font-size', '0.85rem', 'important');
+      s.setProperty('white-space', 'pre-line', 'important');
+      s.setProperty('line-height', '1.8', 'important');
+      s.setProperty('cursor', 'pointer', 'important');
+      s.setProperty('text-align', 'center', 'important');
+      s.setProperty('transition', 'transform 0.15s ease, opacity 0.15s ease', 'important');
+      s.setProperty('will-change', 'transform, box-shadow', 'important');
+
+      if (c.active) {{
+        s.setProperty('border', '3px solid ' + c.border, 'important');
+        s.setProperty('opacity', '1', 'important');
+        var kfId = 'gkf-' + c.region.toLowerCase();
+        if (!doc.getElementById(kfId)) {{
+          var el = doc.createElement('style');
+          el.id = kfId;
+          el.textContent =
+            '@keyframes ' + kfId + '{{' +
+            '0%,100%{{box-shadow:0 0 8px ' + c.border + '55,0 0 18px ' + c.border + '22}}' +
+            '50%{{box-shadow:0 0 30px ' + c.border + 'ff,0 0 60px ' + c.border + 'bb,0 0 90px ' + c.border + '44}}' +
+            '}}';
+          doc.head.appendChild(el);
+        }}
+        s.setProperty('animation', kfId + ' 2.5s ease-in-out infinite', 'important');
+      }} else {{
+        s.setProperty('border', '1.5px solid ' + c.border, 'important');
+        s.setProperty('opacity', '0.72', 'important');
+        s.setProperty('animation', 'none', 'important');
+        s.setProperty('box-shadow', 'none', 'important');
+      }}
+
+      if (!btn._rsHover) {{
+        btn._rsHover = true;
+        var border = c.border;
+        var isAct = c.active;
+        btn.addEventListener('mouseenter', function() {{
+          btn.style.setProperty('opacity', '1', 'important');
+          btn.style.setProperty('transform', 'translateY(-4px) scale(1.02)', 'important');
+          btn.style.setProperty('box-shadow', '0 0 32px ' + border + 'dd, 0 10px 28px rgba(0,0,0,.5)', 'important');
+          btn.style.setProperty('animation', 'none', 'important');
+        }});
+        btn.addEventListener('mouseleave', function() {{
+          btn.style.setProperty('transform', '', 'important');
+          if (isAct) {{
+            btn.style.setProperty('animation', 'gkf-' + c.region.toLowerCase() + ' 2.5s ease-in-out infinite', 'important');
+          }}
+        }});
+      }}
+    }});
+  }}
+
+  styleAll();
+  var obs = new MutationObserver(function(muts) {{
+    var hasNew = muts.some(function(m) {{ return m.addedNodes.length > 0; }});
+    if (hasNew) styleAll();
+  }});
+  obs.observe(window.parent.document.body, {{childList:true, subtree:true}});
+}})();
+</script>"""
+
+
+# ── geographic insight banner ────────────────────────────────────────────────
+def pip_strip(n_states, above):
+    """One pip per active state (at most ``PIP_LIMIT``), lit if above average."""
+    def render():
+        lit = np.arange(min(n_states, PIP_LIMIT)) < above
+        colours = np.where(lit, '#9f7aea', 'rgba(255,255,255,0.06)').astype(object)
+        return ''.join('<div style="width:8px;height:8px;border-radius:2px;flex-shrink:0;background:'
+                       + colours + ';"></div>')
+    return cache.get('pips', (n_states, above), render)
+
+
+def geo_banner(summary, top, total_sales, n_markets):
+    """The four-card insight banner above the map.
+
+    ``summary`` is :meth:`query.QueryEngine.state_summary`, ``top`` the top
+    state's ``State`` / ``Sales`` row and ``total_sales`` the filtered total.
+    """
+    top5, bottom = summary['top5'], summary['bottom']
+    values = dict(
+        n_states=int(summary['active_states']), above_avg=int(summary['above_avg_states']),
+        avg_sales=float(summary['avg_state_sales']), top5_sales=float(top5['Sales'].sum()),
+        top_name=top['State'], top_sales=float(top['Sales']),
+        bottom_name=bottom['State'], bottom_sales=float(bottom['Sales']),
+        total_sales=float(total_sales), n_markets=int(n_markets),
+    )
+    return cache.get('geo_banner', canonical_key(**values), lambda: _geo_banner(**values))
+
+
+def _geo_banner(n_states, above_avg, avg_sales, top5_sales, top_name, top_sales,
+                bottom_name, bottom_sales, total_sales, n_markets):
+    top5_share = top5_sales / total_sales * 100 if total_sales else 0
+    top_share  = top_sales / total_sales * 100 if total_sales else 0
+    pct_above  = above_avg / n_states * 100 if n_states else 0
+    gap_ratio  = top_sales / bottom_sales if bottom_sales > 0 else 0
+    conc_lbl   = "High Risk — over-reliance on few states" if top5_share > 60 else "Moderate — healthy regional spread" if top5_share > 40 else "Low — well diversified across states"
+    conc_color = "#e94560" if top5_share > 60 else "#ed8936" if top5_share > 40 else "#48bb78"
+    bottom_pct = max(bottom_sales / top_sales * 100, 1.5) if top_sales else 0
+    avg_pct    = min(avg_sales / top_sales * 100, 100) if top_sales else 0
+    avg_share  = avg_sales / total_sales * 100 if total_sales else 0
+    pips       = pip_strip(n_states, above_avg)
+    return (
+    "<!DOCTYPE html><html><head><meta charset=\'utf-8\'>"
+    "<style>"
+    "body{margin:0;padding:0;background:transparent;font-family:-apple-system,BlinkMacSystemFont,Segoe UI,sans-serif;}"
+    "@keyframes shimmer{0%{background-position:-200% center}100%{background-position:200% center}}"
+    ".geo-card-click{cursor:pointer;transition:transform 0.15s,box-shadow 0.15s;}"
+    ".geo-card-click:hover{transform:translateY(-3px);box-shadow:0 8px 24px rgba(0,0,0,0.5);}"
+    ".geo-card-click.active{outline:2px solid currentColor;outline-offset:2px;}"
+    "</style>"
+    "<script>"
+    "function sendFilter(f){window.parent.postMessage({geoFilter:f},'*');}"
+    "</script>"
+    "</head><body>"
+) + f"""<div style="background:linear-gradient(160deg,#080f1e 0%,#0c1a30 60%,#080f1e 100%);border:1px solid #162640;border-radius:16px;padding:28px 28px 24px;margin-bottom:12px;position:relative;overflow:hidden;">
+
+  <!-- glow -->
+  <div style="position:absolute;inset:0;background:radial-gradient(ellipse at 80% 0%,rgba(66,153,225,0.07) 0%,transparent 60%),radial-gradient(ellipse at 10% 100%,rgba(99,179,237,0.04) 0%,transparent 50%);pointer-events:none;"></div>
+
+  <!-- header -->
+  <div style="display:flex;align-items:center;gap:10px;margin-bottom:18px;">
+    <div style="width:3px;height:18px;background:linear-gradient(180deg,#4299e1,#63b3ed);border-radius:2px;flex-shrink:0;"></div>
+    <span style="font-size:0.68rem;font-weight:800;color:#4299e1;text-transform:uppercase;letter-spacing:0.18em;">Geographic Revenue Intelligence</span>
+    <span style="margin-left:auto;background:rgba(66,153,225,0.08);border:1px solid #1e3a5f;border-radius:20px;padding:2px 10px;font-size:0.68rem;color:#90cdf4;font-weight:600;">{n_states} states · {n_markets} markets</span>
+  </div>
+
+  <!-- 4-col grid -->
+  <div style="display:grid;grid-template-columns:1.4fr 1fr 1fr 1fr;gap:10px;">
+
+    <!-- Card 1: Revenue Leader -->
+    <div class="geo-card-click" onclick="sendFilter('leader')" style="background:linear-gradient(145deg,#0d2240,#112a50);border:1px solid #1e4a80;border-radius:12px;padding:16px 14px 14px;position:relative;overflow:hidden;color:#4299e1;">
+      <div style="position:absolute;top:0;left:0;right:0;height:2px;background:linear-gradient(90deg,transparent,#4299e1,#90cdf4,transparent);"></div>
+      <div style="font-size:0.65rem;font-weight:700;text-transform:uppercase;letter-spacing:0.13em;color:#4a6580;margin-bottom:12px;display:flex;align-items:center;gap:5px;">
+        <div style="width:5px;height:5px;border-radius:50%;background:#4299e1;flex-shrink:0;"></div>Revenue Leader
+      </div>
+      <div style="font-size:1.55rem;font-weight:800;color:#fff;line-height:1.1;">{top_name}</div>
+      <div style="font-size:0.88rem;font-weight:600;margin-top:5px;color:#48bb78;">${top_sales:,.0f}</div>
+      <div style="margin-top:14px;display:flex;flex-direction:column;gap:5px;">
+        <div style="display:flex;align-items:center;gap:6px;">
+          <span style="color:#4a6580;font-size:0.6rem;width:32px;flex-shrink:0;">Leader</span>
+          <div style="flex:1;background:rgba(255,255,255,0.05);border-radius:99px;height:4px;">
+            <div style="width:100%;height:4px;background:linear-gradient(90deg,#4299e1,#90cdf4);border-radius:99px;"></div>
+          </div>
+          <span style="color:#90cdf4;font-size:0.6rem;width:34px;text-align:right;">{top_share:.1f}%</span>
+        </div>
+        <div style="display:flex;align-items:center;gap:6px;">
+          <span style="color:#4a6580;font-size:0.6rem;width:32px;flex-shrink:0;">Avg</span>
+          <div style="flex:1;background:rgba(255,255,255,0.05);border-radius:99px;height:4px;">
+            <div style="width:{avg_pct:.0f}%;height:4px;background:rgba(66,153,225,0.35);border-radius:99px;"></div>
+          </div>
+          <span style="color:#4a6580;font-size:0.6rem;width:34px;text-align:right;">{avg_share:.1f}%</span>
+        </div>
+      </div>
+      <div style="font-size:0.72rem;color:#4a6580;margin-top:12px;font-weight:500;">{gap_ratio:.0f}x larger than weakest state</div>
+    </div>
+
+    <!-- Card 2: Concentration -->
+    <div class="geo-card-click" onclick="sendFilter('top5')" style="background:rgba(255,255,255,0.025);border:1px solid #162640;border-radius:12px;padding:16px 14px 14px;position:relative;overflow:hidden;color:#ed8936;">
+      <div style="font-size:0.65rem;font-weight:700;text-transform:uppercase;letter-spacing:0.13em;color:#4a6580;margin-bottom:12px;display:flex;align-items:center;gap:5px;">
+        <div style="width:5px;height:5px;border-radius:50%;background:{conc_color};flex-shrink:0;"></div>Concentration
+      </div>
+      <div style="font-size:1.55rem;font-weight:800;color:#fff;line-height:1.1;">{top5_share:.0f}<span style="font-size:0.75rem;color:#718096;font-weight:500;">%</span></div>
+      <div style="font-size:0.88rem;font-weight:600;margin-top:5px;color:{conc_color};">Top-5 share</div>
+      <div style="margin-top:14px;width:70px;height:70px;border-radius:50%;background:conic-gradient({conc_color} 0% {top5_share:.0f}%,rgba(255,255,255,0.06) {top5_share:.0f}% 100%);display:flex;align-items:center;justify-content:center;">
+        <div style="width:50px;height:50px;border-radius:50%;background:#0c1a30;display:flex;align-items:center;justify-content:center;font-size:0.72rem;font-weight:700;color:{conc_color};">{top5_share:.0f}%</div>
+      </div>
+      <div style="font-size:0.63rem;color:{conc_color};margin-top:8px;font-weight:500;">{conc_lbl}</div>
+    </div>
+
+    <!-- Card 3: Market Spread -->
+    <div class="geo-card-click" onclick="sendFilter('above_avg')" style="background:rgba(255,255,255,0.025);border:1px solid #162640;border-radius:12px;padding:16px 14px 14px;position:relative;overflow:hidden;color:#9f7aea;">
+      <div style="font-size:0.65rem;font-weight:700;text-transform:uppercase;letter-spacing:0.13em;color:#4a6580;margin-bottom:12px;display:flex;align-items:center;gap:5px;">
+        <div style="width:5px;height:5px;border-radius:50%;background:#9f7aea;flex-shrink:0;"></div>Market Spread
+      </div>
+      <div style="font-size:1.55rem;font-weight:800;color:#fff;line-height:1.1;">{above_avg}<span style="font-size:0.75rem;color:#718096;font-weight:400;"> /{n_states}</span></div>
+      <div style="font-size:0.88rem;font-weight:600;margin-top:5px;color:#9f7aea;">States above avg</div>
+      <div style="margin-top:12px;display:flex;gap:2px;flex-wrap:wrap;">{pips}</div>
+      <div style="font-size:0.72rem;color:#4a6580;margin-top:10px;font-weight:500;">{pct_above:.0f}% outperforming avg ${avg_sales/1000:.0f}K</div>
+    </div>
+
+    <!-- Card 4: Needs Attention -->
+    <div class="geo-card-click" onclick="sendFilter('weakest')" style="background:rgba(233,69,96,0.04);border:1px solid #3d1020;border-radius:12px;padding:16px 14px 14px;position:relative;overflow:hidden;color:#e94560;">
+      <div style="font-size:0.65rem;font-weight:700;text-transform:uppercase;letter-spacing:0.13em;color:#4a6580;margin-bottom:12px;display:flex;align-items:center;gap:5px;">
+        <div style="width:5px;height:5px;border-radius:50%;background:#e94560;flex-shrink:0;"></div>Needs Attention
+      </div>
+      <div style="font-size:1.3rem;font-weight:800;color:#fff;line-height:1.1;">{bottom_name}</div>
+      <div style="font-size:0.88rem;font-weight:600;margin-top:5px;color:#e94560;">${bottom_sales:,.0f}</div>
+      <div style="margin-top:12px;background:rgba(255,255,255,0.05);border-radius:99px;height:3px;overflow:hidden;">
+        <div style="width:{bottom_pct:.1f}%;height:3px;border-radius:99px;background:linear-gradient(90deg,#e94560,#fc8181);"></div>
+      </div>
+      <div style="font-size:0.72rem;color:#4a6580;margin-top:10px;font-weight:500;">Only {bottom_pct:.1f}% of leader — high opportunity gap</div>
+    </div>
+
+  </div>
+</div>""" + "</body></html>"
@@ -0,0 +1,169 @@
+"""The state choropleth, assembled from cached base figures and overlay traces.
+
+``px.choropleth`` is by far the slowest part of drawing the map, yet the
+base figure only depends on the state rollup under the year / category /
+segment filters (and on whether region cards are active, which mutes it).
+It is built once per distinct rollup; the region outlines, the clicked-state
+ring and the geo-card highlight are separate overlay traces, each cached
+under its own inputs, and a rerun only composes the figure from them.
+
+A rerun with unchanged map inputs reuses the composed figure object, so
+Streamlit gets back the same spec and keeps the chart mounted.  Figures
+and traces are cached values shared by every session and must not be
+mutated.
+"""
+import hashlib
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from section_cache import SectionCache
+
+cache = SectionCache(maxsize=256)
+
+REGION_FILL = {
+    'East':    [[0, 'rgba(66,153,225,0.12)'],  [1, 'rgba(66,153,225,0.55)']],
+    'West':    [[0, 'rgba(72,187,120,0.12)'],  [1, 'rgba(72,187,120,0.55)']],
+    'Central': [[0, 'rgba(237,137,54,0.12)'],  [1, 'rgba(237,137,54,0.55)']],
+    'South':   [[0, 'rgba(159,122,234,0.12)'], [1, 'rgba(159,122,234,0.55)']],
+}
+REGION_BORDER = {'East': '#4299e1', 'West': '#48bb78', 'Central': '#ed8936', 'South': '#9f7aea'}
+
+_DEFAULT_FILL = [[0, 'rgba(255,255,255,0.1)'], [1, 'rgba(255,255,255,0.5)']]
+
+
+def fingerprint(states):
+    """Content key of a state rollup (``QueryEngine.map_data``)."""
+    hashed = pd.util.hash_pandas_object(states, index=False).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+
+def _rgba(colour, alpha):
+    return f'rgba({int(colour[1:3],16)},{int(colour[3:5],16)},{int(colour[5:7],16)},{alpha})'
+
+
+# ── base ─────────────────────────────────────────────────────────────────────
+def _base(key, states, muted):
+    """``(trace, layout)`` of the base figure; the layout omits the template."""
+    def build():
+        if muted:
+            fig = px.choropleth(
+                states, locations='State Code', locationmode="USA-states",
+                color='Sales', scope="usa", hover_name='State',
+                color_continuous_scale=[[0,'rgba(40,40,60,0.5)'],[1,'rgba(80,80,100,0.5)']],
+                labels={'Sales': 'Total Sales ($)'},
+                custom_data=['Share']
+            )
+            fig.update_traces(marker_line_color='rgba(100,100,120,0.3)', marker_line_width=0.5)
+        else:
+            fig = px.choropleth(
+                states, locations='State Code', locationmode="USA-states",
+                color='Sales', scope="usa", hover_name='State',
+                color_continuous_scale="Blues", labels={'Sales': 'Total Sales ($)'},
+                custom_data=['Share']
+            )
+        fig.update_traces(
+            hovertemplate=(
+                "<b>%{hovertext}</b><br>"
+                "Total Sales: $%{z:,.0f}<br>"
+                "Revenue Share: %{customdata[0]:.1f}%"
+                "<extra></extra>"
+            )
+        )
+        fig.update_layout(
+            margin={"r":0,"t":0,"l":0,"b":0}, geo_bgcolor='rgba(0,0,0,0)',
+            coloraxis_colorbar=dict(title="Sales ($)", tickprefix="$"),
+            showlegend=False,
+        )
+        # Without the template, a new Figure re-applies the default one from
+        # plotly's own (validated) copy, which is much cheaper than copying it.
+        layout = fig.layout.to_plotly_json()
+        layout.pop('template', None)
+        return fig.data[0], layout
+    return cache.get('map_base', (key, muted), build)
+
+
+# ── overlays ─────────────────────────────────────────────────────────────────
+def _region_trace(key, region, states):
+    def build():
+        return go.Choropleth(
+            locations=states['State Code'].tolist(),
+            z=states['Sales'].tolist(),
+            locationmode="USA-states",
+            colorscale=REGION_FILL.get(region, _DEFAULT_FILL),
+            showscale=False,
+            marker_line_color=REGION_BORDER.get(region, '#ffffff'),
+            marker_line_width=2.5,
+            text=states['State'].tolist(),
+            customdata=states[['Share']].values,
+            hovertemplate=(
+                "<b>%{text}</b><br>"
+                "Sales: $%{z:,.0f}<br>"
+                "Revenue Share: %{customdata[0]:.1f}%<br>"
+                "Region: " + region +
+                "<extra></extra>"
+            ),
+            name=region,
+        )
+    return cache.get('map_region', (key, region, tuple(states['State'])), build)
+
+
+def _clicked_trace(code):
+    return cache.get('map_clicked', code, lambda: go.Choropleth(
+        locations=[code], z=[1], locationmode="USA-states",
+        colorscale=[[0,"rgba(233,69,96,0)"],[1,"rgba(233,69,96,0)"]],
+        showscale=False, marker_line_color="#e94560",
+        marker_line_width=3, hoverinfo='skip',
+    ))
+
+
+def _highlight_trace(key, names, colour, states):
+    def build():
+        return go.Choropleth(
+            locations=states['State Code'].tolist(),
+            z=states['Sales'].tolist(),
+            locationmode="USA-states",
+            colorscale=[[0, _rgba(colour, 0.25)], [1, _rgba(colour, 0.7)]],
+            showscale=False,
+            marker_line_color=colour,
+            marker_line_width=3,
+            text=states['State'].tolist(),
+            customdata=states[['Share']].values,
+            hovertemplate="<b>%{text}</b><br>Sales: $%{z:,.0f}<br>Share: %{customdata[0]:.1f}%<extra></extra>",
+            name='highlighted',
+        )
+    return cache.get('map_highlight', (key, names, colour), build)
+
+
+# ── figure ───────────────────────────────────────────────────────────────────
+def figure(states, region_states=None, regions=(), clicked=None, highlight=(), colour='#ffffff'):
+    """The map figure.
+
+    ``states`` is ``QueryEngine.map_data`` and ``region_states`` its
+    ``region_states``; ``regions`` are the active region cards, ``clicked``
+    the clicked state and ``highlight`` the states picked by a geo card,
+    outlined in ``colour``.
+    """
+    key       = fingerprint(states)
+    regions   = tuple(regions)
+    highlight = tuple(sorted(highlight))
+    slot = (key, regions, clicked, highlight, colour)
+
+    def build():
+        base, layout = _base(key, states, bool(regions))
+        traces = [base]
+        for region in regions:
+            members = states[states['State'].isin((region_states or {}).get(region, ()))]
+            if not members.empty:
+                traces.append(_region_trace(key, region, members))
+        if clicked:
+            codes = states.loc[states['State'] == clicked, 'State Code']
+            if not codes.empty:
+                traces.append(_clicked_trace(codes.iloc[0]))
+        if highlight:
+            members = states[states['State'].isin(highlight)]
+            if not members.empty:
+                traces.append(_highlight_trace(key, highlight, colour, members))
+        return go.Figure(data=traces, layout=layout)
+    return cache.get('map_figure', slot, build)
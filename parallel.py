@@ -0,0 +1,138 @@
+"""Partitioned group-by over cube cells, spread across a thread pool.
+
+Every rollup behind the dashboard (state, city, category, monthly, the city
+table, the A/B and forecast breakdowns) groups a selection of cube cells.
+On a large selection the work is cut into partitions that are aggregated
+independently and then merged:
+
+* sums partition by cell position: each partition bincounts its slice into
+  a dense per-group array, and the partial arrays are added;
+* distinct counts partition by group (see ``DistinctCounter.count_by``):
+  a partition sees every cell of its groups, so its counts are final and
+  the partitions' results never overlap.
+
+Group keys are the cells' dictionary codes combined into one integer per
+cell, so grouping never hashes labels, and the per-partition work is NumPy
+array code that releases the GIL.  A thread pool therefore spreads it over
+the cores without copying the cells into worker processes.  Selections of
+fewer than ``MIN_PARTITION`` cells per worker stay on the calling thread.
+
+``SUPERSTORE_WORKERS`` sets the pool size (default: one per core; 1 turns
+partitioning off).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+WORKERS = int(os.environ.get('SUPERSTORE_WORKERS') or 0) or os.cpu_count() or 1
+MIN_PARTITION = 50_000
+
+# Above this many possible key combinations, groups are found by sorting
+# rather than with a dense presence table.
+_DENSE_KEYS = 1 << 24
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='groupby')
+        return _pool
+
+
+def run(fn, parts):
+    """``[fn(part) for part in parts]``, on the pool when there are several."""
+    if len(parts) <= 1:
+        return [fn(part) for part in parts]
+    return list(_executor().map(fn, parts))
+
+
+def chunks(n, workers=None):
+    """Positions ``0..n`` as contiguous slices, one per worker (one if small)."""
+    k = max(1, min(workers or WORKERS, n // MIN_PARTITION))
+    bounds = np.linspace(0, n, k + 1).astype(np.int64)
+    return [slice(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def group_ranges(groups, n_groups, workers=None):
+    """Group numbers ``0..n_groups`` as contiguous ranges holding similar row counts."""
+    k = max(1, min(workers or WORKERS, len(groups) // MIN_PARTITION, n_groups))
+    if k == 1:
+        return [range(n_groups)]
+    cum  = np.cumsum(np.bincount(groups, minlength=n_groups))
+    cuts = np.searchsorted(cum, np.linspace(0, cum[-1], k + 1)[1:-1])
+    bounds = np.unique(np.concatenate(([0], cuts, [n_groups])))
+    return [range(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+# ── grouping ─────────────────────────────────────────────────────────────────
+def _codes(col):
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return col.cat.codes.to_numpy(dtype=np.int64), col.cat.categories
+    codes, levels = pd.factorize(col, sort=True)
+    return codes.astype(np.int64), levels
+
+
+def group_index(frame, by):
+    """``(groups, keys)``: each row's group number, and the group keys in order.
+
+    Matches ``frame.groupby(by, observed=True)``: groups are numbered in key
+    order (category order for categoricals), only observed combinations
+    count, and rows with a missing key get group -1.  ``keys`` is an Index
+    (a MultiIndex when ``by`` is a list of several columns) named ``by``.
+    """
+    names = [by] if isinstance(by, str) else list(by)
+    combined, missing, levels = np.zeros(len(frame), dtype=np.int64), None, []
+    for name in names:
+        codes, level = _codes(frame[name])
+        combined = combined * len(level) + codes
+        if len(codes) and codes.min() < 0:
+            missing = codes < 0 if missing is None else missing | (codes < 0)
+        levels.append(level)
+    shape = [len(level) for level in levels]
+    space = int(np.prod(shape, dtype=np.float64))
+
+    observed = combined if missing is None else combined[~missing]
+    if space <= max(_DENSE_KEYS, 4 * len(frame)):
+        seen = np.zeros(space, dtype=bool)
+        seen[observed] = True
+        present = np.flatnonzero(seen)
+        found   = (np.cumsum(seen) - 1)[observed]
+    else:
+        present = np.sort(observed)
+        present = present[np.r_[True, present[1:] != present[:-1]]] if len(present) else present
+        found   = np.searchsorted(present, observed)
+    if missing is None:
+        groups = found
+    else:
+        groups = np.full(len(frame), -1, dtype=np.int64)
+        groups[~missing] = found
+
+    parts = np.unravel_index(present, shape) if shape else ()
+    arrays = [pd.Categorical.from_codes(codes, dtype=frame[name].dtype)
+              if isinstance(frame[name].dtype, pd.CategoricalDtype) else level.take(codes)
+              for name, level, codes in zip(names, levels, parts)]
+    if isinstance(by, str) or len(names) == 1:
+        keys = pd.Index(arrays[0], name=names[0])
+    else:
+        keys = pd.MultiIndex.from_arrays(arrays, names=names)
+    return groups, keys
+
+
+def group_sum(groups, n_groups, values):
+    """``values`` summed per group (rows in group -1 are skipped), partition by partition."""
+    values = np.asarray(values)
+
+    def part(span):
+        g = groups[span]
+        keep = g >= 0
+        return np.bincount(g[keep], weights=values[span][keep], minlength=n_groups)
+
+    total = np.sum(run(part, chunks(len(groups))), axis=0)
+    return total.round().astype(values.dtype) if values.dtype.kind in 'iu' else total
@@ -0,0 +1,176 @@
+"""Per-rerun profiling of the dashboard's sections.
+
+app.py opens a :class:`Rerun` at the top of the script and marks the end of
+every named section with :meth:`Rerun.mark`; the time since the previous
+mark (and, when memory is traced, the bytes allocated) is charged to that
+section, together with the number of cube cells it reads.
+
+Profiling is sampled: only every ``SUPERSTORE_PROFILE_EVERY``-th rerun of
+the process is profiled (0, the default, turns sampling off), plus every
+rerun of a session that ticks "Profile every rerun" in the debug panel.
+Unsampled reruns get a no-op stand-in, so leaving it on costs one method
+call per section, and a sampled rerun only adds a clock read per section.
+
+Allocations are traced with tracemalloc only when asked for
+(``SUPERSTORE_PROFILE_MEMORY=1``, or "Trace allocations" in the panel):
+it makes a rerun several times slower.  Only one rerun is traced at a
+time, and allocations made by other sessions' threads meanwhile are
+counted too.
+
+Finished reruns are kept in memory (:attr:`Profiler.recent`) and, if
+``SUPERSTORE_PROFILE_LOG`` names a file, appended to it as JSON lines::
+
+    {"run": 12, "session": "...", "started": 1760000000.0, "complete": true,
+     "total_ms": 412.5, "sections": [{"section": "load", "ms": 3.1,
+     "rows": 8655, "alloc_bytes": 5120, "peak_bytes": 20480}, ...]}
+"""
+import itertools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+
+PROFILE_EVERY = int(os.environ.get('SUPERSTORE_PROFILE_EVERY') or 0)
+PROFILE_LOG   = os.environ.get('SUPERSTORE_PROFILE_LOG') or None
+PROFILE_MEMORY = os.environ.get('SUPERSTORE_PROFILE_MEMORY', '') not in ('', '0')
+
+# A traced rerun that never finished (st.stop / st.rerun part-way) is closed
+# by the next rerun of its session, or by any rerun after this many seconds.
+STALE_SECONDS = 30
+
+
+class _Off:
+    """Stand-in for reruns that are not sampled."""
+    sampled = False
+
+    def mark(self, section, rows=None):
+        pass
+
+    def finish(self, complete=True):
+        return None
+
+
+OFF = _Off()
+
+
+class Rerun:
+    sampled = True
+
+    def __init__(self, profiler, number, session, trace):
+        self.profiler = profiler
+        self.number   = number
+        self.session  = session
+        self.trace    = trace
+        self.sections = []
+        self.started  = time.time()
+        self.done     = False
+        if trace:
+            tracemalloc.reset_peak()
+            self._memory = tracemalloc.get_traced_memory()[0]
+        self._t0 = self._t = time.perf_counter()
+
+    def mark(self, section, rows=None):
+        """Close ``section``: charge it everything since the previous mark."""
+        if self.done:
+            return
+        entry = {'section': section, 'ms': round((time.perf_counter() - self._t) * 1e3, 3),
+                 'rows': None if rows is None else int(rows)}
+        if self.trace:
+            current, peak = tracemalloc.get_traced_memory()
+            entry['alloc_bytes'] = current - self._memory
+            entry['peak_bytes']  = peak - self._memory
+            tracemalloc.reset_peak()
+            self._memory = current
+        self.sections.append(entry)
+        self._t = time.perf_counter()
+
+    def finish(self, complete=True):
+        """Record the rerun; returns its record (None if already finished)."""
+        if self.done:
+            return None
+        self.done = True
+        record = {'run': self.number, 'session': self.session, 'started': self.started,
+                  'complete': complete, 'total_ms': round((time.perf_counter() - self._t0) * 1e3, 3),
+                  'sections': self.sections}
+        self.profiler._record(self, record)
+        return record
+
+
+class Profiler:
+    def __init__(self, every=PROFILE_EVERY, log_path=PROFILE_LOG, memory=PROFILE_MEMORY, keep=500):
+        self.every    = every
+        self.log_path = log_path
+        self.memory   = memory
+        self.recent   = deque(maxlen=keep)
+        self._count   = itertools.count(1)
+        self._lock    = threading.Lock()
+        self._traced  = None
+
+    def rerun(self, session=None, force=False, memory=None):
+        """A :class:`Rerun` if this rerun is sampled, else a no-op stand-in.
+
+        ``force`` samples it regardless; ``memory`` overrides :attr:`memory`.
+        """
+        number = next(self._count)
+        if not (force or (self.every and number % self.every == 0)):
+            return OFF
+        memory = self.memory if memory is None else memory
+        with self._lock:
+            stale = self._traced
+            if stale is not None and (stale.session == session
+                                      or time.time() - stale.started > STALE_SECONDS):
+                self._traced = None
+            else:
+                stale = None
+        if stale is not None:
+            stale.finish(complete=False)
+        with self._lock:
+            trace = memory and self._traced is None and not tracemalloc.is_tracing()
+            if trace:
+                tracemalloc.start()
+            run = Rerun(self, number, session, trace)
+            if trace:
+                self._traced = run
+        return run
+
+    def _record(self, run, record):
+        with self._lock:
+            if run.trace:
+                tracemalloc.stop()
+                if self._traced is run:
+                    self._traced = None
+            self.recent.append(record)
+            if self.log_path:
+                with open(self.log_path, 'a') as fh:
+                    fh.write(json.dumps(record) + '\n')
+
+    # ── reading ──────────────────────────────────────────────────────────────
+    def records(self, session=None):
+        """Recent finished reruns, oldest first (only ``session``'s if given)."""
+        with self._lock:
+            return [r for r in self.recent if session is None or r['session'] == session]
+
+    def jsonl(self, session=None):
+        return ''.join(json.dumps(r) + '\n' for r in self.records(session))
+
+    def summary(self, session=None):
+        """Per-section ``runs`` / ``mean_ms`` / ``p95_ms`` / ``max_peak_bytes`` over recent reruns."""
+        by_section = {}
+        for record in self.records(session):
+            for entry in record['sections']:
+                by_section.setdefault(entry['section'], []).append(entry)
+        out = {}
+        for section, entries in by_section.items():
+            ms    = np.array([e['ms'] for e in entries])
+            peaks = [e['peak_bytes'] for e in entries if 'peak_bytes' in e]
+            out[section] = {'runs': len(entries), 'mean_ms': round(float(ms.mean()), 3),
+                            'p95_ms': round(float(np.percentile(ms, 95)), 3),
+                            'max_peak_bytes': max(peaks) if peaks else None}
+        return out
+
+
+profiler = Profiler()
@@ -0,0 +1,675 @@
+"""Headless query engine for the dashboard's aggregations, plus a JSON endpoint.
+
+Everything the dashboard shows is computed here from the sales cube, so a
+reporting job gets the same numbers as the UI without a Streamlit session.
+Filters are the filter bar's, as a dict of lists:
+
+``year``, ``category``, ``segment``
+    the filter bar; region cards and the map only ever apply these three.
+``region``, ``state``, ``city``
+    the region cards and map / city drill-down.
+
+Missing or empty filters mean "all".  Each result is cached in a
+:class:`section_cache.SectionCache` under a key of only the inputs it reads;
+the engine is safe to share between threads.  Returned frames are cached
+values and must be treated as read-only.
+
+Run ``python query.py serve`` for a local HTTP endpoint.  Every route takes
+the filters as repeated query parameters (``?year=2017&year=2018&state=Texas``)
+plus ``mode=exact|hll`` for distinct counts, and answers JSON:
+
+=================  ==========================================================
+``/kpis``          totals and every rollup behind the KPI row and charts
+``/regions``       region cards (sales and orders per region)
+``/states``        map data (sales and share per state)
+``/state-summary`` the map insight banner (top 5, weakest, above average)
+``/cities``        the city table; with ``sort``, ``asc=1``, ``start``,
+                   ``stop`` or ``q`` (search), one page of it and the
+                   number of matching cities
+``/ab``            A/B comparison; ``dim_a``, ``val_a``, ``dim_b``, ``val_b``,
+                   or any number of ``group=Dim:Value|Value`` (tested
+                   against the first group)
+``/trend``         sales per ``grain`` (Day, Week, Month, Quarter; default
+                   Month) bucket, one column per ``dim`` value (default
+                   Total), optionally within ``start`` / ``end`` dates
+``/forecast``      per-series forecast; ``dim`` (default Total), ``months``
+                   (1 to ``MAX_FORECAST_MONTHS``, default 6),
+                   ``interval=bootstrap|sigma`` (the band), ``grain``
+=================  ==========================================================
+
+Several server processes can share one cube: ``python query.py publish``
+builds it once and publishes it next to the store (``--watch`` keeps
+folding in appended orders and republishing).  :func:`load_cube` then
+attaches every other process to the published files read-only instead of
+aggregating the store again.
+"""
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import ab_test
+import datastore
+import parallel
+import timeseries
+from cube import SalesCube
+from forecast import INTERVALS, forecast_many
+from ranking import Ranking
+from section_cache import SectionCache, canonical_key
+from text_index import SubstringIndex
+from timeseries import GRAINS
+
+FILTERS = ('year', 'category', 'segment', 'region', 'state', 'city')
+
+# Dimensions offered for A/B groups, and for forecast and trend breakdowns.
+AB_DIMS       = ('Region', 'Category', 'Sub-Category', 'Segment', 'Ship Mode', 'State')
+FORECAST_DIMS = ('Total', 'Category', 'Region', 'Segment', 'Sub-Category', 'State')
+
+# Longest forecast horizon the HTTP route accepts; bootstrap paths grow with it.
+MAX_FORECAST_MONTHS = 24
+
+# Section computations :meth:`QueryEngine.prefetch` runs at once, per engine.
+PREFETCH_WORKERS = 8
+
+# City table: sort columns, and rows per page of :meth:`QueryEngine.city_page`.
+CITY_SORTS     = ('Total Sales', 'Orders', 'Customers', 'Avg Order', 'City', 'State')
+CITY_PAGE_ROWS = 50
+_CITY_COUNTED  = ('Orders', 'Customers', 'Avg Order')
+
+# Rollups of :meth:`QueryEngine.metrics` that :meth:`QueryEngine.rankings` ranks.
+RANKED = ('by_state', 'by_category', 'by_sub_category', 'by_region', 'by_segment',
+          'by_city', 'region_segment')
+
+
+def labels(frame):
+    """Categorical group keys back to plain labels (small aggregates only)."""
+    cat_cols = frame.select_dtypes('category').columns
+    return frame.astype({c: object for c in cat_cols}) if len(cat_cols) else frame
+
+
+def selections(filters):
+    """``(base, full)`` cube selections for a filter dict.
+
+    ``base`` is year / category / segment only, which the region cards and
+    the map use so that every region and state stays visible.
+    """
+    f = {k: list(v) if isinstance(v, (list, tuple, set)) else ([v] if v else [])
+         for k, v in (filters or {}).items()}
+    base = {'Year': f.get('year', []), 'Category': f.get('category', []),
+            'Segment': f.get('segment', [])}
+    return base, dict(base, Region=f.get('region', []), State=f.get('state', []),
+                      City=f.get('city', []))
+
+
+# ── Shared cube ───────────────────────────────────────────────────────────────
+SHARED_POINTER = 'shared_cube.json'
+
+
+def publish_cube(cube, store_dir=datastore.STORE_DIR):
+    """Publish ``cube`` for other processes to :func:`attach_cube`.
+
+    Each generation goes to its own directory and a pointer file is swapped
+    atomically, so an attaching process never reads a half-written cube.
+    The previous generation is kept for processes attaching right now.
+    """
+    name = f'cube{cube.generation:06d}'
+    cube.publish(os.path.join(store_dir, name))
+    source, _ = datastore.store_state(store_dir)
+    pointer = os.path.join(store_dir, SHARED_POINTER)
+    with open(pointer + '.tmp', 'w') as fh:
+        json.dump({'dir': name, 'generation': cube.generation, 'source': source}, fh)
+    previous = _read_pointer(store_dir)
+    os.replace(pointer + '.tmp', pointer)
+    keep = {name, previous and previous['dir']}
+    for path in glob.glob(os.path.join(store_dir, 'cube[0-9]*')):
+        if os.path.basename(path) not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _read_pointer(store_dir):
+    try:
+        with open(os.path.join(store_dir, SHARED_POINTER)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def attach_cube(store_dir=datastore.STORE_DIR):
+    """The published cube, if it was built from the store's current rows."""
+    pointer = _read_pointer(store_dir)
+    state   = datastore.store_state(store_dir)
+    if not pointer or not state or pointer['source'] != state[0] or pointer['generation'] > state[1]:
+        return None
+    try:
+        return SalesCube.attach(os.path.join(store_dir, pointer['dir']))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_cube(csv_path=datastore.SOURCE_CSV, memory_mb=datastore.MEMORY_BUDGET_MB, shared=True):
+    """``(cube, load report)`` for ``csv_path``'s store.
+
+    With ``shared`` a published cube matching the store is attached rather
+    than built; the report then says so.  With a memory budget the CSV is
+    ingested in chunks and the cube built one store block at a time; the
+    report then holds the ingest and cube-build peaks.  Otherwise the
+    report is None.
+    """
+    if shared and datastore.is_fresh(csv_path):
+        t0   = time.perf_counter()
+        cube = attach_cube()
+        if cube is not None:
+            return cube, {'attached': cube.generation, 'attach_ms': (time.perf_counter() - t0) * 1000}
+    if not memory_mb:
+        return SalesCube(datastore.load(csv_path)), None
+    datastore.ensure_store(csv_path, memory_mb=memory_mb)
+    cube, peak = datastore.traced_peak(SalesCube.from_frames, datastore.iter_frames())
+    return cube, dict(datastore.ingest_report() or {}, cube_peak_bytes=peak)
+
+
+class QueryEngine:
+    def __init__(self, cube, maxsize=512, workers=PREFETCH_WORKERS):
+        self.cube  = cube
+        self.cache = SectionCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sections')
+
+    def refresh(self, read_since):
+        """Fold appended orders into the cube (see ``SalesCube.catch_up``).
+
+        A changed cube starts a fresh cache, so no result computed before
+        the append is served after it.
+        """
+        with self._lock:
+            if self.cube.catch_up(read_since):
+                self.cache = SectionCache(maxsize=self.cache.maxsize)
+
+    def _get(self, section, key, compute):
+        return self.cache.get(section, key, compute)
+
+    def prefetch(self, calls):
+        """Start ``calls`` (zero-argument callables over this engine) in the background.
+
+        Their results land in the section cache: whoever makes the same call
+        later gets the cached result, or waits for the one still in flight.
+        A call that raises is simply not cached, so the error resurfaces when
+        the call is repeated.  Returns the futures.
+        """
+        return [self._pool.submit(call) for call in calls]
+
+    # ── selections ───────────────────────────────────────────────────────────
+    # The year / category / segment selection is resolved once into an array
+    # of cell positions.  The full selection narrows that array rather than
+    # querying the index again, and both are shared by every section keyed on
+    # them; only :meth:`cells` materialises the (small) cell frame, once.
+    def base_rows(self, filters):
+        """Cell positions matching the year / category / segment filters."""
+        base, _ = selections(filters)
+        return self._get('rows', canonical_key(base), lambda: self.cube.rows(base))
+
+    def rows(self, filters):
+        """Cell positions matching every filter, derived from :meth:`base_rows`."""
+        base, full = selections(filters)
+        within = self.base_rows(filters)
+        extra  = {k: v for k, v in full.items() if k not in base and v}
+        if not extra:
+            return within
+        return self._get('rows', canonical_key(full), lambda: self.cube.rows(extra, within=within))
+
+    def cells(self, filters, base=False):
+        """Cube cells matching ``filters`` (only year/category/segment if ``base``)."""
+        key = self._key(filters, base)
+        return self._get('cells', key, lambda: self.cube.take(
+            self.base_rows(filters) if base else self.rows(filters)))
+
+    def _key(self, filters, base=False):
+        return canonical_key(selections(filters)[0 if base else 1])
+
+    def _mode(self, mode):
+        return mode or self.cube.distinct_mode
+
+    # ── sections ─────────────────────────────────────────────────────────────
+    def metrics(self, filters, mode=None):
+        """Totals plus the sales rollups behind the KPI row and charts."""
+        mode  = self._mode(mode)
+        cells = self.cells(filters)
+        cube  = self.cube
+
+        def compute():
+            total_sales  = cells['Sales'].sum()
+            total_orders = cube.distinct(cells, 'Order ID', mode=mode)
+            return {
+                'total_sales':      total_sales,
+                'total_orders':     total_orders,
+                'avg_order':        total_sales / total_orders if total_orders else 0,
+                'by_state':         cube.rollup(cells, ['State', 'State Code']),
+                'by_category':      cube.rollup(cells, 'Category'),
+                'by_sub_category':  cube.rollup(cells, 'Sub-Category'),
+                'by_region':        cube.rollup(cells, 'Region'),
+                'by_segment':       cube.rollup(cells, 'Segment'),
+                'by_city':          cube.rollup(cells, 'City'),
+                'region_segment':   cube.rollup(cells, ['Region', 'Segment']).pipe(labels),
+                'category_segment': cube.rollup(cells, ['Category', 'Segment']).pipe(labels),
+            }
+        return self._get('metrics', (self._key(filters), mode), compute)
+
+    def rankings(self, filters, mode=None):
+        """``{rollup: Ranking}`` over the sales rollups of :meth:`metrics` (see ``RANKED``)."""
+        mode    = self._mode(mode)
+        metrics = self.metrics(filters, mode)
+        return self._get('rankings', (self._key(filters), mode), lambda: {
+            name: Ranking(metrics[name]) for name in RANKED})
+
+    def region_cards(self, filters, mode=None):
+        """Sales and orders per region under the year/category/segment filters."""
+        mode  = self._mode(mode)
+        cells = self.cells(filters, base=True)
+        return self._get('region_cards', (self._key(filters, base=True), mode), lambda: pd.DataFrame({
+            'Sales':  self.cube.totals(cells, 'Region'),
+            'Orders': self.cube.distinct(cells, 'Order ID', by=['Region'], mode=mode),
+        }).reset_index().sort_values('Sales', ascending=False).reset_index(drop=True))
+
+    def map_data(self, filters):
+        """Sales and share per state under the year/category/segment filters."""
+        cells = self.cells(filters, base=True)
+
+        def compute():
+            states = self.cube.rollup(cells, ['State', 'State Code'])
+            states['Share'] = states['Sales'] / states['Sales'].sum() * 100
+            return states
+        return self._get('map_data', self._key(filters, base=True), compute)
+
+    def map_ranking(self, filters):
+        """A :class:`ranking.Ranking` of :meth:`map_data`."""
+        states = self.map_data(filters)
+        return self._get('map_ranking', self._key(filters, base=True), lambda: Ranking(states))
+
+    def region_states(self, filters):
+        """States with sales in each region under the year/category/segment filters."""
+        cells = self.cells(filters, base=True)
+        return self._get('region_states', self._key(filters, base=True), lambda: {
+            region: sorted(states)
+            for region, states in cells.groupby('Region', observed=True)['State'].unique().items()})
+
+    def state_summary(self, filters, mode=None):
+        """Inputs of the map insight banner, from the filtered state rollup."""
+        states = self.rankings(filters, mode)['by_state']
+        return self._get('insight_banner', self._key(filters), lambda: {
+            'active_states':    states.count_above(0),
+            'top5':             states.top(5),
+            'bottom':           states.weakest(),
+            'avg_state_sales':  states.mean,
+            'above_avg_states': states.count_above(),
+        })
+
+    # ── city table ───────────────────────────────────────────────────────────
+    # Sales per city are cheap and give the default order; distinct orders and
+    # customers take a pass over the ID sets, so a page only counts them for
+    # its own cities.  Only sorting by a count column counts every city (once
+    # per filter state).  The order for each sort column and search is built
+    # the first time it is asked for, by top-K selection rather than a full
+    # sort (see ranking.py).
+    def city_table(self, filters, mode=None):
+        """Sales, orders, customers and average order per city, best first."""
+        return self.city_page(filters, mode, stop=None)[0]
+
+    def city_page(self, filters, mode=None, sort='Total Sales', ascending=False,
+                  start=0, stop=CITY_PAGE_ROWS, search=''):
+        """``(page, matches)``: rows ``start:stop`` of the city table, and how many cities match.
+
+        Rows are in ``sort`` order (one of ``CITY_SORTS``) and numbered from
+        ``start + 1``; ``stop=None`` means to the end.  ``search`` keeps the
+        cities whose city or state name contains it, ignoring case.
+        """
+        if sort not in CITY_SORTS:
+            raise ValueError(f'sort must be one of {list(CITY_SORTS)}')
+        mode   = self._mode(mode)
+        search = search.strip().casefold()
+        order  = self._city_order(filters, mode, sort, search)
+        stop   = len(order) if stop is None else min(stop, len(order))
+        key = canonical_key(self._key(filters), mode=mode, sort=sort, ascending=bool(ascending),
+                            start=start, stop=stop, search=search)
+
+        def compute():
+            cities, _ = self._city_sales(filters)
+            ranked = order.bottom(stop) if ascending else order.top(stop)
+            rows = ranked['row'].to_numpy()[start:]
+            if sort in _CITY_COUNTED:
+                counts = {k: v[rows] for k, v in self._city_counts(filters, mode).items()}
+            else:
+                on_page = np.sort(rows)
+                counts  = {k: v[np.searchsorted(on_page, rows)]
+                           for k, v in self._city_counts(filters, mode, on_page).items()}
+            page = cities.iloc[rows][['State', 'City', 'Total Sales']].assign(
+                Orders=counts['Orders'], Customers=counts['Customers'])
+            page['Avg Order'] = page['Total Sales'] / page['Orders']
+            page.index = pd.RangeIndex(start + 1, start + 1 + len(page))
+            return page
+        return self._get('city_page', key, compute), len(order)
+
+    def _city_sales(self, filters):
+        """``(cities, groups)``: City / State / Total Sales per city, and each cell's city row."""
+        cells = self.cells(filters)
+
+        def compute():
+            groups, keys = parallel.group_index(cells, ['City', 'State'])
+            sales = parallel.group_sum(groups, len(keys), cells['Sales'].to_numpy())
+            return keys.to_frame(index=False).assign(**{'Total Sales': sales}), groups
+        return self._get('city_sales', self._key(filters), compute)
+
+    def _city_counts(self, filters, mode, rows=None):
+        """``{'Orders', 'Customers'}`` arrays for sorted city rows ``rows`` (all if None)."""
+        if rows is None:
+            return self._get('city_counts', (self._key(filters), mode),
+                             lambda: self._city_counts(filters, mode, slice(None)))
+        cells = self.cells(filters)
+        if not isinstance(rows, slice):
+            cells = cells[np.isin(self._city_sales(filters)[1], rows)]
+        # Both keep city-row order: the rows' groups are numbered in key order too.
+        return {name: np.asarray(self.cube.distinct(cells, id_col, by=['City', 'State'], mode=mode))
+                for id_col, name in (('Order ID', 'Orders'), ('Customer ID', 'Customers'))}
+
+    def _city_order(self, filters, mode, sort, search):
+        """A :class:`ranking.Ranking` of the city rows matching ``search`` by ``sort``."""
+        def compute():
+            cities, _ = self._city_sales(filters)
+            rows = self._city_search(filters, search)
+            if sort in ('City', 'State'):
+                values = cities[sort].cat.codes.to_numpy()   # categories are sorted
+            elif sort in _CITY_COUNTED:
+                counts = self._city_counts(filters, mode)
+                values = (cities['Total Sales'].to_numpy() / counts['Orders']
+                          if sort == 'Avg Order' else counts[sort])
+            else:
+                values = cities[sort].to_numpy()
+            return Ranking(pd.DataFrame({'row': rows, 'key': values[rows]}), value='key')
+        return self._get('city_order', (self._key(filters), mode if sort in _CITY_COUNTED else None,
+                                        sort, search), compute)
+
+    def _city_search(self, filters, search):
+        """City rows whose city or state name contains ``search`` (casefolded)."""
+        cities, _ = self._city_sales(filters)
+        if not search:
+            return np.arange(len(cities))
+
+        def compute():
+            hits = np.zeros(len(cities), dtype=bool)
+            for col in ('City', 'State'):
+                labels = cities[col].cat.categories
+                index  = self._get('text_index', (col, len(labels)), lambda: SubstringIndex(labels))
+                hits  |= np.isin(cities[col].cat.codes.to_numpy(), index.find(search))
+            return np.flatnonzero(hits)
+        return self._get('city_search', (self._key(filters), search), compute)
+
+    # ── A/B comparison ───────────────────────────────────────────────────────
+    # Groups are ``(dim, value)`` or ``(dim, [values])`` pairs; see :mod:`ab_test`.
+    def _ab_key(self, filters, groups, mode):
+        # Group order matters (the first is the reference), the order of a
+        # group's values does not.
+        return canonical_key(self._key(filters), *({'dim': g[0], 'values': ab_test.values_of(g)}
+                                                   for g in groups), mode=mode)
+
+    def ab_compare(self, filters, groups, mode=None):
+        """Every group's stats, monthly sales and category breakdown (``ab_test.compare``)."""
+        mode = self._mode(mode)
+        cells = self.cells(filters)
+        return self._get('ab', self._ab_key(filters, groups, mode),
+                         lambda: ab_test.compare(self.cube, cells, groups, mode))
+
+    def ab_significance(self, filters, groups, mode=None):
+        """Bootstrap tests of every group against the first (``ab_test.significance``)."""
+        mode = self._mode(mode)
+        cells = self.cells(filters)
+        return self._get('ab_significance', self._ab_key(filters, groups, mode), lambda: (
+            ab_test.significance(cells, groups, self.ab_compare(filters, groups, mode)['stats'])))
+
+    def ab_stats(self, filters, a, b, mode=None):
+        """Headline stats of groups ``a`` and ``b``."""
+        return tuple(self.ab_compare(filters, (a, b), mode)['stats'])
+
+    def ab_category(self, filters, a, b, mode=None):
+        """Sales and order count per category for groups ``a`` and ``b``."""
+        return tuple(self.ab_compare(filters, (a, b), mode)['category'])
+
+    def ab_daily(self, filters, groups):
+        """Daily prefix sums of every group's sales, one column per group position."""
+        cells = self.cells(filters)
+
+        def compute():
+            group, pos = np.nonzero(ab_test.members(cells, groups))
+            return self.cube.daily.series(cells.index.to_numpy()[pos], group, list(range(len(groups))))
+        return self._get('ab_daily', self._ab_key(filters, groups, None), compute)
+
+    def ab_trend(self, filters, groups, grain='Month'):
+        """Date / Sales frame per group, one row per ``grain`` bucket of their shared span."""
+        table = self.ab_daily(filters, groups).resample(grain)
+        return tuple(pd.DataFrame({'Date': table.index, 'Sales': table[i].to_numpy()})
+                     for i in range(len(groups)))
+
+    # ── time series ──────────────────────────────────────────────────────────
+    # Each filter state and breakdown is turned into daily prefix sums once
+    # (see :mod:`timeseries`); every grain and date range is a resample of
+    # them, O(buckets), so those are not cached.
+    def daily(self, filters, dim='Total'):
+        """:class:`timeseries.DailySeries` of the selection, one column per ``dim`` value."""
+        rows = self.rows(filters)
+
+        def compute():
+            if dim == 'Total':
+                return self.cube.daily.series(rows)
+            groups, keys = parallel.group_index(self.cells(filters), dim)
+            return self.cube.daily.series(rows, groups, list(keys))
+        return self._get('daily', canonical_key(self._key(filters), dim=dim), compute)
+
+    def trend(self, filters, grain='Month', start=None, end=None):
+        """Date / Sales frame, one row per ``grain`` bucket within ``[start, end]``."""
+        table = self.daily(filters).resample(grain, start, end)
+        return pd.DataFrame({'Date': table.index, 'Sales': table['Total'].to_numpy()})
+
+    # ── forecast ─────────────────────────────────────────────────────────────
+    def forecast_history(self, filters, dim='Total', grain='Month'):
+        """Sales per ``grain`` bucket, one column per ``dim`` value (buckets without rows NaN)."""
+        return self.daily(filters, dim).resample(grain, missing=np.nan)
+
+    def forecast(self, filters, dim='Total', months=6, interval=INTERVALS[0], grain='Month'):
+        """``{series: (hist, forecast, (lower, upper))}``; every series fitted once.
+
+        The horizon is ``months`` months in ``grain`` buckets.  ``interval``
+        is one of ``forecast.INTERVALS``; bootstrap paths are cached per
+        series, so a new horizon reuses them.
+        """
+        history = self.forecast_history(filters, dim, grain)
+        return self._get('forecast', canonical_key(self._key(filters), dim=dim, months=months,
+                                                   interval=interval, grain=grain),
+                         lambda: forecast_many(history, timeseries.periods(months, grain),
+                                               interval=interval, grain=grain))
+
+
+# ── JSON ──────────────────────────────────────────────────────────────────────
+def to_jsonable(value):
+    """Frames, series and numpy scalars as plain JSON-ready Python values."""
+    if isinstance(value, pd.DataFrame):
+        return [{k: to_jsonable(v) for k, v in row.items()} for row in value.to_dict('records')]
+    if isinstance(value, pd.Series):
+        return {str(k.date() if isinstance(k, pd.Timestamp) else k): to_jsonable(v)
+                for k, v in value.items()}
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def _forecast_json(results):
+    out = {}
+    for name, (hist, fc, band) in results.items():
+        out[str(name)] = None if hist is None else {
+            'history': to_jsonable(hist), 'forecast': to_jsonable(fc),
+            'lower': to_jsonable(band[0]), 'upper': to_jsonable(band[1]),
+        }
+    return out
+
+
+def _parse(query):
+    params  = parse_qs(query)
+    filters = {k: params.get(k, []) for k in FILTERS}
+    filters['year'] = [int(y) for y in filters['year']]
+    one = {k: v[-1] for k, v in params.items() if k not in FILTERS}
+    return filters, one
+
+
+class UnknownRoute(Exception):
+    """Raised by :func:`answer` for a route it does not serve."""
+
+
+def answer(engine, route, query=''):
+    """JSON-ready answer for ``route`` with a query string of filters.
+
+    Raises :class:`UnknownRoute` for an unknown route and ValueError (or
+    KeyError) for bad parameters.
+    """
+    filters, p = _parse(query)
+    mode = p.get('mode')
+    if mode not in (None, 'exact', 'hll'):
+        raise ValueError(f'mode must be exact or hll, not {mode!r}')
+    if route == '/kpis':
+        return to_jsonable(engine.metrics(filters, mode))
+    if route == '/regions':
+        return to_jsonable(engine.region_cards(filters, mode))
+    if route == '/states':
+        return to_jsonable(engine.map_data(filters))
+    if route == '/state-summary':
+        return to_jsonable(engine.state_summary(filters, mode))
+    if route == '/cities':
+        if not {'sort', 'asc', 'start', 'stop', 'q'} & p.keys():
+            return to_jsonable(engine.city_table(filters, mode))
+        stop = p.get('stop')
+        page, matches = engine.city_page(filters, mode, p.get('sort', CITY_SORTS[0]), p.get('asc') == '1',
+                                         int(p.get('start', 0)), None if stop is None else int(stop),
+                                         p.get('q', ''))
+        return {'matches': matches, 'rows': to_jsonable(page)}
+    if route == '/ab':
+        specs = parse_qs(query).get('group')
+        if specs:
+            groups = [(dim, values.split('|')) for dim, _, values in (s.partition(':') for s in specs)]
+        else:
+            groups = [(p.get('dim_a'), p.get('val_a')), (p.get('dim_b'), p.get('val_b'))]
+        for dim, _ in groups:
+            if dim not in AB_DIMS:
+                raise ValueError(f'group dimensions must be among {list(AB_DIMS)}')
+        result = engine.ab_compare(filters, groups, mode)
+        tests  = engine.ab_significance(filters, groups, mode)
+        out = [dict(s, monthly=m, category=c, significance=t) for s, m, c, t in zip(
+            result['stats'], result['monthly'], result['category'], tests)]
+        return to_jsonable({'groups': out} if specs else {'a': out[0], 'b': out[1]})
+    if route in ('/trend', '/forecast'):
+        dim, grain = p.get('dim', 'Total'), p.get('grain', 'Month')
+        if dim not in FORECAST_DIMS:
+            raise ValueError(f'dim must be one of {list(FORECAST_DIMS)}')
+        if grain not in GRAINS:
+            raise ValueError(f'grain must be one of {list(GRAINS)}')
+    if route == '/trend':
+        table = engine.daily(filters, dim).resample(grain, p.get('start'), p.get('end'))
+        return [dict(Date=str(day.date()), **to_jsonable(row)) for day, row in table.iterrows()]
+    if route == '/forecast':
+        interval, months = p.get('interval', INTERVALS[0]), int(p.get('months', 6))
+        if interval not in INTERVALS:
+            raise ValueError(f'interval must be one of {list(INTERVALS)}')
+        if not 1 <= months <= MAX_FORECAST_MONTHS:
+            raise ValueError(f'months must be between 1 and {MAX_FORECAST_MONTHS}')
+        return _forecast_json(engine.forecast(filters, dim, months, interval, grain))
+    raise UnknownRoute(route)
+
+
+def _http_key(url):
+    """Cache key of a request: filters as sets, ``group`` parameters in order.
+
+    The first A/B group is the reference of the significance tests, so
+    reordering groups changes the answer and must not share its entry.
+    """
+    params = parse_qs(url.query)
+    groups = tuple(params.pop('group', ()))
+    return canonical_key(url.path, params), groups
+
+
+def make_server(engine, host='127.0.0.1', port=8765, read_since=None):
+    """Threaded HTTP server answering :func:`answer` as JSON.
+
+    Encoded responses are cached per request URL, so repeated queries skip
+    both the computation and the JSON encoding.  ``read_since`` (e.g.
+    ``datastore.read_segments``) folds appended orders in before each
+    request.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if read_since is not None:
+                engine.refresh(read_since)
+            try:
+                body = engine.cache.get('http', _http_key(url), lambda: json.dumps(
+                    answer(engine, url.path, url.query)).encode())
+                status = 200
+            except UnknownRoute:
+                body, status = json.dumps({'error': f'unknown route {url.path}'}).encode(), 404
+            except (ValueError, KeyError) as exc:
+                body, status = json.dumps({'error': str(exc)}).encode(), 400
+            except Exception as exc:
+                body, status = json.dumps({'error': f'internal error ({type(exc).__name__})'}).encode(), 500
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads     = True
+        request_queue_size = 128
+
+    return Server((host, port), Handler)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    serve = sub.add_parser('serve', help='serve the query engine over HTTP/JSON')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    publish = sub.add_parser('publish', help='build the cube once and share it with other processes')
+    publish.add_argument('--watch', type=float, metavar='SECONDS',
+                         help='keep folding in appended orders and republishing')
+    args = parser.parse_args()
+
+    try:
+        if args.cmd == 'publish':
+            cube, _ = load_cube(shared=False)
+            publish_cube(cube)
+            print(f'published cube generation {cube.generation}')
+            while args.watch:
+                time.sleep(args.watch)
+                if cube.catch_up(datastore.read_segments):
+                    publish_cube(cube)
+                    print(f'published cube generation {cube.generation}')
+        elif args.cmd == 'serve':
+            engine = QueryEngine(load_cube()[0])
+            server = make_server(engine, args.host, args.port, read_since=datastore.read_segments)
+            print(f'serving http://{args.host}:{args.port}/ (Ctrl+C to stop)')
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,78 @@
+"""Leader / top-K / weakest / above-average queries over a rollup, without sorting it.
+
+The dashboard ranks the same few rollups over and over: the leading state,
+city, category, sub-category, region and segment, the top 10 states, the
+top 5 for the quick-select buttons and the insight banner, the weakest
+state and the above-average states behind ``geo_map_filter``.  A
+:class:`Ranking` selects the ``K`` largest and ``K`` smallest entries of a
+rollup once, in linear time (``np.argpartition``), and answers every one
+of those queries from them; only a request for more than ``K`` entries
+selects again.
+
+The engine keeps one ranking per rollup and filter state in its section
+cache (``QueryEngine.rankings``), so a rerun that changes no filter
+reuses them, and a changed filter ranks only the rollups it changed.
+Ties keep rollup order, as ``nlargest(keep='first')`` and a stable sort do.
+"""
+import numpy as np
+
+TOP_K = 10
+
+
+def _select(values, k, largest):
+    """Positions of the ``k`` largest (or smallest) ``values``, best first."""
+    n = len(values)
+    k = min(k, n)
+    if not k:
+        return np.empty(0, dtype=np.int64)
+    keyed = -values if largest else values
+    pick = np.arange(n) if k == n else np.argpartition(keyed, k - 1)[:k]
+    if k < n:
+        # Entries tied with the k-th may fall either side of the partition;
+        # take all of them and let the position tie-break decide.
+        pick = np.flatnonzero(keyed <= keyed[pick].max())
+    order = np.lexsort((pick, keyed[pick]))
+    return pick[order][:k]
+
+
+class Ranking:
+    """Order statistics of ``frame[value]`` (NaN ranks last either way)."""
+
+    def __init__(self, frame, value='Sales', k=TOP_K):
+        self.frame  = frame
+        self.value  = value
+        self.k      = k
+        self.values = frame[value].to_numpy(dtype=np.float64)
+        self.mean   = float(np.nanmean(self.values)) if len(self.values) else np.nan
+        self._high  = np.nan_to_num(self.values, nan=-np.inf)
+        self._low   = np.nan_to_num(self.values, nan=np.inf)
+        self._top    = _select(self._high, k, largest=True)
+        self._bottom = _select(self._low, k, largest=False)
+
+    def __len__(self):
+        return len(self.values)
+
+    def top(self, k=5):
+        """The ``k`` largest rows, largest first."""
+        rows = self._top if k <= self.k else _select(self._high, k, largest=True)
+        return self.frame.iloc[rows[:k]]
+
+    def bottom(self, k=5):
+        """The ``k`` smallest rows, smallest first."""
+        rows = self._bottom if k <= self.k else _select(self._low, k, largest=False)
+        return self.frame.iloc[rows[:k]]
+
+    def leader(self):
+        """The largest row (a Series)."""
+        return self.frame.iloc[self._top[0]]
+
+    def weakest(self):
+        """The smallest row (a Series)."""
+        return self.frame.iloc[self._bottom[0]]
+
+    def above(self, threshold=None):
+        """Rows above ``threshold`` (default: the mean), in rollup order."""
+        return self.frame[self.values > (self.mean if threshold is None else threshold)]
+
+    def count_above(self, threshold=None):
+        return int(np.count_nonzero(self.values > (self.mean if threshold is None else threshold)))
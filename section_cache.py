@@ -0,0 +1,92 @@
+"""Bounded LRU cache for the dashboard's derived section data.
+
+Streamlit reruns the whole script on every widget interaction.  Each section
+stores what it derives from the cube under ``(section, key)``, where the key
+is built by :func:`canonical_key` from only the inputs that section reads, so
+a click on a widget that does not feed a section costs one dictionary lookup
+for it.  One cache is shared by all sessions of a process; cached values must
+be treated as read-only.
+
+Each key is computed once at a time: a caller that misses on a key another
+thread is already computing waits for that result instead of computing it
+again, so sections can be computed ahead, in parallel, by the same calls
+that later read them.
+"""
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+
+def _norm(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return tuple(sorted((k, _norm(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        # Filter lists are sets: selection order must not split the cache.
+        return tuple(sorted({_norm(v) for v in value}, key=repr))
+    return value
+
+
+def canonical_key(*parts, **named):
+    """Hashable, order-insensitive key for a section's inputs."""
+    return tuple(_norm(p) for p in parts) + _norm(named)
+
+
+class SectionCache:
+    def __init__(self, maxsize=512):
+        self.maxsize  = maxsize
+        self._entries = OrderedDict()
+        self._lock    = threading.Lock()
+        self._hits    = Counter()
+        self._misses  = Counter()
+        self._pending = {}   # slot -> Event set once its computation ends
+
+    def get(self, section, key, compute):
+        """Cached ``compute()`` for ``(section, key)``; computes on a miss.
+
+        If another thread is computing the same slot, waits for it instead
+        (and computes after all if that computation raised).
+        """
+        slot = (section, key)
+        while True:
+            with self._lock:
+                if slot in self._entries:
+                    self._entries.move_to_end(slot)
+                    self._hits[section] += 1
+                    return self._entries[slot]
+                done = self._pending.get(slot)
+                if done is None:
+                    done = self._pending[slot] = threading.Event()
+                    self._misses[section] += 1
+                    break
+            done.wait()
+        # Computed outside the lock so one slow section never blocks other
+        # sections or sessions.
+        try:
+            value = compute()
+            with self._lock:
+                self._entries[slot] = value
+                self._entries.move_to_end(slot)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._pending[slot]
+            done.set()
+        return value
+
+    def stats(self):
+        """Per-section ``{'hits', 'misses', 'entries'}`` counters."""
+        with self._lock:
+            entries  = Counter(section for section, _ in self._entries)
+            sections = sorted(set(self._hits) | set(self._misses) | set(entries))
+            return {s: {'hits': self._hits[s], 'misses': self._misses[s], 'entries': entries[s]}
+                    for s in sections}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hits.clear()
+            self._misses.clear()
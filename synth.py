@@ -0,0 +1,280 @@
+"""Synthetic Superstore orders, learned from ``cleaned_train.csv``, at any scale.
+
+:meth:`SuperstoreModel.fit` learns from the bundled export:
+
+* where orders ship to: the joint Region / State / City / Postal Code
+  frequencies (so the geographic hierarchy always holds);
+* what they contain: the number of lines per order, and per line the joint
+  Category / Sub-Category / Product frequencies;
+* how they ship: the Ship Mode mix and, per ship mode, the order-to-ship
+  gap in days;
+* when they are placed: the order-date frequencies;
+* who places them: the Segment mix and the customer names;
+* what they cost: a log-normal sales amount per sub-category.
+
+Customers are synthetic too (one per ``ROWS_PER_CUSTOMER`` rows, as in the
+source), so distinct-customer counts grow with the data.
+
+Rows are generated in blocks of ``BLOCK_ROWS``.  Each block draws from its
+own generator, seeded by ``(seed, block)``, so the output depends only on
+the seed and the row count, never on the number of workers.  Blocks are
+built in parallel and streamed out in order, to a CSV file or straight into
+a columnar store (see :func:`datastore.build_store_from_frames`); memory
+stays bounded by a few blocks per worker.
+
+Usage::
+
+    python synth.py csv   big.csv --rows 100000000 --workers 16
+    python synth.py store .store_big --rows 10000000 --seed 1
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import datastore
+
+BLOCK_ROWS = 250_000
+ROWS_PER_CUSTOMER = 12
+DEFAULT_SEED = 0
+
+_LOCATION = ['Country', 'City', 'State', 'Postal Code', 'Region']
+_PRODUCT  = ['Product ID', 'Category', 'Sub-Category', 'Product Name']
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(x):
+    """splitmix64 of a uint64 array: a cheap, stateless per-key hash."""
+    with np.errstate(over='ignore'):
+        z = x * _GOLDEN + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _table(frame, columns):
+    """Distinct rows of ``columns`` and their cumulative frequencies."""
+    counts = frame.groupby(columns, observed=True, sort=True).size()
+    return counts.index.to_frame(index=False), np.cumsum(counts.to_numpy()) / counts.sum()
+
+
+def _pick(cdf, u):
+    return np.minimum(np.searchsorted(cdf, u, side='right'), len(cdf) - 1)
+
+
+class SuperstoreModel:
+    """Column distributions of a Superstore export (see the module docstring)."""
+
+    def __init__(self, columns, locations, products, lines, ship_modes, gaps, dates,
+                 segments, names, sales):
+        self.columns    = columns
+        self.locations  = locations     # (frame, cdf), per order
+        self.products   = products      # (frame, cdf), per line
+        self.lines      = lines         # (values, cdf) of lines per order
+        self.ship_modes = ship_modes    # (values, cdf), per order
+        self.gaps       = gaps          # ship mode -> (days, cdf)
+        self.dates      = dates         # (datetime64 values, cdf), per order
+        self.segments   = segments      # (values, cdf), per customer
+        self.names      = names         # customer names
+        self.sales      = sales         # sub-category -> (mu, sigma) of log sales
+
+    @classmethod
+    def fit(cls, df):
+        orders = df.drop_duplicates('Order ID')
+        order_date = pd.to_datetime(orders['Order Date'])
+        gap_days = (pd.to_datetime(orders['Ship Date']) - order_date).dt.days
+        customers = df.drop_duplicates('Customer ID')
+
+        def values(series):
+            counts = series.value_counts().sort_index()
+            return counts.index.to_numpy(), np.cumsum(counts.to_numpy()) / counts.sum()
+
+        log_sales = np.log(df['Sales'].clip(lower=0.01))
+        sales = log_sales.groupby(df['Sub-Category']).agg(['mean', 'std']).fillna(0)
+        return cls(
+            columns    = list(df.columns),
+            locations  = _table(orders, _LOCATION),
+            products   = _table(df, _PRODUCT),
+            lines      = values(df.groupby('Order ID').size()),
+            ship_modes = values(orders['Ship Mode']),
+            gaps       = {mode: values(g) for mode, g in gap_days.groupby(orders['Ship Mode'])},
+            dates      = values(order_date),
+            segments   = values(customers['Segment']),
+            names      = customers['Customer Name'].to_numpy(dtype=object),
+            sales      = {k: (float(r['mean']), float(r['std'])) for k, r in sales.iterrows()},
+        )
+
+    # ── generation ───────────────────────────────────────────────────────────
+    def customers(self, ids, seed):
+        """``(Customer ID, Customer Name, Segment)`` arrays for customer numbers ``ids``."""
+        h = _mix(ids.astype(np.uint64) ^ _mix(np.full(len(ids), seed, dtype=np.uint64)))
+        which = (h % np.uint64(len(self.names))).astype(np.int64)
+        u     = (h >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+        segment = self.segments[0][_pick(self.segments[1], u)]
+        initials = np.array([(p[0][0] + p[-1][0]).upper() for p in map(str.split, self.names)], dtype=object)
+        cid = initials[which] + '-' + (ids + 10000).astype(str).astype(object)
+        return cid, self.names[which], segment
+
+    def block(self, block, rows, n_customers, seed=DEFAULT_SEED):
+        """The ``block``-th block of ``rows`` rows, as ``pd.read_csv`` would return it."""
+        rng = np.random.default_rng([seed, block])
+        first_row = block * BLOCK_ROWS
+
+        # Orders, until they have at least ``rows`` lines; the last is cut short.
+        n_orders = int(rows / np.average(self.lines[0], weights=np.diff(self.lines[1], prepend=0))) + 16
+        while True:
+            lines = self.lines[0][_pick(self.lines[1], rng.random(n_orders))]
+            if lines.sum() >= rows:
+                break
+            n_orders *= 2
+        n_orders = int(np.searchsorted(np.cumsum(lines), rows) + 1)
+        lines = lines[:n_orders]
+        lines[-1] -= lines.sum() - rows
+
+        dates = self.dates[0][_pick(self.dates[1], rng.random(n_orders))]
+        modes = self.ship_modes[0][_pick(self.ship_modes[1], rng.random(n_orders))]
+        gap = np.zeros(n_orders, dtype=np.int64)
+        for mode, (days, cdf) in self.gaps.items():
+            at = np.flatnonzero(modes == mode)
+            gap[at] = days[_pick(cdf, rng.random(len(at)))]
+        ship = dates + gap.astype('timedelta64[D]')
+        location = self.locations[0].iloc[_pick(self.locations[1], rng.random(n_orders))]
+        cust = rng.integers(0, n_customers, n_orders)
+        cid, cname, segment = self.customers(cust, seed)
+        order_no = first_row + np.arange(n_orders)
+        years = dates.astype('datetime64[Y]').astype(int) + 1970
+        order_id = ('CA-' + pd.Series(years).astype(str) + '-'
+                    + pd.Series(order_no + 100000).astype(str)).to_numpy(dtype=object)
+
+        # Lines: order attributes repeated, product and sales drawn per line.
+        of = np.repeat(np.arange(n_orders), lines)
+        product = self.products[0].iloc[_pick(self.products[1], rng.random(rows))]
+        sub = product['Sub-Category'].to_numpy()
+        mu    = pd.Series(sub).map({k: v[0] for k, v in self.sales.items()}).to_numpy()
+        sigma = pd.Series(sub).map({k: v[1] for k, v in self.sales.items()}).to_numpy()
+        sales = np.round(np.exp(mu + sigma * rng.standard_normal(rows)), 2)
+
+        out = pd.DataFrame({
+            'Row ID':        first_row + np.arange(1, rows + 1),
+            'Order ID':      order_id[of],
+            'Order Date':    np.datetime_as_string(dates[of], unit='D'),
+            'Ship Date':     np.datetime_as_string(ship[of], unit='D'),
+            'Ship Mode':     modes[of],
+            'Customer ID':   cid[of],
+            'Customer Name': cname[of],
+            'Segment':       segment[of],
+            **{c: location[c].to_numpy()[of] for c in _LOCATION},
+            **{c: product[c].to_numpy() for c in _PRODUCT},
+            'Sales':         sales,
+        })
+        return out[self.columns]
+
+
+def fit(csv_path=datastore.SOURCE_CSV):
+    return SuperstoreModel.fit(pd.read_csv(csv_path))
+
+
+# ── parallel streaming ───────────────────────────────────────────────────────
+def _blocks(rows):
+    n = -(-rows // BLOCK_ROWS)
+    return [(b, min(BLOCK_ROWS, rows - b * BLOCK_ROWS)) for b in range(n)]
+
+
+def _customers_for(rows):
+    return max(rows // ROWS_PER_CUSTOMER, 1)
+
+
+_worker_model = None
+
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+
+def _frame(args):
+    block, rows, n_customers, seed = args
+    return _worker_model.block(block, rows, n_customers, seed)
+
+
+def _csv_part(args):
+    block, rows, n_customers, seed, part_dir = args
+    path = os.path.join(part_dir, f'part{block:06d}.csv')
+    _worker_model.block(block, rows, n_customers, seed).to_csv(path, header=block == 0, index=False)
+    return path
+
+
+def _ordered(model, workers, fn, jobs):
+    """``fn(job)`` for every job, in order, with at most two jobs per worker in flight."""
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model,)) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.submit(fn, job))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_csv(path, rows, seed=DEFAULT_SEED, workers=None, model=None):
+    """Write ``rows`` synthetic rows to ``path``; blocks are built in parallel."""
+    model = model or fit()
+    n_customers = _customers_for(rows)
+    part_dir = tempfile.mkdtemp(prefix='synth-', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with open(path + '.tmp', 'wb') as out:
+            jobs = [(b, n, n_customers, seed, part_dir) for b, n in _blocks(rows)]
+            for part in _ordered(model, workers, _csv_part, jobs):
+                with open(part, 'rb') as fh:
+                    shutil.copyfileobj(fh, out)
+                os.remove(part)
+        os.replace(path + '.tmp', path)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+    return path
+
+
+def iter_frames(rows, seed=DEFAULT_SEED, workers=None, model=None):
+    """The synthetic rows as block frames, in order; blocks are built in parallel."""
+    model = model or fit()
+    n_customers = _customers_for(rows)
+    yield from _ordered(model, workers, _frame, [(b, n, n_customers, seed) for b, n in _blocks(rows)])
+
+
+def write_store(store_dir, rows, seed=DEFAULT_SEED, workers=None, model=None):
+    """Write ``rows`` synthetic rows straight into a columnar store."""
+    params = {'generator': 'synth', 'rows': rows, 'seed': seed, 'block_rows': BLOCK_ROWS}
+    source = dict(params, path=None, size=None, mtime_ns=None,
+                  sha1=hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest())
+    return datastore.build_store_from_frames(iter_frames(rows, seed, workers, model), store_dir, source)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('format', choices=['csv', 'store'])
+    parser.add_argument('out', help='CSV file or store directory to write')
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--workers', type=int, default=None, help='default: one per core')
+    parser.add_argument('--source', default=datastore.SOURCE_CSV, help='CSV to learn from')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    model = fit(args.source)
+    if args.format == 'csv':
+        write_csv(args.out, args.rows, args.seed, args.workers, model)
+    else:
+        write_store(args.out, args.rows, args.seed, args.workers, model)
+    print(f'wrote {args.rows:,} rows to {args.out} in {time.perf_counter() - t0:.1f}s')
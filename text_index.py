@@ -0,0 +1,46 @@
+"""Case-insensitive substring search over a fixed list of labels.
+
+A trigram index maps every three-character sequence to the sorted positions
+of the labels containing it.  A query of three characters or more only
+checks the labels that contain all of its trigrams (the intersection of
+their posting lists), so a search over tens of thousands of city names
+touches a handful of them; shorter queries scan the labels.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _grams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SubstringIndex:
+    def __init__(self, labels):
+        self.labels = [str(label).casefold() for label in labels]
+        postings = defaultdict(list)
+        for i, label in enumerate(self.labels):
+            for gram in _grams(label):
+                postings[gram].append(i)
+        self._postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def find(self, query):
+        """Positions of the labels containing ``query``, ascending."""
+        query = query.casefold()
+        if not query:
+            return np.arange(len(self.labels))
+        if len(query) < 3:
+            candidates = range(len(self.labels))
+        else:
+            lists = sorted((self._postings.get(gram, _EMPTY) for gram in _grams(query)), key=len)
+            candidates = lists[0]
+            for ids in lists[1:]:
+                if not len(candidates):
+                    break
+                candidates = np.intersect1d(candidates, ids, assume_unique=True)
+        return np.array([i for i in candidates if query in self.labels[i]], dtype=np.int64)
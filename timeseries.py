@@ -0,0 +1,240 @@
+"""Daily sales per cube cell, resampled to any time grain on the fly.
+
+The cube's finest time dimension is the month.  :class:`DailySales` keeps,
+next to it, every cell's sales per day: days are integers (days since
+1970-01-01) and the ``(cell, day)`` pairs are one sorted array of
+``cell << 32 | day`` keys with their sales alongside, the layout
+:mod:`distinct` uses for ``(cell, id)`` pairs.  Each cell's days are a
+contiguous run, so a selection gathers its cells' runs and nothing else.
+Appended rows land in a small sorted side array (a pair may then be in
+both, its sales split between them), merged into the main one once it
+reaches 1/8 of its size.  As in :mod:`distinct`, appends build new arrays
+into a copy (:meth:`DailySales.added`) and never write the old ones.
+
+A selection (and optionally a grouping of it) is turned once into a
+:class:`DailySeries`: cumulative daily sales over the selection's date
+span, one column per group.  Any bucketing is then a difference of those
+prefix sums at the bucket edges, so day, week, month and quarter buckets
+and custom date ranges all cost O(buckets), however many cells and days
+feed them.  The query engine caches one series per filter state and
+dimension, so switching the grain re-reads nothing.
+"""
+import copy
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+GRAINS = ('Day', 'Week', 'Month', 'Quarter')
+
+# Per grain: pandas period frequency (weeks run Monday to Sunday), the
+# frequency of bucket starts, buckets per year, and seasonal slots for
+# forecasting (weekdays for days, calendar positions otherwise).
+_PERIOD    = {'Day': 'D', 'Week': 'W-SUN', 'Month': 'M', 'Quarter': 'Q'}
+STARTS     = {'Day': 'D', 'Week': 'W-MON', 'Month': 'MS', 'Quarter': 'QS'}
+PER_YEAR   = {'Day': 365, 'Week': 52, 'Month': 12, 'Quarter': 4}
+SEASONS    = {'Day': 7, 'Week': 52, 'Month': 12, 'Quarter': 4}
+
+_DAY_BITS = 32
+_DAY_MASK = (1 << _DAY_BITS) - 1
+
+
+def day_numbers(dates):
+    """Days since 1970-01-01 of datetime values."""
+    return np.asarray(dates, dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+
+
+def season(index, grain):
+    """Seasonal slot ``0..SEASONS[grain]`` of each bucket start in ``index``."""
+    index = pd.DatetimeIndex(index)
+    if grain == 'Day':
+        return index.dayofweek.to_numpy()
+    if grain == 'Week':
+        # The odd 53rd ISO week shares the 52nd's slot.
+        return np.minimum(index.isocalendar().week.to_numpy(dtype=np.int64), 52) - 1
+    if grain == 'Quarter':
+        return index.quarter.to_numpy() - 1
+    return index.month.to_numpy() - 1
+
+
+def periods(months, grain):
+    """Buckets of ``grain`` covering ``months`` months (at least one)."""
+    return max(1, int(np.ceil(months * PER_YEAR[grain] / 12)))
+
+
+def _check(grain):
+    if grain not in GRAINS:
+        raise ValueError(f'grain must be one of {list(GRAINS)}')
+
+
+def _summed(keys, sales):
+    """Sorted unique keys of the concatenated ``keys``, with their summed ``sales``."""
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights=np.concatenate(sales).astype(np.float64),
+                       minlength=len(keys))
+    return keys, sums
+
+
+class DailySeries:
+    """Prefix sums of daily sales over ``first .. first + len(prefix) - 2``.
+
+    ``prefix[i]`` holds, per column, the sales of the days before ``first +
+    i``; ``entries`` the same for the number of ``(cell, day)`` entries,
+    which tells a bucket with no sales from a bucket with no rows.
+    """
+
+    def __init__(self, first, prefix, entries, names):
+        self.first   = first
+        self.prefix  = prefix
+        self.entries = entries
+        self.names   = names
+
+    def __len__(self):
+        return len(self.prefix) - 1
+
+    @property
+    def start(self):
+        return pd.Timestamp(np.datetime64(self.first, 'D')) if len(self) else None
+
+    @property
+    def end(self):
+        return pd.Timestamp(np.datetime64(self.first + len(self) - 1, 'D')) if len(self) else None
+
+    def _edges(self, start, end):
+        """``(lo, hi)`` day numbers of ``[start, end]`` clipped to the span."""
+        lo = self.first if start is None else max(self.first, int(day_numbers([pd.Timestamp(start)])[0]))
+        hi = self.first + len(self) if end is None else min(self.first + len(self),
+                                                           int(day_numbers([pd.Timestamp(end)])[0]) + 1)
+        return lo, max(lo, hi)
+
+    def total(self, start=None, end=None):
+        """Sales per column over ``[start, end]`` (inclusive dates), as a Series."""
+        lo, hi = self._edges(start, end)
+        sums = self.prefix[hi - self.first] - self.prefix[lo - self.first]
+        return pd.Series(sums, index=self.names, name='Sales')
+
+    def resample(self, grain='Month', start=None, end=None, missing=0.0):
+        """Sales per ``grain`` bucket over ``[start, end]``, one column per group.
+
+        Indexed by bucket start (the first bucket may be cut short by
+        ``start``, the last by ``end``).  Buckets without any rows hold
+        ``missing``.
+        """
+        _check(grain)
+        lo, hi = self._edges(start, end)
+        if lo == hi:
+            return pd.DataFrame(index=pd.DatetimeIndex([], name='Date'), columns=self.names, dtype=float)
+        buckets = pd.period_range(np.datetime64(lo, 'D'), np.datetime64(hi - 1, 'D'), freq=_PERIOD[grain])
+        starts  = pd.DatetimeIndex(buckets.start_time, name='Date')
+        edges   = np.clip(np.append(day_numbers(starts), hi), lo, hi) - self.first
+        sums    = self.prefix[edges[1:]] - self.prefix[edges[:-1]]
+        if missing != 0:
+            sums = np.where(self.entries[edges[1:]] > self.entries[edges[:-1]], sums, missing)
+        return pd.DataFrame(sums, index=starts, columns=self.names)
+
+
+class DailySales:
+    """Per-cell daily sales sums.
+
+    ``cell_of_row`` maps every raw row to its cube cell, ``days`` are the
+    rows' :func:`day_numbers` and ``sales`` their sales.
+    """
+
+    def __init__(self, cell_of_row, days, sales):
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+        self._main, self._recent = empty, empty   # (sorted cell << 32 | day, sales)
+        self.add(cell_of_row, days, sales)
+
+    def added(self, cell_of_row, days, sales):
+        """A copy of the sums with rows folded in; this one is left as it is."""
+        daily = copy.copy(self)
+        daily.add(cell_of_row, days, sales)
+        return daily
+
+    def add(self, cell_of_row, days, sales):
+        """Fold rows in; existing cell positions must not have changed.
+
+        Arrays are replaced, never written in place.
+        """
+        keys = (np.asarray(cell_of_row, dtype=np.int64) << _DAY_BITS) | np.asarray(days, dtype=np.int64)
+        self._recent = _summed((self._recent[0], keys), (self._recent[1], sales))
+        if 8 * len(self._recent[0]) > len(self._main[0]):
+            self._main = _summed((self._main[0], self._recent[0]), (self._main[1], self._recent[1]))
+            self._recent = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    def _gather(self, rows):
+        """``(days, sales, owner)`` of every ``(cell, day)`` pair of cells ``rows``.
+
+        ``owner`` is the position in ``rows`` each pair belongs to (a cell
+        listed twice contributes its pairs twice).
+        """
+        days, sales, owner = [], [], []
+        for keys, values in (self._main, self._recent):
+            if not len(keys):
+                continue
+            starts  = np.searchsorted(keys, rows << _DAY_BITS)
+            lengths = np.searchsorted(keys, (rows + 1) << _DAY_BITS) - starts
+            total   = int(lengths.sum())
+            if not total:
+                continue
+            at = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths) + np.arange(total)
+            days.append(keys[at] & _DAY_MASK)
+            sales.append(values[at])
+            owner.append(np.repeat(np.arange(len(rows)), lengths))
+        if not days:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64)
+        return np.concatenate(days), np.concatenate(sales), np.concatenate(owner)
+
+    def series(self, rows, groups=None, names=('Total',)):
+        """:class:`DailySeries` of cells ``rows``, one column per name.
+
+        ``groups[i]`` is the column of ``rows[i]`` (-1 leaves it out); by
+        default every cell goes to the single column.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        n_groups = len(names)
+        days, sales, owner = self._gather(rows)
+        if groups is not None:
+            group = np.asarray(groups, dtype=np.int64)[owner]
+            days, sales, group = days[group >= 0], sales[group >= 0], group[group >= 0]
+        else:
+            group = np.zeros(len(days), dtype=np.int64)
+        if not len(days):
+            zeros = np.zeros((1, n_groups))
+            return DailySeries(0, zeros, zeros, names)
+        first = int(days.min())
+        n_days = int(days.max()) - first + 1
+        slot = (days - first) * n_groups + group
+        size = n_days * n_groups
+        prefix  = np.zeros((n_days + 1, n_groups))
+        entries = np.zeros((n_days + 1, n_groups))
+        prefix[1:]  = np.bincount(slot, weights=sales, minlength=size).reshape(n_days, n_groups).cumsum(axis=0)
+        entries[1:] = np.bincount(slot, minlength=size).reshape(n_days, n_groups).cumsum(axis=0)
+        return DailySeries(first, prefix, entries, names)
+
+    def nbytes(self):
+        return sum(a.nbytes for a in self._main + self._recent)
+
+    # ── sharing ──────────────────────────────────────────────────────────────
+    def save(self, path):
+        """Write the sums to directory ``path`` (created)."""
+        os.makedirs(path)
+        for name, (keys, sales) in (('main', self._main), ('recent', self._recent)):
+            np.save(os.path.join(path, name + '.keys.npy'), keys)
+            np.save(os.path.join(path, name + '.sales.npy'), sales)
+        with open(os.path.join(path, 'daily.json'), 'w') as fh:
+            json.dump({'day_bits': _DAY_BITS}, fh)
+
+    @classmethod
+    def attach(cls, path):
+        """Sums over the files written by :meth:`save`, memory-mapped copy-on-write."""
+        with open(os.path.join(path, 'daily.json')) as fh:
+            if json.load(fh)['day_bits'] != _DAY_BITS:
+                raise ValueError(f'{path} uses another key layout')
+        daily = cls.__new__(cls)
+        for name in ('main', 'recent'):
+            setattr(daily, '_' + name, tuple(
+                np.asarray(np.load(os.path.join(path, f'{name}.{part}.npy'), mmap_mode='c'))
+                for part in ('keys', 'sales')))
+        return daily